@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+下载目录的磁盘缓存
+把 DOWNLOAD_DIR 当作按字节数限制大小的 LRU 缓存：
+- 每个本子目录记录大小、最后访问时间、访问次数，保存在 manifest 文件中
+- 下载完整的本子再次被请求时直接从磁盘读取，不再访问禁漫
+- 总大小超过上限时按最后访问时间淘汰，正在下载/发送的本子被 pin 住，不会被淘汰
+只能在事件循环线程中调用
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = '.album_cache.json'
+TRASH_PREFIX = '.trash-'
+
+
+def dir_size(path: Path) -> int:
+    """目录下所有文件的总字节数"""
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class AlbumDiskCache:
+    """按字节数限制大小的本子目录 LRU 缓存"""
+
+    def __init__(self, root: Path, max_bytes: int):
+        """初始化
+
+        Args:
+            root: 下载目录，每个本子一个子目录 (root/<album_id>)
+            max_bytes: 缓存总大小上限 (字节)
+        """
+        self.root = root
+        self.root.mkdir(exist_ok=True, parents=True)
+        self.max_bytes = max_bytes
+        self.manifest_path = root / MANIFEST_NAME
+
+        # album_id -> {size, last_access, hits, complete, photo_ids, episodes}
+        self.entries: Dict[str, dict] = {}
+        # album_id -> 引用计数
+        self._pins: Dict[str, int] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._load()
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(entry['size'] for entry in self.entries.values())
+
+    def album_dir(self, album_id: str) -> Path:
+        return self.root / album_id
+
+    def stats(self) -> dict:
+        return {
+            'albums': len(self.entries),
+            'bytes': self.total_bytes,
+            'max_bytes': self.max_bytes,
+            'pinned': len(self._pins),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    # ============ 查询 ============
+
+    def lookup(self, album_id: str, episodes: Optional[List[str]] = None) -> Optional[dict]:
+        """查找完整下载过的本子
+
+        Args:
+            album_id: 漫画 ID
+            episodes: 当前的章节 ID 列表，与缓存时不一致（本子有更新）时视为未命中；为 None 时不校验
+
+        Returns:
+            命中时返回缓存条目（photo_ids 为 章节序号 -> 章节 ID），否则返回 None
+        """
+        entry = self.entries.get(album_id)
+        hit = (
+            entry is not None
+            and entry['complete']
+            and (episodes is None or entry['episodes'] == episodes)
+            and self.album_dir(album_id).is_dir()
+        )
+        if not hit:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        entry['hits'] += 1
+        entry['last_access'] = time.time()
+        self._save()
+        return entry
+
+    # ============ pin ============
+
+    def pin(self, album_id: str):
+        """标记本子正在使用，不会被淘汰"""
+        self._pins[album_id] = self._pins.get(album_id, 0) + 1
+
+    def unpin(self, album_id: str):
+        count = self._pins.get(album_id, 0) - 1
+        if count > 0:
+            self._pins[album_id] = count
+        else:
+            self._pins.pop(album_id, None)
+            # 之前因为被 pin 而没能淘汰的空间在这里补上
+            self.evict()
+
+    # ============ 写入 ============
+
+    def put(self, album_id: str, size: int, complete: bool,
+            photo_ids: Optional[Dict[int, str]] = None, episodes: Optional[List[str]] = None):
+        """记录一次下载的结果，然后按需淘汰"""
+        entry = self.entries.get(album_id) or {'hits': 0}
+        entry.update(
+            size=size,
+            last_access=time.time(),
+            complete=complete,
+            photo_ids={str(k): v for k, v in (photo_ids or {}).items()},
+            episodes=list(episodes or []),
+        )
+        self.entries[album_id] = entry
+        self._save()
+        self.evict()
+
+    def evict(self):
+        """总大小超过上限时，按最后访问时间从旧到新淘汰未被 pin 的本子"""
+        total = self.total_bytes
+        if total <= self.max_bytes:
+            return
+
+        candidates = sorted(
+            (entry['last_access'], album_id)
+            for album_id, entry in self.entries.items()
+            if album_id not in self._pins
+        )
+        for _, album_id in candidates:
+            if total <= self.max_bytes:
+                break
+            total -= self.entries[album_id]['size']
+            self._remove(album_id)
+            self.evictions += 1
+            logger.info(f"淘汰本子缓存: {album_id}，缓存大小 {total / 1048576:.1f}MB")
+        self._save()
+
+    def _remove(self, album_id: str):
+        del self.entries[album_id]
+        album_dir = self.album_dir(album_id)
+        if not album_dir.exists():
+            return
+        # 先原子地改名，同一本子的新下载不会和删除交错；真正的删除放到后台线程
+        trash = self.root / f'{TRASH_PREFIX}{album_id}-{time.time_ns()}'
+        album_dir.rename(trash)
+        threading.Thread(target=shutil.rmtree, args=(trash, True), daemon=True).start()
+
+    # ============ manifest ============
+
+    def _load(self):
+        if self.manifest_path.exists():
+            try:
+                self.entries = json.loads(self.manifest_path.read_text(encoding='utf-8'))
+            except (OSError, ValueError) as e:
+                logger.warning(f"读取本子缓存清单失败，重新扫描: {e}")
+                self.entries = {}
+
+        # 与磁盘对齐：清单里有但目录不在的删掉，目录在但清单里没有的（例如进程崩溃时的半成品）记为不完整
+        existing = {}
+        for child in self.root.iterdir():
+            if child.name.startswith(TRASH_PREFIX):
+                shutil.rmtree(child, ignore_errors=True)
+            elif child.is_dir() and not child.name.startswith('.'):
+                existing[child.name] = child
+
+        for album_id in list(self.entries):
+            if album_id not in existing:
+                del self.entries[album_id]
+        for album_id, child in existing.items():
+            if album_id not in self.entries:
+                self.entries[album_id] = {
+                    'size': dir_size(child),
+                    'last_access': child.stat().st_mtime,
+                    'hits': 0,
+                    'complete': False,
+                    'photo_ids': {},
+                    'episodes': [],
+                }
+
+        self._save()
+        self.evict()
+
+    def _save(self):
+        tmp = self.manifest_path.with_suffix('.tmp')
+        tmp.write_text(json.dumps(self.entries, ensure_ascii=False), encoding='utf-8')
+        os.replace(tmp, self.manifest_path)
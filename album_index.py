@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地本子索引
+记录机器人见过的每个本子（搜索结果、本子详情）的标题、作者和标签，
+inline 查询先在本地查找，本地结果不够时才请求禁漫
+"""
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+# albums 表数据版本，记录在 PRAGMA user_version 中
+SCHEMA_VERSION = 1
+
+# 搜索结果没有作者时填的占位值，不写入索引
+UNKNOWN_AUTHOR = 'Unknown'
+
+
+def _escape_like(term: str) -> str:
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _author(author) -> str:
+    if not author or author == UNKNOWN_AUTHOR:
+        return ''
+    return str(author)
+
+
+class AlbumIndex:
+    """基于 sqlite 的本子元数据索引，可以在任意线程中使用"""
+
+    def __init__(self, db_path: Path):
+        """初始化
+
+        Args:
+            db_path: sqlite 数据库文件路径
+        """
+        db_path.parent.mkdir(exist_ok=True, parents=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS albums (
+                album_id   TEXT PRIMARY KEY,
+                title      TEXT NOT NULL,
+                author     TEXT NOT NULL DEFAULT '',
+                tags       TEXT NOT NULL DEFAULT '',
+                updated_at REAL NOT NULL
+            );
+        ''')
+        if self._conn.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+            # 旧版本把占位的作者写进了索引，查询 "unknown" 会命中所有没有作者的本子
+            self._conn.execute('UPDATE albums SET author = ? WHERE author = ?', ('', UNKNOWN_AUTHOR))
+            self._conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        self._conn.commit()
+
+    def add(self, albums: Iterable[Dict]):
+        """写入或更新本子，每项包含 id、title，可选 author、tags (列表)
+
+        作者或标签为空时保留已有的值（搜索结果可能不带作者和标签，详情带）
+        """
+        now = time.time()
+        rows = [
+            (
+                str(album['id']),
+                album.get('title') or '',
+                _author(album.get('author')),
+                ' '.join(album.get('tags') or []),
+                now,
+            )
+            for album in albums
+            if album.get('id') and album.get('title')
+        ]
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT INTO albums (album_id, title, author, tags, updated_at) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT(album_id) DO UPDATE SET title = excluded.title, '
+                "author = CASE WHEN excluded.author = '' THEN albums.author ELSE excluded.author END, "
+                "tags = CASE WHEN excluded.tags = '' THEN albums.tags ELSE excluded.tags END, "
+                'updated_at = excluded.updated_at',
+                rows
+            )
+
+    def search(self, query: str, limit: int = 20) -> List[Dict]:
+        """按关键词查找本子
+
+        查询按空白切分，每个词都要出现在标题、作者或标签中（不区分大小写的子串匹配）；
+        纯数字的查询同时按 ID 匹配。标题命中的排在前面，其余按最近见到的时间排序。
+        """
+        terms = query.split()
+        if not terms:
+            return []
+
+        conditions = []
+        params = []
+        for term in terms:
+            conditions.append(
+                "(title LIKE ? ESCAPE '\\' OR author LIKE ? ESCAPE '\\' OR tags LIKE ? ESCAPE '\\')"
+            )
+            pattern = f'%{_escape_like(term)}%'
+            params.extend([pattern, pattern, pattern])
+
+        where = ' AND '.join(conditions)
+        if query.strip().isdigit():
+            where = f'album_id = ? OR ({where})'
+            params.insert(0, query.strip())
+
+        title_pattern = f'%{_escape_like(terms[0])}%'
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT album_id, title, author, tags FROM albums WHERE {where} '
+                f"ORDER BY title LIKE ? ESCAPE '\\' DESC, updated_at DESC LIMIT ?",
+                (*params, title_pattern, limit)
+            ).fetchall()
+
+        return [
+            {'id': album_id, 'title': title, 'author': author, 'tags': tags.split() if tags else []}
+            for album_id, title, author, tags in rows
+        ]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM albums').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JMComicAPI 单次请求延迟基准测试
+
+对比两种方式:
+  before: 每次请求都 JmOption.default() + option.build_jm_client()（旧实现）
+  after:  复用 JMComicAPI 启动时构建的共享 client（新实现）
+
+用法:
+  python benchmarks/bench_jm_client.py --offline            # 只测构建开销，不访问网络
+  python benchmarks/bench_jm_client.py --keyword 無修正 -n 20  # 访问禁漫，测完整 search 延迟
+"""
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from jmcomic_wrapper import JMComicAPI, jmcomic  # noqa: E402
+
+
+def summarize(name, samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(
+        f"{name:<8} n={len(samples):<4} "
+        f"mean={statistics.mean(samples) * 1000:8.2f}ms  "
+        f"p50={statistics.median(samples) * 1000:8.2f}ms  "
+        f"p95={p95 * 1000:8.2f}ms"
+    )
+
+
+def bench(func, n):
+    samples = []
+    for _ in range(n):
+        begin = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - begin)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JMComicAPI 单次请求延迟基准测试")
+    parser.add_argument("-n", type=int, default=20, help="每种方式的请求次数")
+    parser.add_argument("--keyword", default="無修正", help="搜索关键词")
+    parser.add_argument("--offline", action="store_true", help="不访问网络，只测 option/client 构建开销")
+    args = parser.parse_args()
+
+    if args.offline:
+        # 关闭 JmApiClient.after_init 中的网络请求
+        jmcomic.JmModuleConfig.FLAG_API_CLIENT_AUTO_UPDATE_DOMAIN = False
+        jmcomic.JmModuleConfig.FLAG_API_CLIENT_REQUIRE_COOKIES = False
+
+    jmcomic.disable_jm_log()
+    api = JMComicAPI(Path(tempfile.mkdtemp()))
+
+    def before():
+        client = jmcomic.JmOption.default().build_jm_client()
+        if not args.offline:
+            client.search_site(search_query=args.keyword, page=1)
+
+    def after():
+        client = api.client
+        if not args.offline:
+            # 共享 client 不带响应缓存，每次都真正发出 HTTP 请求，只比较构建开销
+            client.search_site(search_query=args.keyword, page=1)
+
+    # 预热：after_init 中的域名更新、cookies 获取只会执行一次
+    before()
+    after()
+
+    summarize("before", bench(before, args.n))
+    summarize("after", bench(after, args.n))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+离线端到端基准测试：N 个用户同时通过 /download 下载，测量整条流水线
+
+机器人的处理器（telegram_bot.build_application）照常运行，外部依赖全部换成本地替身：
+  - Telegram: 进程内的假 Bot API 服务器（benchmarks/fake_bot_api.py）
+  - 禁漫: 本地 HTTP 服务器提供本子 JSON 和切割过的 webp 图片（benchmarks/fake_jm.py），
+          图片的下载、解密、保存仍走 jmcomic 原本的流程
+
+输出首图时间和完成时间的 p50/p99、每秒发送页数、机器人进程和下载工作进程的峰值 RSS。
+
+用法:
+  python benchmarks/bench_pipeline.py                                   # 10 个用户下载 10 个不同的本子
+  python benchmarks/bench_pipeline.py --users 20 --albums 5 --pages 40  # 多个用户请求同一本子（共享下载、file_id 缓存）
+  python benchmarks/bench_pipeline.py --processes 2                     # 多进程下载模式
+  python benchmarks/bench_pipeline.py --format zip --json result.json
+  python benchmarks/bench_pipeline.py --chapters 10 --select "3 1-5"      # 只下载一部分 (/download <ID> 3 1-5)
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def percentile(samples, q: float) -> float:
+    samples = sorted(samples)
+    if not samples:
+        return float('nan')
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="离线端到端基准测试（假 Telegram + 假禁漫）")
+    parser.add_argument("--users", type=int, default=10, help="同时下载的用户数")
+    parser.add_argument("--albums", type=int, default=0, help="不同本子的数量，用户按顺序轮流选择；0 表示每个用户一个本子")
+    parser.add_argument("--chapters", type=int, default=1, help="每个本子的章节数")
+    parser.add_argument("--pages", type=int, default=20, help="每个章节的图片数")
+    parser.add_argument("--size", default="900x1300", help="图片尺寸 (宽x高)")
+    parser.add_argument("--interval", type=float, default=0.0, help="用户之间的到达间隔 (秒)")
+    parser.add_argument("--jm-latency", type=float, default=0.02, help="禁漫每个请求的延迟 (秒)")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="Bot API 每个请求的延迟 (秒)")
+    parser.add_argument("--upload-mbps", type=float, default=0.0, help="Bot API 上传带宽 (MB/s)，0 表示不限制")
+    parser.add_argument("--processes", type=int, default=0, help="DOWNLOAD_PROCESSES，0 表示在机器人进程中下载")
+    parser.add_argument("--format", default="", help="DEFAULT_FORMAT，例如 zip")
+    parser.add_argument("--select", default="", help="/download <ID> 之后的章节/页码范围，例如 \"3 1-5\"")
+    parser.add_argument("--timeout", type=float, default=600, help="整个测试的超时 (秒)")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    parser.add_argument("--verbose", action="store_true", help="显示机器人的日志和下载输出")
+    return parser.parse_args()
+
+
+def setup(args, workdir: Path):
+    """启动假禁漫，配置环境变量后导入机器人（机器人在导入时按配置初始化）"""
+    from benchmarks import fake_jm
+
+    width, height = (int(v) for v in args.size.split('x'))
+    jm_server = fake_jm.FakeJmServer(args.chapters, args.pages, width, height, latency=args.jm_latency).start()
+    # 下载工作进程导入 benchmarks.fake_jm 时按 FAKE_JM_URL 注册假 client
+    os.environ['FAKE_JM_URL'] = jm_server.url
+    fake_jm.install(jm_server.url)
+
+    os.environ['TELEGRAM_TOKEN'] = '123456:BENCHMARK'
+    os.environ['DOWNLOAD_PROCESSES'] = str(args.processes)
+    if args.format:
+        os.environ['DEFAULT_FORMAT'] = args.format
+
+    from telegram_config import TelegramConfig
+    TelegramConfig.DOWNLOAD_DIR = workdir / 'downloads'
+    TelegramConfig.TEMP_DIR = workdir / 'temp'
+    TelegramConfig.FILE_ID_CACHE_DB = workdir / 'temp' / 'file_id_cache.db'
+    TelegramConfig.JOB_JOURNAL_DB = workdir / 'temp' / 'jobs.db'
+    TelegramConfig.ALBUM_INDEX_DB = workdir / 'temp' / 'album_index.db'
+
+    import telegram_bot
+    if not args.verbose:
+        import logging
+        logging.getLogger().setLevel(logging.WARNING)
+    if telegram_bot.download_workers is not None:
+        telegram_bot.download_workers.preload.append('benchmarks.fake_jm')
+    return jm_server, telegram_bot
+
+
+async def run(args, telegram_bot, jm_server) -> dict:
+    from telegram import Update
+    from benchmarks.fake_bot_api import FakeBotApi
+    from benchmarks.fake_update_poster import make_update
+    from memory_governor import read_rss
+    from jmcomic_wrapper import DownloadSelection
+
+    selection = DownloadSelection.parse(args.select.split())
+
+    api = await FakeBotApi(args.api_latency, args.upload_mbps * 1024 * 1024).start()
+    telegram_bot.TelegramConfig.BOT_API_URL = api.url
+    application = telegram_bot.build_application()
+    await application.initialize()
+    await application.start()
+    telegram_bot.memory_governor.start()
+
+    peak_rss = read_rss()
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while True:
+            peak_rss = max(peak_rss, read_rss())
+            await asyncio.sleep(0.05)
+
+    sampler = asyncio.create_task(sample_rss())
+
+    albums = args.albums or args.users
+    users = [(10000 + i, str(600000 + i % albums)) for i in range(args.users)]
+
+    async def send(text: str, user_id: int):
+        await application.update_queue.put(Update.de_json(make_update(text, user_id, user_id), application.bot))
+
+    # 进入对话（/download 需要先 /start）
+    for user_id, _ in users:
+        await send('/start', user_id)
+    while any(not api.calls.get(user_id) for user_id, _ in users):
+        await asyncio.sleep(0.01)
+
+    submitted = {}
+    finished = {}
+    began = time.perf_counter()
+    for user_id, album_id in users:
+        submitted[user_id] = time.perf_counter()
+        await send(f'/download {album_id} {selection.spec}'.strip(), user_id)
+        if args.interval > 0:
+            await asyncio.sleep(args.interval)
+
+    # pending_downloads 中出现过又消失的任务视为结束
+    seen = set()
+    deadline = began + args.timeout
+    while len(finished) < len(users) and time.perf_counter() < deadline:
+        for user_id, album_id in users:
+            key = (user_id, album_id, selection.spec)
+            if key in telegram_bot.pending_downloads:
+                seen.add(key)
+            elif key in seen and user_id not in finished:
+                finished[user_id] = time.perf_counter()
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - began
+
+    sampler.cancel()
+    await application.stop()
+    await application.shutdown()
+    await telegram_bot.memory_governor.stop()
+    await api.stop()
+
+    first_image = [api.first_media_at(user_id) - submitted[user_id]
+                   for user_id, _ in users if api.first_media_at(user_id) is not None]
+    completion = [finished[user_id] - submitted[user_id] for user_id in finished]
+    jobs = telegram_bot.job_journal.stats()
+    pages_per_album = selection.page_count(args.pages) * (1 if selection.chapter else args.chapters)
+    pages = jobs.get('done', 0) * pages_per_album
+
+    return {
+        'users': args.users,
+        'albums': albums,
+        'pages_per_album': pages_per_album,
+        'processes': args.processes,
+        'format': args.format or telegram_bot.TelegramConfig.DEFAULT_FORMAT,
+        'jobs': jobs,
+        'timed_out': len(users) - len(finished),
+        'elapsed': elapsed,
+        'pages': pages,
+        'pages_per_second': pages / elapsed if elapsed > 0 else 0,
+        'first_image_p50': percentile(first_image, 0.5),
+        'first_image_p99': percentile(first_image, 0.99),
+        'completion_p50': percentile(completion, 0.5),
+        'completion_p99': percentile(completion, 0.99),
+        'bot_api_requests': api.requests,
+        'uploaded_bytes': api.uploaded_bytes,
+        'jm_requests': jm_server.requests,
+        'jm_bytes': jm_server.bytes_sent,
+        'peak_rss': peak_rss,
+        'fetch_wait_seconds': telegram_bot.jm_api.fetch_wait_seconds,
+        'lanes': telegram_bot.jm_api.lane_stats(),
+    }
+
+
+def report(result: dict):
+    mb = 1024 * 1024
+    print(f"用户 {result['users']}，本子 {result['albums']}，每本 {result['pages_per_album']} 页，"
+          f"下载进程 {result['processes']}，格式 {result['format']}")
+    print(f"任务: {result['jobs']}" + (f"，超时 {result['timed_out']}" if result['timed_out'] else ''))
+    print(f"总耗时   {result['elapsed']:8.2f}s   发送 {result['pages']} 页，{result['pages_per_second']:.1f} 页/秒")
+    print(f"首图时间 p50={result['first_image_p50'] * 1000:8.0f}ms  p99={result['first_image_p99'] * 1000:8.0f}ms")
+    print(f"完成时间 p50={result['completion_p50'] * 1000:8.0f}ms  p99={result['completion_p99'] * 1000:8.0f}ms")
+    print(f"Bot API  {result['bot_api_requests']} 个请求，上传 {result['uploaded_bytes'] / mb:.1f}MB")
+    print(f"禁漫     {result['jm_requests']} 个请求，下载 {result['jm_bytes'] / mb:.1f}MB")
+    print(f"下载因发送跟不上暂停 {result['fetch_wait_seconds']:.2f}s")
+    print(f"峰值 RSS 机器人进程 {result['peak_rss'] / mb:.0f}MB，子进程 {result['children_peak_rss'] / mb:.0f}MB")
+    for name, lane in result['lanes'].items():
+        print(f"通道 {name:<9} 完成 {lane['completed']:<5} 排队 p95={lane['wait_p95'] * 1000:.0f}ms")
+
+
+def main():
+    args = parse_args()
+    workdir = Path(tempfile.mkdtemp(prefix='jm_bench_'))
+    # 下载库和机器人的 print 输出很多，默认不显示（工作进程的输出不受影响）
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    try:
+        with quiet:
+            jm_server, telegram_bot = setup(args, workdir)
+            try:
+                result = asyncio.run(run(args, telegram_bot, jm_server))
+            finally:
+                telegram_bot.jm_api.cleanup()
+                telegram_bot.image_preprocessor.shutdown()
+                if telegram_bot.download_workers is not None:
+                    telegram_bot.download_workers.shutdown()
+                jm_server.stop()
+        # ru_maxrss 单位为 KB；子进程（下载工作进程、预处理进程）退出后才计入
+        result['children_peak_rss'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+        result['peak_rss'] = max(result['peak_rss'], resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report(result)
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+进程内的假 Telegram Bot API 服务器，供离线基准测试使用
+
+运行在机器人的事件循环中，机器人通过 BOT_API_URL 指向这里。
+实现机器人用到的方法（sendMessage、sendMediaGroup、sendPhoto、sendDocument、editMessageText 等），
+返回结构正确的 Message，并记录每个会话收到的消息，用于计算首图时间等指标。
+"""
+import asyncio
+import itertools
+import json
+import time
+import urllib.parse
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# 这些方法会发送图片/文件
+MEDIA_METHODS = ('sendMediaGroup', 'sendPhoto', 'sendDocument')
+
+
+class ApiCall(NamedTuple):
+    at: float  # time.perf_counter()
+    method: str
+    media: int  # 本次请求发送的图片/文件数
+    uploaded: int  # 本次请求上传的字节数
+
+
+def parse_multipart(body: bytes, content_type: str) -> Tuple[Dict[str, str], int]:
+    """解析 multipart/form-data，返回 (普通字段, 文件总字节数)"""
+    boundary = content_type.split('boundary=', 1)[1].strip('"').encode()
+    fields = {}
+    file_bytes = 0
+    for part in body.split(b'--' + boundary):
+        head, sep, content = part.partition(b'\r\n\r\n')
+        if not sep:
+            continue
+        content = content[:-2] if content.endswith(b'\r\n') else content
+        headers = head.decode('utf-8', 'replace')
+        if 'filename=' in headers:
+            file_bytes += len(content)
+            continue
+        name = headers.split('name="', 1)[1].split('"', 1)[0]
+        fields[name] = content.decode('utf-8')
+    return fields, file_bytes
+
+
+class FakeBotApi:
+    """基于 asyncio.start_server 的假 Bot API"""
+
+    def __init__(self, latency: float = 0.0, upload_bandwidth: float = 0.0, port: int = 0):
+        """初始化
+
+        Args:
+            latency: 每个请求的固定延迟 (秒)
+            upload_bandwidth: 上传带宽 (字节/秒)，按请求体大小额外等待；0 表示不限制
+            port: 监听端口，0 表示随机
+        """
+        self.latency = latency
+        self.upload_bandwidth = upload_bandwidth
+        self.port = port
+        # chat_id -> 按时间顺序的请求
+        self.calls: Dict[int, List[ApiCall]] = defaultdict(list)
+        self.requests = 0
+        self.uploaded_bytes = 0
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.port}'
+
+    async def start(self) -> 'FakeBotApi':
+        self._server = await asyncio.start_server(self._handle_connection, '127.0.0.1', self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def first_media_at(self, chat_id: int) -> Optional[float]:
+        """会话第一次收到图片/文件的时间"""
+        for call in self.calls.get(chat_id, ()):
+            if call.media:
+                return call.at
+        return None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                _, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length') or 0))
+
+                payload = json.dumps(await self._call(target, headers.get('content-type', ''), body)).encode()
+                writer.write(
+                    b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                    b'Content-Length: ' + str(len(payload)).encode() + b'\r\n\r\n' + payload
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _call(self, target: str, content_type: str, body: bytes) -> dict:
+        # /bot<token>/<method>
+        method = target.split('?', 1)[0].rsplit('/', 1)[-1]
+        if content_type.startswith('multipart/form-data'):
+            fields, uploaded = parse_multipart(body, content_type)
+        else:
+            fields = {k: v[0] for k, v in urllib.parse.parse_qs(body.decode()).items()}
+            uploaded = 0
+
+        self.requests += 1
+        self.uploaded_bytes += uploaded
+        delay = self.latency + (len(body) / self.upload_bandwidth if self.upload_bandwidth else 0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        result = self._result(method, fields)
+        chat_id = fields.get('chat_id')
+        if chat_id is not None:
+            media = len(result) if method == 'sendMediaGroup' else int(method in MEDIA_METHODS)
+            self.calls[int(chat_id)].append(ApiCall(time.perf_counter(), method, media, uploaded))
+        return {'ok': True, 'result': result}
+
+    def _result(self, method: str, fields: Dict[str, str]):
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        if method in ('sendMessage', 'editMessageText'):
+            return self._message(fields, text=fields.get('text', ''))
+        if method == 'sendPhoto':
+            return self._message(fields, photo=[self._file()])
+        if method == 'sendDocument':
+            return self._message(fields, document=self._file())
+        if method == 'sendMediaGroup':
+            return [
+                self._message(fields, **{'document': self._file()} if item['type'] == 'document'
+                              else {'photo': [self._file()]})
+                for item in json.loads(fields['media'])
+            ]
+        # deleteMessage、sendChatAction、answerCallbackQuery 等
+        return True
+
+    def _message(self, fields: Dict[str, str], **content) -> dict:
+        return {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(fields.get('chat_id', 0)), 'type': 'private'},
+            **content,
+        }
+
+    def _file(self) -> dict:
+        file_id = next(self._file_ids)
+        return {'file_id': f'bench-{file_id}', 'file_unique_id': f'u{file_id}', 'width': 1, 'height': 1}
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地的禁漫替身，供离线基准测试使用
+
+- FakeJmServer: 在后台线程中运行的 HTTP 服务器，提供本子/章节 JSON 和按禁漫规则切割（scramble）过的 webp 图片
+- FakeJmClient: 从 FakeJmServer 读取详情的 JmApiClient，图片仍走 jmcomic 原本的下载、解密、保存流程
+
+导入本模块时如果设置了环境变量 FAKE_JM_URL，会自动注册 FakeJmClient 为默认 client，
+下载工作进程通过 DownloadWorkerPool(preload=['benchmarks.fake_jm']) 使用同一个替身。
+"""
+import hashlib
+import io
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from jmcomic_wrapper import jmcomic  # noqa: E402
+from PIL import Image  # noqa: E402
+
+# 大于 SCRAMBLE_421926 的本子按 md5 决定切割段数（2~16），与现在的禁漫一致
+FIRST_ALBUM_ID = 600000
+SCRAMBLE_ID = jmcomic.JmMagicConstants.SCRAMBLE_220980
+
+
+def scramble_num(photo_id: str, filename: str) -> int:
+    """与 JmImageTool.get_num 相同的切割段数"""
+    return jmcomic.JmImageTool.get_num(SCRAMBLE_ID, photo_id, filename)
+
+
+def scramble(img: Image.Image, num: int) -> Image.Image:
+    """JmImageTool.decode_and_save 的逆操作：把原图切成 num 段后打乱"""
+    if num == 0:
+        return img
+    w, h = img.size
+    scrambled = Image.new('RGB', (w, h))
+    over = h % num
+    for i in range(num):
+        move = math.floor(h / num)
+        y_src = h - (move * (i + 1)) - over
+        y_dst = move * i
+        if i == 0:
+            move += over
+        else:
+            y_dst += over
+        scrambled.paste(img.crop((0, y_dst, w, y_dst + move)), (0, y_src))
+    return scrambled
+
+
+def make_page(width: int, height: int, seed: int) -> Image.Image:
+    """大小接近真实漫画页的图片：低频噪声放大后再叠加细节"""
+    rng = random.Random(seed)
+    base = Image.effect_noise((width // 8, height // 8), 64).convert('RGB')
+    base = base.resize((width, height), Image.BILINEAR)
+    detail = Image.effect_noise((width, height), 24).convert('RGB')
+    tint = Image.new('RGB', (width, height), tuple(rng.randrange(256) for _ in range(3)))
+    return Image.blend(Image.blend(base, detail, 0.3), tint, 0.2)
+
+
+class FakeJmServer:
+    """本子、章节详情和图片的 HTTP 服务（线程中运行，与机器人的事件循环互不影响）
+
+    - GET /album/<id>: 本子 JSON（章节列表）
+    - GET /photo/<id>: 章节 JSON（图片文件名）
+    - GET /media/photos/<photo_id>/<filename>: 切割过的 webp 图片
+    """
+
+    def __init__(self, chapters: int = 1, pages: int = 20, width: int = 900, height: int = 1300,
+                 latency: float = 0.0, port: int = 0):
+        """初始化
+
+        Args:
+            chapters: 每个本子的章节数
+            pages: 每个章节的图片数
+            width: 图片宽度
+            height: 图片高度
+            latency: 每个请求额外等待的秒数（模拟网络延迟）
+            port: 监听端口，0 表示随机
+        """
+        self.chapters = chapters
+        self.pages = pages
+        self.width = width
+        self.height = height
+        self.latency = latency
+        self.requests = 0
+        self.bytes_sent = 0
+        # 切割段数 -> webp 数据（同一段数的图片内容相同，只编码一次）
+        self._images: Dict[int, bytes] = {}
+        self._lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, content_type, body = server.route(self.path)
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'FakeJmServer':
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='fake-jm', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def photo_ids(self, album_id: str):
+        if self.chapters == 1:
+            return [album_id]
+        return [f'{album_id}{index:02d}' for index in range(1, self.chapters + 1)]
+
+    def route(self, path: str) -> Tuple[int, str, bytes]:
+        with self._lock:
+            self.requests += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        parts = path.split('?', 1)[0].strip('/').split('/')
+        if len(parts) == 2 and parts[0] == 'album':
+            body = json.dumps(self.album_json(parts[1])).encode()
+            return 200, 'application/json', body
+        if len(parts) == 2 and parts[0] == 'photo':
+            body = json.dumps(self.photo_json(parts[1])).encode()
+            return 200, 'application/json', body
+        if len(parts) == 4 and parts[:2] == ['media', 'photos']:
+            body = self.image(scramble_num(parts[2], Path(parts[3]).stem))
+            with self._lock:
+                self.bytes_sent += len(body)
+            return 200, 'image/webp', body
+        return 404, 'text/plain', b'Not Found'
+
+    def album_json(self, album_id: str) -> dict:
+        return {
+            'id': album_id,
+            'name': f'Fake album {album_id}',
+            'author': 'fake',
+            'tags': ['fake'],
+            'page_count': self.chapters * self.pages,
+            'episodes': [[photo_id, str(index), f'Chapter {index}']
+                         for index, photo_id in enumerate(self.photo_ids(album_id), 1)],
+        }
+
+    def photo_json(self, photo_id: str) -> dict:
+        return {
+            'id': photo_id,
+            # 多章节本子的 photo_id 是 <album_id><序号:02d>，单章本子的 series_id 为 0
+            'series_id': photo_id[:-2] if self.chapters > 1 else '0',
+            'sort': int(photo_id[-2:]) if self.chapters > 1 else 1,
+            'name': f'Fake photo {photo_id}',
+            'page_arr': [f'{index:05d}.webp' for index in range(1, self.pages + 1)],
+        }
+
+    def image(self, num: int) -> bytes:
+        with self._lock:
+            data = self._images.get(num)
+        if data is None:
+            seed = int(hashlib.md5(str(num).encode()).hexdigest(), 16)
+            img = scramble(make_page(self.width, self.height, seed), num)
+            buffer = io.BytesIO()
+            img.save(buffer, format='WEBP', quality=80)
+            data = buffer.getvalue()
+            with self._lock:
+                self._images[num] = data
+        return data
+
+
+class FakeJmClient(jmcomic.JmApiClient):
+    """从 FakeJmServer 读取详情的 client，图片下载和解密使用 jmcomic 原本的实现"""
+
+    client_key = 'fake_jm'
+    server_url = ''
+
+    def after_init(self):
+        # 不访问禁漫的域名/cookie 接口
+        pass
+
+    def _get_json(self, path: str) -> dict:
+        resp = self.postman.get(f'{self.server_url}{path}')
+        return json.loads(resp.content)
+
+    def get_album_detail(self, album_id) -> jmcomic.JmAlbumDetail:
+        data = self._get_json(f'/album/{album_id}')
+        return jmcomic.JmAlbumDetail(
+            data['id'], SCRAMBLE_ID, data['name'], [tuple(episode) for episode in data['episodes']],
+            data['page_count'], '2024-01-01', '2024-01-01', '0', '0', 0, [], [], [data['author']], data['tags']
+        )
+
+    def get_photo_detail(self, photo_id, fetch_album=True, fetch_scramble_id=True) -> jmcomic.JmPhotoDetail:
+        data = self._get_json(f'/photo/{photo_id}')
+        photo = jmcomic.JmPhotoDetail(
+            data['id'], data['name'], data['series_id'], data['sort'],
+            scramble_id=SCRAMBLE_ID,
+            page_arr=data['page_arr'],
+            data_original_domain=self.server_url.split('://', 1)[1],
+        )
+        if fetch_album:
+            photo.from_album = self.get_album_detail(photo_id)
+        return photo
+
+    def search(self, search_query, page, main_tag, order_by, time_, category, sub_category):
+        return jmcomic.JmSearchPage(
+            [(str(FIRST_ALBUM_ID + i), {'name': f'{search_query} {i}', 'author': 'fake', 'tags': ['fake']})
+             for i in range(20)],
+            20
+        )
+
+
+def install(server_url: str):
+    """把 FakeJmClient 注册为默认 client（需要在构建 JmOption 之前调用）"""
+    FakeJmClient.server_url = server_url.rstrip('/')
+    jmcomic.JmModuleConfig.register_client(FakeJmClient)
+    jmcomic.JmModuleConfig.DEFAULT_CLIENT_IMPL = FakeJmClient.client_key
+    # 图片地址使用 http
+    jmcomic.JmModuleConfig.PROT = 'http://'
+    jmcomic.disable_jm_log()
+
+
+if os.getenv('FAKE_JM_URL'):
+    install(os.environ['FAKE_JM_URL'])
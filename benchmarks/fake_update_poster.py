@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+模拟 Telegram 向 webhook 推送更新，测量从 POST 到收到 200 的延迟
+
+用法:
+  WEBHOOK_URL=http://localhost:8080 WEBHOOK_SECRET=test python telegram_bot.py   # 先以 webhook 模式启动机器人
+  python benchmarks/fake_update_poster.py --secret test -n 50                       # 推送 50 条 /start
+  python benchmarks/fake_update_poster.py --secret test --text "/search 無修正"
+"""
+import argparse
+import itertools
+import json
+import statistics
+import time
+import urllib.error
+import urllib.request
+
+_update_ids = itertools.count(int(time.time()))
+
+
+def make_update(text: str, user_id: int, chat_id: int) -> dict:
+    """构造一条私聊文本消息更新"""
+    user = {'id': user_id, 'is_bot': False, 'first_name': 'Fake'}
+    entities = []
+    if text.startswith('/'):
+        entities.append({'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])})
+    return {
+        'update_id': next(_update_ids),
+        'message': {
+            'message_id': next(_update_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private', 'first_name': 'Fake'},
+            'from': user,
+            'text': text,
+            'entities': entities,
+        },
+    }
+
+
+def post(url: str, secret: str, update: dict) -> float:
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(update).encode(),
+        headers={
+            'Content-Type': 'application/json',
+            'X-Telegram-Bot-Api-Secret-Token': secret,
+        },
+        method='POST',
+    )
+    begin = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=10) as response:
+        response.read()
+    return time.perf_counter() - begin
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟 Telegram webhook 推送")
+    parser.add_argument("--url", default="http://localhost:8080/telegram/webhook", help="webhook 地址")
+    parser.add_argument("--secret", default="", help="WEBHOOK_SECRET")
+    parser.add_argument("--text", default="/start", help="消息内容")
+    parser.add_argument("--user-id", type=int, default=10000, help="发送者 ID")
+    parser.add_argument("-n", type=int, default=1, help="推送次数")
+    args = parser.parse_args()
+
+    samples = []
+    for _ in range(args.n):
+        try:
+            samples.append(post(args.url, args.secret, make_update(args.text, args.user_id, args.user_id)))
+        except urllib.error.HTTPError as e:
+            print(f"推送失败: HTTP {e.code}")
+            return
+
+    samples.sort()
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(
+        f"n={len(samples)}  "
+        f"mean={statistics.mean(samples) * 1000:.2f}ms  "
+        f"p50={statistics.median(samples) * 1000:.2f}ms  "
+        f"p95={p95 * 1000:.2f}ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
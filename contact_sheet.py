@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+搜索结果封面拼图
+把搜索结果的封面缩略图拼成一张图片，左上角标注序号，与文字结果中的 1️⃣ 2️⃣ ... 对应
+"""
+import io
+from pathlib import Path
+from typing import List, Optional
+
+from PIL import Image, ImageDraw, ImageFont
+
+# 搜索列表页封面 (_3x4) 的宽高比
+THUMB_RATIO = 4 / 3
+
+BACKGROUND = (255, 255, 255)
+PLACEHOLDER = (220, 220, 220)
+LABEL_BACKGROUND = (0, 0, 0)
+LABEL_COLOR = (255, 255, 255)
+
+
+def make_contact_sheet(covers: List[Optional[Path]], thumb_width: int = 200,
+                       columns: int = 5, gap: int = 8, quality: int = 85) -> bytes:
+    """拼接封面
+
+    Args:
+        covers: 按结果顺序排列的封面路径，缺失的封面为 None（显示为灰色占位）
+        thumb_width: 每个缩略图的宽度
+        columns: 每行缩略图数量
+        gap: 缩略图之间的间距
+        quality: JPEG 质量
+
+    Returns:
+        JPEG 数据
+    """
+    thumb_height = int(thumb_width * THUMB_RATIO)
+    columns = max(1, min(columns, len(covers)))
+    rows = (len(covers) + columns - 1) // columns
+
+    sheet = Image.new(
+        'RGB',
+        (columns * thumb_width + (columns + 1) * gap, rows * thumb_height + (rows + 1) * gap),
+        BACKGROUND
+    )
+    draw = ImageDraw.Draw(sheet)
+    font = ImageFont.load_default(thumb_width // 6)
+
+    for index, cover in enumerate(covers):
+        x = gap + (index % columns) * (thumb_width + gap)
+        y = gap + (index // columns) * (thumb_height + gap)
+        sheet.paste(_thumbnail(cover, thumb_width, thumb_height), (x, y))
+
+        label = str(index + 1)
+        left, top, right, bottom = draw.textbbox((0, 0), label, font=font)
+        padding = thumb_width // 30
+        draw.rectangle(
+            (x, y, x + right - left + 2 * padding, y + bottom - top + 2 * padding),
+            fill=LABEL_BACKGROUND
+        )
+        draw.text((x + padding - left, y + padding - top), label, fill=LABEL_COLOR, font=font)
+
+    buffer = io.BytesIO()
+    sheet.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def _thumbnail(cover: Optional[Path], width: int, height: int) -> Image.Image:
+    """按比例缩放后居中裁剪到 width x height，读取失败时返回占位图"""
+    if cover is not None:
+        try:
+            with Image.open(cover) as img:
+                img = img.convert('RGB')
+                scale = max(width / img.width, height / img.height)
+                resized = img.resize((max(width, round(img.width * scale)), max(height, round(img.height * scale))),
+                                     Image.LANCZOS)
+            left = (resized.width - width) // 2
+            top = (resized.height - height) // 2
+            return resized.crop((left, top, left + width, top + height))
+        except OSError:
+            pass
+    return Image.new('RGB', (width, height), PLACEHOLDER)
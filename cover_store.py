@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+封面缩略图缓存
+每个封面一个文件 (<album_id><size>.jpg)，总大小超过上限时按最近访问时间淘汰。
+访问顺序记录在文件的 mtime 中，重启后按 mtime 恢复，不需要额外的清单文件。
+只能在事件循环线程中调用
+"""
+import logging
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CoverStore:
+    """按字节数限制大小的封面文件 LRU 缓存"""
+
+    def __init__(self, root: Path, max_bytes: int):
+        """初始化
+
+        Args:
+            root: 封面目录
+            max_bytes: 封面总大小上限 (字节)
+        """
+        self.root = root
+        self.root.mkdir(exist_ok=True, parents=True)
+        self.max_bytes = max_bytes
+        # 文件名 -> 大小，按访问时间从旧到新排列
+        self._files: 'OrderedDict[str, int]' = OrderedDict()
+        self.total_bytes = 0
+        # 文件名 -> 引用计数，正在使用（例如拼图中）的封面不会被淘汰
+        self._pins: Dict[str, int] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._load()
+
+    def path_of(self, album_id: str, size: str = '') -> Path:
+        return self.root / f"{album_id}{size}.jpg"
+
+    def tmp_path(self, album_id: str, size: str = '') -> Path:
+        """下载用的临时文件（以 . 开头，下载完成后通过 put 放入缓存）"""
+        return self.root / f".{time.time_ns()}-{album_id}{size}.jpg"
+
+    def get(self, album_id: str, size: str = '') -> Optional[Path]:
+        """已缓存时返回封面路径，并刷新访问时间"""
+        path = self.path_of(album_id, size)
+        if path.name not in self._files:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._files.move_to_end(path.name)
+        try:
+            os.utime(path)
+        except OSError:
+            # 文件被外部删除
+            self.total_bytes -= self._files.pop(path.name)
+            return None
+        return path
+
+    def put(self, album_id: str, size: str, tmp_file: Path) -> Path:
+        """把下载好的临时文件放入缓存，然后按需淘汰"""
+        path = self.path_of(album_id, size)
+        os.replace(tmp_file, path)
+        self.total_bytes -= self._files.pop(path.name, 0)
+        self._files[path.name] = path.stat().st_size
+        self.total_bytes += self._files[path.name]
+        self._evict()
+        return path
+
+    def pin(self, album_ids: Iterable[str], size: str = ''):
+        """标记封面正在使用，不会被淘汰（可以在封面下载之前调用）"""
+        for album_id in album_ids:
+            name = self.path_of(album_id, size).name
+            self._pins[name] = self._pins.get(name, 0) + 1
+
+    def unpin(self, album_ids: Iterable[str], size: str = ''):
+        for album_id in album_ids:
+            name = self.path_of(album_id, size).name
+            count = self._pins.get(name, 0) - 1
+            if count > 0:
+                self._pins[name] = count
+            else:
+                self._pins.pop(name, None)
+        self._evict()
+
+    def stats(self) -> dict:
+        return {
+            'covers': len(self._files),
+            'bytes': self.total_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def _evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        # 从最久未访问的开始，跳过正在使用的和最新放入的封面
+        for name in list(self._files)[:-1]:
+            if self.total_bytes <= self.max_bytes:
+                break
+            if name in self._pins:
+                continue
+            self.total_bytes -= self._files.pop(name)
+            self.evictions += 1
+            try:
+                (self.root / name).unlink()
+            except OSError:
+                pass
+
+    def _load(self):
+        entries = []
+        for child in self.root.iterdir():
+            if child.name.startswith('.'):
+                # 上次运行中断的下载
+                child.unlink(missing_ok=True)
+            elif child.suffix == '.jpg':
+                stat = child.stat()
+                entries.append((stat.st_mtime, child.name, stat.st_size))
+
+        for _, name, size in sorted(entries):
+            self._files[name] = size
+            self.total_bytes += size
+        self._evict()
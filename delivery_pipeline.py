@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+发送流水线
+下载 (fetch)、预处理 (decode)、上传 (upload) 三个阶段同时进行，阶段之间都有上限：
+- 下载 -> 预处理: put() 把下载好的页面交给预处理（进程池），预处理中和等待上传的页面最多 decode_ahead 张，
+  满了 put() 就等待
+- 预处理 -> 上传: 上传任务按页面顺序取出预处理结果交给上传器，上传器控制每个会话同时发送的请求数
+上传跟不上时 put() 等待，AlbumStream 的订阅者停止读取，下载线程随之在 FetchWindow 处暂停，
+所以无论本子多大，内存中的页面和领先的下载都是有限的。
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Collection, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryPipeline:
+    """一个会话发送一个本子的流水线，只能在事件循环线程中使用"""
+
+    def __init__(self, uploader, prepare: Optional[Callable[..., Awaitable[list]]] = None,
+                 skip: Collection = (), decode_ahead: int = 20):
+        """初始化（立即启动上传任务）
+
+        Args:
+            uploader: MediaGroupUploader / ArchiveUploader
+            prepare: 预处理函数 (page) -> [page, ...]，为 None 时原样上传
+            skip: 不再发送的页面 (photo_index, page_index, part)，例如重启前已经发送过的
+            decode_ahead: 预处理中和等待上传的页面数上限
+        """
+        self.uploader = uploader
+        self.prepare = prepare
+        self.skip = skip
+        # (page, 预处理 Future)，None 表示结束
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, decode_ahead))
+        self._task = asyncio.ensure_future(self._upload_loop())
+
+    async def put(self, page):
+        """交给预处理；等待上传的页面已满时等待"""
+        future = asyncio.ensure_future(self.prepare(page)) if self.prepare is not None else None
+        await self._queue.put((page, future))
+
+    async def close(self):
+        """所有页面都已 put：等待预处理和上传完成，发送剩余的页面"""
+        await self._queue.put(None)
+        await self._task
+        await self.uploader.flush()
+
+    def cancel(self):
+        """取消上传任务和预处理中的页面（任务被取消时调用）"""
+        self._task.cancel()
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None and item[1] is not None:
+                item[1].cancel()
+        self.uploader.cancel()
+
+    async def _upload_loop(self):
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            page, future = item
+            try:
+                parts = await future if future is not None else [page]
+                for part in parts:
+                    if (part.photo_index, part.page_index, part.part) not in self.skip:
+                        await self.uploader.add(part)
+            except Exception as e:
+                # 单页出错不影响后面的页面
+                logger.error(f"发送页面失败: {page.path or page.file_id}, {e}")
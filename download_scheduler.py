@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+下载任务调度
+- 全局最多 max_workers 个下载同时进行
+- 排队的任务在用户之间轮询分配，一个用户提交再多任务也不会饿死其他用户
+- 每个用户的下载/搜索次数用令牌桶限速
+- 可选的准入检查（例如内存预算），不满足时暂缓启动新任务
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """令牌桶：最多 capacity 个令牌，每 period 秒恢复 capacity 个"""
+
+    def __init__(self, capacity: int, period: float = 3600):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self) -> bool:
+        """取一个令牌，没有令牌时返回 False"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        """距离下一个令牌可用的秒数"""
+        self._refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """按用户划分的令牌桶限速"""
+
+    def __init__(self, max_per_hour: int):
+        self.max_per_hour = max_per_hour
+        self.buckets: Dict[int, TokenBucket] = {}
+
+    def acquire(self, user_id: int) -> float:
+        """尝试消耗一次额度
+
+        Returns:
+            0 表示允许，否则为需要等待的秒数
+        """
+        if self.max_per_hour <= 0:
+            return 0
+
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            bucket = self.buckets[user_id] = TokenBucket(self.max_per_hour)
+
+        if bucket.try_acquire():
+            return 0
+        return bucket.retry_after()
+
+
+@dataclass
+class DownloadJob:
+    user_id: int
+    name: str
+    run: Callable[[], Awaitable[None]]
+    # 排队位置变化回调 (position)，position 从1开始，变为 0 表示轮到该任务执行
+    on_position: Optional[Callable[[int], Awaitable[None]]] = None
+    position: int = 0
+    done: asyncio.Future = field(default=None)
+
+
+class DownloadScheduler:
+    """公平的下载任务调度器
+
+    submit() 只负责排队并立即返回，任务由 max_workers 个 worker 协程执行。
+    每次分配任务时按用户轮询：取队头用户的第一个任务，该用户如果还有任务就排到用户队尾。
+    """
+
+    def __init__(self, max_workers: int,
+                 admission: Optional[Callable[[], bool]] = None,
+                 after_job: Optional[Callable[[], None]] = None,
+                 admission_retry: float = 2.0):
+        """初始化
+
+        Args:
+            max_workers: 最多同时执行的任务数
+            admission: 启动新任务前的检查，返回 False 时暂缓（没有任务在执行时总是放行）
+            after_job: 每个任务结束后调用（例如回收内存）
+            admission_retry: 准入检查未通过时的重试间隔 (秒)
+        """
+        self.max_workers = max(1, max_workers)
+        self.admission = admission
+        self.after_job = after_job
+        self.admission_retry = admission_retry
+        # user_id -> 该用户排队中的任务，OrderedDict 的顺序即轮询顺序
+        self._queues: 'OrderedDict[int, Deque[DownloadJob]]' = OrderedDict()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._workers = []
+        self.active_jobs = 0
+
+    @property
+    def queued_jobs(self) -> int:
+        return sum(len(jobs) for jobs in self._queues.values())
+
+    def start(self):
+        """在事件循环中启动 worker（首次 submit 时自动调用）"""
+        if self._workers:
+            return
+        self._wakeup = asyncio.Event()
+        self._workers = [
+            asyncio.create_task(self._worker(i), name=f'download-worker-{i}')
+            for i in range(self.max_workers)
+        ]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, user_id: int, name: str,
+               run: Callable[[], Awaitable[None]],
+               on_position: Optional[Callable[[int], Awaitable[None]]] = None) -> DownloadJob:
+        """提交任务
+
+        Args:
+            user_id: 提交任务的用户
+            name: 任务名称（日志用）
+            run: 任务协程工厂
+            on_position: 排队位置变化回调
+
+        Returns:
+            DownloadJob，job.position 为需要等待时的排队位置（从1开始，0 表示马上开始），
+            job.done 在任务结束时完成
+        """
+        self.start()
+        job = DownloadJob(user_id, name, run, on_position,
+                          done=asyncio.get_event_loop().create_future())
+        self._queues.setdefault(user_id, deque()).append(job)
+        logger.info(f"任务入队: {name} (用户 {user_id})，排队中 {self.queued_jobs} 个")
+        self._update_positions()
+        self._wakeup.set()
+        return job
+
+    def dispatch_order(self):
+        """按轮询规则展开所有排队任务，得到它们将被执行的顺序"""
+        queues = [list(jobs) for jobs in self._queues.values()]
+        order = []
+        depth = 0
+        while True:
+            row = [jobs[depth] for jobs in queues if depth < len(jobs)]
+            if not row:
+                return order
+            order.extend(row)
+            depth += 1
+
+    def _next_job(self) -> Optional[DownloadJob]:
+        if not self._queues:
+            return None
+        user_id, jobs = self._queues.popitem(last=False)
+        job = jobs.popleft()
+        if jobs:
+            # 还有任务的用户排到轮询队尾
+            self._queues[user_id] = jobs
+        return job
+
+    def _update_positions(self):
+        # 空闲 worker 马上会取走前 free_slots 个任务，这些任务不算排队
+        free_slots = max(0, self.max_workers - self.active_jobs)
+        for index, job in enumerate(self.dispatch_order(), 1):
+            position = max(0, index - free_slots)
+            if job.position != position:
+                waited = job.position > 0
+                job.position = position
+                if position > 0 or waited:
+                    self._notify(job, position)
+
+    def _notify(self, job: DownloadJob, position: int):
+        if job.on_position is None:
+            return
+
+        async def _call():
+            try:
+                await job.on_position(position)
+            except Exception as e:
+                logger.warning(f"排队位置回调错误: {e}")
+
+        asyncio.create_task(_call())
+
+    def _admit(self) -> bool:
+        # 至少保证有一个任务在执行，避免所有任务都停住
+        if self.admission is None or self.active_jobs == 0:
+            return True
+        try:
+            return self.admission()
+        except Exception as e:
+            logger.warning(f"准入检查错误: {e}")
+            return True
+
+    async def _worker(self, index: int):
+        while True:
+            if not self._queues:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            if not self._admit():
+                await asyncio.sleep(self.admission_retry)
+                continue
+
+            job = self._next_job()
+            self.active_jobs += 1
+            if job.position > 0:
+                job.position = 0
+                self._notify(job, 0)
+            self._update_positions()
+            logger.info(f"worker-{index} 开始任务: {job.name}")
+            try:
+                await job.run()
+            except Exception as e:
+                logger.error(f"任务执行错误: {job.name}, {e}", exc_info=True)
+            finally:
+                self.active_jobs -= 1
+                if self.after_job is not None:
+                    try:
+                        self.after_job()
+                    except Exception as e:
+                        logger.warning(f"任务结束回调错误: {e}")
+                if not job.done.done():
+                    job.done.set_result(None)
+                logger.info(f"worker-{index} 完成任务: {job.name}")
+                self._update_positions()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+下载工作进程
+多进程模式下，机器人进程只处理 Telegram 更新，jmcomic 下载在独立的工作进程中执行：
+- 每个工作进程通过 socketpair 与机器人进程通信（multiprocessing.connection.Connection，pickle 消息）
+- 工作进程每下载完一张图片就把 PageRef 发回机器人进程，机器人进程照常流式发送
+- 工作进程执行 max_jobs 个任务，或任务结束后 RSS 超过 max_rss_bytes 时退出，下一个任务启动新进程
+工作进程崩溃（内存不足被杀、库中的段错误）只会让当前任务失败，不影响机器人进程
+"""
+import importlib
+import logging
+import signal
+import socket
+import subprocess
+import sys
+import threading
+from multiprocessing.connection import Connection
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from jmcomic_wrapper import StreamingDownloader, build_option, run_album_download
+from memory_governor import read_rss, release_memory
+
+logger = logging.getLogger(__name__)
+
+# 退出时等待工作进程结束的秒数，超时后强制结束
+STOP_TIMEOUT = 5
+
+# 连接的收发缓冲区：机器人进程因背压停止读取时，工作进程很快在发送页面时阻塞，下载随之暂停
+SOCKET_BUFFER = 16 * 1024
+
+
+class WorkerCrashed(RuntimeError):
+    """工作进程在任务执行中退出"""
+
+
+class _Worker:
+    """一个工作进程及其连接"""
+
+    def __init__(self, download_dir: Path, preload: List[str]):
+        parent_sock, child_sock = socket.socketpair()
+        parent_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER)
+        child_sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER)
+        with child_sock:
+            self.process = subprocess.Popen(
+                [sys.executable, str(Path(__file__).resolve()), str(child_sock.fileno()), str(download_dir), *preload],
+                pass_fds=(child_sock.fileno(),)
+            )
+        self.conn = Connection(parent_sock.detach())
+        self.jobs = 0
+        self.rss = 0
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    def stop(self):
+        """关闭连接，工作进程读到 EOF 后退出"""
+        self.conn.close()
+        try:
+            self.process.wait(timeout=STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+    def kill(self):
+        self.conn.close()
+        self.process.kill()
+        self.process.wait()
+
+
+class DownloadWorkerPool:
+    """下载工作进程池，run 在下载通道线程中调用（阻塞）"""
+
+    def __init__(self, processes: int, download_dir: Path, max_jobs: int = 20, max_rss_bytes: int = 0,
+                 preload: Optional[List[str]] = None):
+        """初始化（工作进程在第一次需要时启动）
+
+        Args:
+            processes: 工作进程数，也是同时执行的下载数上限
+            download_dir: 下载目录
+            max_jobs: 每个工作进程执行的任务数上限，0 表示不限制
+            max_rss_bytes: 任务结束后工作进程 RSS 超过此值时回收，0 表示不限制
+            preload: 工作进程启动时先导入的模块（例如注册自定义 jmcomic client 的模块）
+        """
+        self.processes = max(1, processes)
+        self.download_dir = download_dir
+        self.max_jobs = max_jobs
+        self.max_rss_bytes = max_rss_bytes
+        self.preload = list(preload or [])
+        self._slots = threading.Semaphore(self.processes)
+        self._lock = threading.Lock()
+        self._idle: List[_Worker] = []
+        self._busy: List[_Worker] = []
+        self._closed = False
+
+        self.started = 0
+        self.recycled = 0
+        self.crashed = 0
+        self.jobs = 0
+
+    def run(self, album_id: str, album, image_threads: int, photo_threads: int,
+            on_page: Callable, on_total: Optional[Callable[[int], None]] = None, selection=None,
+            page_order: bool = False, reorder_window: int = 0):
+        """在工作进程中下载本子，阻塞到下载结束
+
+        Args:
+            album_id: 本子 ID
+            album: 本子详情 (JmAlbumDetail)，为 None 时由工作进程请求
+            image_threads: 单个章节同时下载的图片数
+            photo_threads: 同时下载的章节数
+            on_page: 每下载完一张图片调用一次（在当前线程中）
+            on_total: 总页数确定或变化时调用
+            selection: 只下载的章节/页码范围 (DownloadSelection)，为 None 时下载整本
+            page_order: 图片按页面顺序下载
+            reorder_window: 页面按顺序发回前最多缓冲的页数，0 表示按完成顺序发回
+
+        Raises:
+            WorkerCrashed: 工作进程在任务执行中退出
+        """
+        with self._slots:
+            worker = self._acquire()
+            try:
+                worker.conn.send((album_id, album, image_threads, photo_threads, selection, page_order, reorder_window))
+                while True:
+                    message = worker.conn.recv()
+                    kind = message[0]
+                    if kind == 'page':
+                        on_page(message[1])
+                    elif kind == 'total':
+                        if on_total is not None:
+                            on_total(message[1])
+                    elif kind == 'done':
+                        _, result, worker.rss = message
+                        break
+            except (EOFError, OSError) as e:
+                self._discard(worker)
+                worker.kill()
+                with self._lock:
+                    self.crashed += 1
+                logger.error(f"下载进程 {worker.pid} 异常退出 (exit code {worker.process.returncode}): {album_id}")
+                raise WorkerCrashed(f"下载进程异常退出: {e!r}") from e
+            except BaseException:
+                # 消息处理出错时工作进程仍在下载，不能再分配给其他任务
+                self._discard(worker)
+                worker.kill()
+                raise
+
+            worker.jobs += 1
+            self._release(worker)
+            return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'processes': self.processes,
+                'idle': len(self._idle),
+                'busy': len(self._busy),
+                'rss': {worker.pid: worker.rss for worker in self._idle + self._busy},
+                'jobs': self.jobs,
+                'started': self.started,
+                'recycled': self.recycled,
+                'crashed': self.crashed,
+            }
+
+    def shutdown(self):
+        """停止所有工作进程（正在执行的任务直接结束）"""
+        with self._lock:
+            self._closed = True
+            idle, busy = self._idle, self._busy
+            self._idle, self._busy = [], []
+        for worker in idle:
+            worker.stop()
+        for worker in busy:
+            worker.kill()
+
+    def _acquire(self) -> _Worker:
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("下载进程池已关闭")
+            worker = self._idle.pop() if self._idle else None
+        if worker is None:
+            worker = _Worker(self.download_dir, self.preload)
+            logger.info(f"启动下载进程 {worker.pid}")
+            with self._lock:
+                self.started += 1
+        with self._lock:
+            self.jobs += 1
+            self._busy.append(worker)
+        return worker
+
+    def _discard(self, worker: _Worker):
+        with self._lock:
+            if worker in self._busy:
+                self._busy.remove(worker)
+
+    def _release(self, worker: _Worker):
+        retire = (
+            (self.max_jobs > 0 and worker.jobs >= self.max_jobs)
+            or (self.max_rss_bytes > 0 and worker.rss > self.max_rss_bytes)
+        )
+        with self._lock:
+            if worker in self._busy:
+                self._busy.remove(worker)
+            if not retire and not self._closed:
+                self._idle.append(worker)
+                return
+            if retire:
+                self.recycled += 1
+
+        if retire:
+            logger.info(f"回收下载进程 {worker.pid}: {worker.jobs} 个任务, RSS {worker.rss / 1024 / 1024:.0f}MB")
+        worker.stop()
+
+
+def worker_main(fd: int, download_dir: Path, preload: List[str]):
+    """工作进程入口：逐个执行机器人进程发来的下载任务，连接关闭时退出"""
+    for module in preload:
+        importlib.import_module(module)
+
+    # Ctrl+C 发给整个进程组，由机器人进程负责关闭工作进程
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    conn = Connection(fd)
+    option = build_option(download_dir)
+    client = None
+    # 下载线程并发推送页面，Connection.send 不是线程安全的
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    while True:
+        try:
+            album_id, album, image_threads, photo_threads, selection, page_order, reorder_window = conn.recv()
+        except EOFError:
+            break
+
+        if client is None:
+            # 与机器人进程相同：关闭 client 自带的永久缓存，downloader 通过 field_cache 拿到这个 client
+            client = option.build_jm_client(cache=False)
+        option.download.threading.image = image_threads
+        option.download.threading.photo = photo_threads
+
+        dler = StreamingDownloader(
+            option, None,
+            on_page=lambda page: send(('page', page)),
+            on_total=lambda total: send(('total', total)),
+            selection=selection,
+            page_order=page_order,
+            reorder_window=reorder_window
+        )
+        result = run_album_download(dler, album_id, album)
+        del dler
+        release_memory()
+        send(('done', result, read_rss()))
+
+
+if __name__ == '__main__':
+    worker_main(int(sys.argv[1]), Path(sys.argv[2]), sys.argv[3:])
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+执行通道
+每个通道是一个独立的线程池，互不阻塞：
+- fast: 搜索、本子详情等元数据请求，耗时短，要求低延迟
+- download: 下载和 PDF 生成等耗时任务
+- prefetch: 预取搜索结果的详情和封面，优先级最低，可以取消
+
+每个任务从提交到开始执行的排队时间会被记录，用来判断通道是否饱和
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class ExecutionLane:
+    """带排队时间统计的线程池"""
+
+    def __init__(self, name: str, max_workers: int, slow_wait: float = 1.0, sample_size: int = 256):
+        """初始化
+
+        Args:
+            name: 通道名称
+            max_workers: 线程数
+            slow_wait: 排队超过该秒数时打印警告
+            sample_size: 计算排队时间分位数所用的最近样本数
+        """
+        self.name = name
+        self.slow_wait = slow_wait
+        self.max_workers = max(1, max_workers)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f'lane-{name}')
+
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=sample_size)
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    async def run(self, func: Callable[..., T], *args) -> T:
+        """在通道的线程池中执行 func(*args)
+
+        还在排队时被取消的任务不会再执行；已经开始执行的任务会执行完，只是结果被丢弃。
+        """
+        submitted_at = time.monotonic()
+        with self._lock:
+            self.queued += 1
+        # [是否已开始, 是否已取消]
+        state = [False, False]
+
+        def _call():
+            wait = time.monotonic() - submitted_at
+            if not self._on_start(wait, state):
+                return None
+            try:
+                return func(*args)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+
+        loop = asyncio.get_event_loop()
+        try:
+            return await loop.run_in_executor(self.executor, _call)
+        except asyncio.CancelledError:
+            with self._lock:
+                if not state[0]:
+                    state[1] = True
+                    self.queued -= 1
+                    self.cancelled += 1
+            raise
+
+    def _on_start(self, wait: float, state: list) -> bool:
+        with self._lock:
+            if state[1]:
+                return False
+            state[0] = True
+            self.queued -= 1
+            self.running += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self._waits.append(wait)
+
+        if wait >= self.slow_wait:
+            logger.warning(f"{self.name} 通道排队 {wait:.2f} 秒，通道可能已饱和 "
+                           f"(线程 {self.max_workers}，排队中 {self.queued})")
+        return True
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            waits = sorted(self._waits)
+            started = self.completed + self.running
+            return {
+                'max_workers': self.max_workers,
+                'queued': self.queued,
+                'running': self.running,
+                'completed': self.completed,
+                'cancelled': self.cancelled,
+                'wait_avg': self.total_wait / started if started else 0.0,
+                'wait_p95': waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+                'wait_max': self.max_wait,
+            }
+
+    def shutdown(self, wait: bool = False):
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Telegram file_id 缓存
+记录每张页面第一次上传后 Telegram 返回的 file_id，
+同一个本子再次被请求时直接用 file_id 转发，不再下载和上传
+"""
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (photo_id, photo_index, page_index, part, file_id)
+CachedPage = Tuple[str, int, int, int, str]
+
+# pages 表结构版本，记录在 PRAGMA user_version 中
+SCHEMA_VERSION = 1
+
+
+def album_version(album) -> str:
+    """本子的版本标识，变化时缓存失效
+
+    API 客户端返回的 update_date 固定为 '0'，所以同时带上章节 ID 列表，
+    新增章节也能让缓存失效。
+    """
+    photo_ids = ','.join(str(episode[0]) for episode in album.episode_list)
+    return f"{album.update_date}|{photo_ids}"
+
+
+class FileIdCache:
+    """基于 sqlite 的 (album_id, photo_id, page_index, part) → file_id 映射"""
+
+    def __init__(self, db_path: Path):
+        """初始化
+
+        Args:
+            db_path: sqlite 数据库文件路径
+        """
+        db_path.parent.mkdir(exist_ok=True, parents=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        if self._conn.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+            # 旧版本的 pages 表没有 part 列，直接丢弃（缓存会在下次发送时重建）
+            self._conn.execute('DROP TABLE IF EXISTS pages')
+            self._conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS albums (
+                album_id   TEXT PRIMARY KEY,
+                version    TEXT NOT NULL,
+                page_total INTEGER NOT NULL DEFAULT 0,
+                complete   INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS pages (
+                album_id    TEXT NOT NULL,
+                photo_id    TEXT NOT NULL,
+                photo_index INTEGER NOT NULL,
+                page_index  INTEGER NOT NULL,
+                part        INTEGER NOT NULL DEFAULT 0,
+                file_id     TEXT NOT NULL,
+                PRIMARY KEY (album_id, photo_id, page_index, part)
+            );
+        ''')
+        self._conn.commit()
+
+    def get_album(self, album_id: str, version: str) -> Optional[List[CachedPage]]:
+        """获取已完整发送过的本子的全部页面，按页面顺序排列
+
+        Returns:
+            版本一致且之前完整发送过时返回页面列表，否则返回 None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT version, page_total, complete FROM albums WHERE album_id = ?',
+                (album_id,)
+            ).fetchone()
+
+            if row is None or row[0] != version or not row[2]:
+                return None
+
+            pages = self._conn.execute(
+                'SELECT photo_id, photo_index, page_index, part, file_id FROM pages '
+                'WHERE album_id = ? ORDER BY photo_index, page_index, part',
+                (album_id,)
+            ).fetchall()
+
+        if len(pages) != row[1]:
+            return None
+        return pages
+
+    def begin_album(self, album_id: str, version: str):
+        """开始发送一个本子，版本变化时清除旧的 file_id"""
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                'SELECT version FROM albums WHERE album_id = ?',
+                (album_id,)
+            ).fetchone()
+
+            if row is not None and row[0] != version:
+                logger.info(f"本子 {album_id} 已更新，清除 file_id 缓存")
+                self._conn.execute('DELETE FROM pages WHERE album_id = ?', (album_id,))
+
+            self._conn.execute(
+                'INSERT INTO albums (album_id, version, page_total, complete, updated_at) '
+                'VALUES (?, ?, 0, 0, ?) '
+                'ON CONFLICT(album_id) DO UPDATE SET version = excluded.version, complete = 0, '
+                'updated_at = excluded.updated_at',
+                (album_id, version, time.time())
+            )
+
+    def put_page(self, album_id: str, photo_id: str, photo_index: int, page_index: int, part: int, file_id: str):
+        """记录一张页面（或超长页面切分后的一段）的 file_id"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO pages (album_id, photo_id, photo_index, page_index, part, file_id) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (album_id, photo_id, photo_index, page_index, part, file_id)
+            )
+
+    def mark_complete(self, album_id: str, page_total: int):
+        """本子的全部页面都已发送成功"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'UPDATE albums SET complete = 1, page_total = ?, updated_at = ? WHERE album_id = ?',
+                (page_total, time.time(), album_id)
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,43 +1,180 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-简单的健康检查 HTTP 服务器
-在后台运行，让 Railway 知道服务还活着
+HTTP 服务器（运行在机器人的事件循环中，不再单独开线程）
+- /、/health: 健康检查，让 Railway 知道服务还活着
+- /stats: 运行统计 (JSON)
+- /metrics: Prometheus 指标
+- webhook 模式下接收 Telegram 推送的更新 (POST webhook_path)
 """
-from http.server import HTTPServer, BaseHTTPRequestHandler
-import threading
+import asyncio
+import hmac
+import json
 import logging
+from typing import Awaitable, Callable, Dict, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+# Telegram 设置 webhook 时的 secret_token 会放在这个请求头里
+SECRET_TOKEN_HEADER = 'x-telegram-bot-api-secret-token'
 
-class HealthCheckHandler(BaseHTTPRequestHandler):
-    """健康检查处理器"""
+# 请求体上限，Telegram 的单个更新远小于这个值
+MAX_BODY_SIZE = 1024 * 1024
 
-    def do_GET(self):
-        """处理 GET 请求"""
-        if self.path == '/health' or self.path == '/':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/plain')
-            self.end_headers()
-            self.wfile.write(b'OK')
-        else:
-            self.send_response(404)
-            self.end_headers()
+# keep-alive 连接的空闲超时 (秒)
+IDLE_TIMEOUT = 75
 
-    def log_message(self, format, *args):
-        """禁用访问日志"""
-        pass
+_REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+            405: 'Method Not Allowed', 413: 'Payload Too Large', 500: 'Internal Server Error'}
 
+Response = Tuple[int, str, bytes]
 
-def start_healthcheck_server(port=8080):
-    """启动健康检查服务器（在后台线程中）"""
+
+class HealthCheckServer:
+    """基于 asyncio.start_server 的极简 HTTP/1.1 服务器"""
+
+    def __init__(self, port: int = 8080,
+                 stats_provider: Optional[Callable[[], Dict]] = None,
+                 metrics_provider: Optional[Callable[[], str]] = None,
+                 webhook_path: Optional[str] = None,
+                 webhook_secret: Optional[str] = None,
+                 on_update: Optional[Callable[[dict], Awaitable[None]]] = None):
+        """初始化
+
+        Args:
+            port: 监听端口
+            stats_provider: 返回统计信息字典的函数，提供时开启 /stats
+            metrics_provider: 返回 Prometheus 文本的函数，提供时开启 /metrics
+            webhook_path: 接收 Telegram 更新的路径，为 None 时不开启 webhook
+            webhook_secret: 校验请求头中的 secret_token
+            on_update: 收到更新时的回调 (update_json)
+        """
+        self.port = port
+        self.stats_provider = stats_provider
+        self.metrics_provider = metrics_provider
+        self.webhook_path = webhook_path
+        self.webhook_secret = webhook_secret
+        self.on_update = on_update
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, '0.0.0.0', self.port)
+        logger.info(f"HTTP 服务器启动在端口 {self.port}")
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request = await asyncio.wait_for(self._read_request(reader), IDLE_TIMEOUT)
+                if request is None:
+                    break
+                method, path, headers, body = request
+
+                try:
+                    status, content_type, payload = await self._route(method, path, headers, body)
+                except Exception as e:
+                    logger.error(f"处理请求错误: {method} {path}, {e}", exc_info=True)
+                    status, content_type, payload = 500, 'text/plain', b'Internal Server Error'
+
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(
+                    f'HTTP/1.1 {status} {_REASONS.get(status, "")}\r\n'
+                    f'Content-Type: {content_type}\r\n'
+                    f'Content-Length: {len(payload)}\r\n'
+                    f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode() + payload
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_request(reader: asyncio.StreamReader):
+        """读取一个请求，连接关闭时返回 None"""
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, target, _ = request_line.decode('latin-1').split(' ', 2)
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+
+        length = int(headers.get('content-length') or 0)
+        if length > MAX_BODY_SIZE:
+            raise ValueError(f'请求体过大: {length}')
+        body = await reader.readexactly(length) if length else b''
+        return method.upper(), target.split('?', 1)[0], headers, body
+
+    async def _route(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> Response:
+        if self.webhook_path is not None and path == self.webhook_path:
+            if method != 'POST':
+                return 405, 'text/plain', b'Method Not Allowed'
+            return await self._handle_webhook(headers, body)
+
+        if method != 'GET':
+            return 405, 'text/plain', b'Method Not Allowed'
+
+        if path in ('/', '/health'):
+            return 200, 'text/plain', b'OK'
+
+        if path == '/stats' and self.stats_provider is not None:
+            # 运行统计：执行通道排队时间、缓存命中等
+            body = json.dumps(self.stats_provider(), ensure_ascii=False, indent=2).encode()
+            return 200, 'application/json; charset=utf-8', body
+
+        if path == '/metrics' and self.metrics_provider is not None:
+            body = self.metrics_provider().encode()
+            return 200, 'text/plain; version=0.0.4; charset=utf-8', body
+
+        return 404, 'text/plain', b'Not Found'
+
+    async def _handle_webhook(self, headers: Dict[str, str], body: bytes) -> Response:
+        if self.webhook_secret and not hmac.compare_digest(
+                headers.get(SECRET_TOKEN_HEADER, ''), self.webhook_secret):
+            return 403, 'text/plain', b'Forbidden'
+
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return 400, 'text/plain', b'Bad Request'
+
+        # 只负责放入更新队列，处理由 Application 完成，尽快给 Telegram 返回 200
+        await self.on_update(data)
+        return 200, 'text/plain', b'OK'
+
+
+async def start_healthcheck_server(port=8080, stats_provider=None, metrics_provider=None,
+                                   webhook_path=None, webhook_secret=None, on_update=None):
+    """在当前事件循环中启动 HTTP 服务器
+
+    Args:
+        port: 监听端口
+        stats_provider: 返回统计信息字典的函数，提供时开启 /stats
+        metrics_provider: 返回 Prometheus 文本的函数，提供时开启 /metrics
+        webhook_path: 接收 Telegram 更新的路径，为 None 时不开启 webhook
+        webhook_secret: 校验请求头中的 secret_token
+        on_update: 收到更新时的回调 (update_json)
+
+    Returns:
+        HealthCheckServer，启动失败返回 None
+    """
     try:
-        server = HTTPServer(('0.0.0.0', port), HealthCheckHandler)
-        thread = threading.Thread(target=server.serve_forever, daemon=True)
-        thread.start()
-        logger.info(f"健康检查服务器启动在端口 {port}")
-        return server
+        server = HealthCheckServer(port, stats_provider, metrics_provider, webhook_path, webhook_secret, on_update)
+        return await server.start()
     except Exception as e:
-        logger.warning(f"无法启动健康检查服务器: {e}")
+        logger.warning(f"无法启动 HTTP 服务器: {e}")
         return None
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上传前的图片预处理
+Telegram 对图片（send_photo / 图片组）的限制：
+- 文件不超过 10MB
+- 宽 + 高不超过 10000 像素
+- 宽高比不超过 20
+
+超出限制的页面在进程池中缩放、重新编码为 JPEG，超长的页面切成几段、超宽的页面上下补白，
+Pillow 的解码/编码不会占用事件循环所在进程的 GIL
+"""
+import asyncio
+import io
+import logging
+import math
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+from PIL import Image
+
+from metrics import PAGE_PREPROCESS_SECONDS
+
+logger = logging.getLogger(__name__)
+
+PHOTO_MAX_BYTES = 10 * 1024 * 1024
+PHOTO_MAX_DIMENSION_SUM = 10000
+PHOTO_MAX_RATIO = 20
+
+# 超长页面切分后，每段高度不超过宽度的 SPLIT_RATIO 倍
+SPLIT_RATIO = 5
+
+# 重新编码时质量的下限，低于它改为继续缩小尺寸
+MIN_QUALITY = 50
+
+
+def needs_preprocess(img_file: Path, max_bytes: int = PHOTO_MAX_BYTES) -> bool:
+    """只读取文件大小和图片头，判断是否超出 Telegram 图片限制"""
+    if img_file.stat().st_size > max_bytes:
+        return True
+    with Image.open(img_file) as img:
+        width, height = img.size
+    return (
+        width + height > PHOTO_MAX_DIMENSION_SUM
+        or max(width, height) > PHOTO_MAX_RATIO * min(width, height)
+    )
+
+
+def process_page(img_file: str, quality: int, max_bytes: int = PHOTO_MAX_BYTES) -> List[bytes]:
+    """把一张页面处理成符合限制的若干张 JPEG（在子进程中执行）
+
+    Args:
+        img_file: 图片路径
+        quality: JPEG 质量 (1-100)
+        max_bytes: 单张图片大小上限
+
+    Returns:
+        JPEG 数据列表，超长页面会切成多段，按从上到下的顺序排列
+    """
+    with Image.open(img_file) as img:
+        rgb = img.convert('RGB')
+
+    width, height = rgb.size
+    parts = []
+    if height > PHOTO_MAX_RATIO * width:
+        count = math.ceil(height / (width * SPLIT_RATIO))
+        step = math.ceil(height / count)
+        for top in range(0, height, step):
+            piece = rgb.crop((0, top, width, min(height, top + step)))
+            parts.append(_encode_within_limits(piece, quality, max_bytes))
+            piece.close()
+    elif width > PHOTO_MAX_RATIO * height:
+        # 超宽的页面上下补白到允许的宽高比
+        canvas = Image.new('RGB', (width, math.ceil(width / (PHOTO_MAX_RATIO - 1))), 'white')
+        canvas.paste(rgb, (0, (canvas.height - height) // 2))
+        parts.append(_encode_within_limits(canvas, quality, max_bytes))
+        canvas.close()
+    else:
+        parts.append(_encode_within_limits(rgb, quality, max_bytes))
+
+    rgb.close()
+    return parts
+
+
+def _encode_within_limits(img: Image.Image, quality: int, max_bytes: int) -> bytes:
+    width, height = img.size
+    scale = min(1.0, (PHOTO_MAX_DIMENSION_SUM - 1) / (width + height))
+
+    while True:
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        resized = img if size == img.size else img.resize(size, Image.LANCZOS)
+
+        # 先降低质量，质量到下限仍然过大时再缩小尺寸
+        for q in range(quality, MIN_QUALITY - 1, -10):
+            buffer = io.BytesIO()
+            resized.save(buffer, format='JPEG', quality=q)
+            if buffer.tell() <= max_bytes:
+                return buffer.getvalue()
+
+        scale *= 0.75
+
+
+class ImagePreprocessor:
+    """在进程池中预处理超出 Telegram 限制的页面"""
+
+    def __init__(self, max_workers: int = 1, quality: int = 85, max_bytes: int = PHOTO_MAX_BYTES):
+        """初始化
+
+        Args:
+            max_workers: 进程数
+            quality: 重新编码的 JPEG 质量 (1-100)
+            max_bytes: 单张图片大小上限，不超过 Telegram 的 10MB
+        """
+        self.max_workers = max(1, max_workers)
+        self.quality = quality
+        self.max_bytes = min(max_bytes, PHOTO_MAX_BYTES)
+        # 首次需要时才启动进程池，大多数页面不需要处理
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._pool
+
+    async def prepare(self, page) -> list:
+        """返回可以直接上传的页面列表
+
+        符合限制的页面原样返回；否则返回处理后的一段或多段，
+        每段的 data 为 JPEG 数据，part 为段序号
+        """
+        if page.path is None:
+            return [page]
+
+        try:
+            if not needs_preprocess(page.path, self.max_bytes):
+                return [page]
+
+            loop = asyncio.get_event_loop()
+            with PAGE_PREPROCESS_SECONDS.time():
+                parts = await loop.run_in_executor(
+                    self.pool, process_page, str(page.path), self.quality, self.max_bytes
+                )
+        except Exception as e:
+            logger.warning(f"图片预处理失败，按原图发送: {page.path}, {e}")
+            return [page]
+
+        logger.info(f"图片已预处理: {page.path.name} -> {len(parts)} 张")
+        return [page._replace(part=i, data=data) for i, data in enumerate(parts)]
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
@@ -5,49 +5,598 @@ JMComic API 封装
 """
 import sys
 from pathlib import Path
-from typing import List, Dict, Optional, Callable
-from PIL import Image
+from typing import List, Dict, Optional, Callable, NamedTuple, Sequence
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
-import os
-
-# 关键：强制限制 Python 默认线程池大小
-# 这会影响所有使用 ThreadPoolExecutor(max_workers=None) 的代码
-os.environ['PYTHONTHREADPOOLSIZE'] = '1'
+import contextlib
+import functools
+import shutil
+import threading
+import time
 
 # 添加 JMComic 库路径
 jm_path = Path(__file__).parent / "JMComic-Crawler-Python" / "src"
 sys.path.insert(0, str(jm_path))
 
-# Monkey Patch: 修改 concurrent.futures 的默认行为
-import concurrent.futures
-_original_threadpool_init = concurrent.futures.ThreadPoolExecutor.__init__
+import jmcomic
 
-def _patched_threadpool_init(self, max_workers=None, *args, **kwargs):
-    """强制限制线程数为 1"""
-    if max_workers is None or max_workers > 1:
-        print(f"[PATCH] ThreadPoolExecutor max_workers 被限制: {max_workers} -> 1")
-        max_workers = 1
-    return _original_threadpool_init(self, max_workers, *args, **kwargs)
+from pdf_writer import StreamingPdfWriter
+from metadata_cache import MetadataCache
+from execution_lane import ExecutionLane
+from album_cache import AlbumDiskCache, dir_size
+from album_index import AlbumIndex
+from contact_sheet import make_contact_sheet
+from cover_store import CoverStore
+from page_order import PageOrderPool, PageReorderBuffer
+from metrics import DOWNLOAD_BYTES, PAGE_DECODE_SECONDS, PAGE_DOWNLOAD_SECONDS, SEARCH_SECONDS
+
+
+IMAGE_SUFFIXES = ('.webp', '.jpg', '.jpeg', '.png')
+
+# 搜索列表页使用的封面小图尺寸后缀
+COVER_SIZE = '_3x4'
+
+# 封面拼图缓存条数（每张几十 KB）
+SHEET_CACHE_SIZE = 64
+
+
+def list_album_images(album_dir: Path) -> List[Path]:
+    """按页面顺序列出本子目录下的所有图片
+
+    目录结构为 <album_dir>/<章节序号>/<图片文件>，章节序号按数字排序
+    """
+    def sort_key(img_file: Path):
+        parts = img_file.relative_to(album_dir).parts
+        return tuple((0, int(part)) if part.isdigit() else (1, part) for part in parts)
+
+    image_files = [f for f in album_dir.rglob('*') if f.suffix.lower() in IMAGE_SUFFIXES and f.is_file()]
+    return sorted(image_files, key=sort_key)
+
+
+def album_author(album) -> str:
+    """本子详情中的作者，多个作者用逗号连接，没有作者时为空字符串"""
+    if hasattr(album, 'authors') and album.authors:
+        return ', '.join(album.authors) if isinstance(album.authors, list) else str(album.authors)
+    if hasattr(album, 'author') and album.author:
+        return ', '.join(album.author) if isinstance(album.author, list) else str(album.author)
+    return ''
+
+
+def build_option(download_dir: Path) -> jmcomic.JmOption:
+    """下载使用的 JmOption"""
+    return jmcomic.JmOption.construct({
+        'dir_rule': {
+            # 每个本子一个目录: base_dir/<album_id>/<章节序号>/00001.webp
+            'rule': 'Bd_Aid_Pindex',
+            'base_dir': str(download_dir)
+        },
+        'download': {
+            # 下载并发从 1 开始，由 MemoryGovernor 按内存预算调整
+            'threading': {
+                'image': 1,
+                'photo': 1
+            }
+        }
+    }, cover_default=True)
+
+
+def instrument_client(client: jmcomic.JmcomicClient):
+    """给 client 的图片请求和解码加上耗时/字节数统计
+
+    JmImageClient.download_image = get_jm_image（网络请求）+ save_image_resp（解码并写入磁盘），
+    这里在实例上包装这两步，分别计入 PAGE_DOWNLOAD_SECONDS 和 PAGE_DECODE_SECONDS。
+    """
+    get_jm_image = client.get_jm_image
+    save_image_resp = client.save_image_resp
+
+    def timed_get_jm_image(img_url):
+        with PAGE_DOWNLOAD_SECONDS.time():
+            resp = get_jm_image(img_url)
+        DOWNLOAD_BYTES.inc(len(resp.content))
+        return resp
+
+    def timed_save_image_resp(*args, **kwargs):
+        with PAGE_DECODE_SECONDS.time():
+            return save_image_resp(*args, **kwargs)
+
+    client.get_jm_image = timed_get_jm_image
+    client.save_image_resp = timed_save_image_resp
+    return client
+
+
+class PageRef(NamedTuple):
+    """一张页面：下载到本地的文件，或已经上传到 Telegram 的 file_id"""
+    photo_id: str
+    photo_index: int  # 章节在本子中的序号，从1开始
+    page_index: int  # 图片在章节中的序号，从1开始
+    path: Optional[Path] = None
+    file_id: Optional[str] = None
+    part: int = 0  # 超长页面切分后的段序号，从0开始
+    data: Optional[bytes] = None  # 预处理后的 JPEG 数据，优先于 path 上传
+
+
+class DownloadSelection(NamedTuple):
+    """只下载本子的一部分：一个章节和/或章节内的页码范围
+
+    chapter 为章节在 episode_list 中的序号（从1开始），0 表示全部章节；
+    页码范围在每个选中的章节内计算，last_page 为 0 表示到章节结尾。
+    """
+    chapter: int = 0
+    first_page: int = 1
+    last_page: int = 0
+
+    @classmethod
+    def parse(cls, args: Sequence[str]) -> 'DownloadSelection':
+        """解析 /download <id> 之后的参数：纯数字为章节，带 - 的为页码范围（a-b、a-、-b）
 
-concurrent.futures.ThreadPoolExecutor.__init__ = _patched_threadpool_init
+        Raises:
+            ValueError: 参数格式错误
+        """
+        chapter, first_page, last_page = 0, 1, 0
+        pages_given = False
+        for arg in args:
+            if arg.isdigit() and not chapter:
+                chapter = int(arg)
+                if chapter < 1:
+                    raise ValueError(f"章节序号从 1 开始: {arg}")
+            elif '-' in arg and not pages_given:
+                start, _, end = arg.partition('-')
+                if not (start.isdigit() or not start) or not (end.isdigit() or not end):
+                    raise ValueError(f"页码范围格式错误: {arg}")
+                first_page = int(start) if start else 1
+                last_page = int(end) if end else 0
+                if first_page < 1 or (last_page and last_page < first_page):
+                    raise ValueError(f"页码范围无效: {arg}")
+                pages_given = True
+            else:
+                raise ValueError(f"无法识别的参数: {arg}")
+        return cls(chapter, first_page, last_page)
+
+    @property
+    def is_full(self) -> bool:
+        return self.chapter == 0 and self.first_page == 1 and self.last_page == 0
+
+    @property
+    def spec(self) -> str:
+        """与 parse 对应的参数字符串，整本时为空（任务日志、按钮回调中使用）"""
+        parts = [str(self.chapter)] if self.chapter else []
+        if self.first_page != 1 or self.last_page:
+            parts.append(f"{self.first_page}-{self.last_page or ''}")
+        return ' '.join(parts)
+
+    def describe(self) -> str:
+        """给用户看的范围描述，例如 第 3 章 第 1-20 页"""
+        parts = [f"第 {self.chapter} 章"] if self.chapter else []
+        if self.first_page != 1 or self.last_page:
+            parts.append(f"第 {self.first_page}-{self.last_page or '末'} 页")
+        return ' '.join(parts) or '全部'
+
+    def filter_album(self, album: jmcomic.JmAlbumDetail) -> list:
+        """do_filter: 本子中要下载的章节"""
+        if not self.chapter:
+            return list(album)
+        return [album[self.chapter - 1]] if self.chapter <= len(album) else []
+
+    def filter_photo(self, photo: jmcomic.JmPhotoDetail) -> list:
+        """do_filter: 章节中要下载的图片"""
+        end = min(self.last_page or len(photo), len(photo))
+        return photo[self.first_page - 1:end] if self.first_page <= end else []
+
+    def page_count(self, photo_pages: int) -> int:
+        """章节共 photo_pages 页时选中的页数"""
+        end = min(self.last_page or photo_pages, photo_pages)
+        return max(0, end - self.first_page + 1)
+
+    def page_filter(self, album: Optional[jmcomic.JmAlbumDetail]) -> Callable[[str, int, int], bool]:
+        """已经下载/上传过的页面 (photo_id, photo_index, page_index) 是否在范围内
+
+        用于从磁盘缓存、file_id 缓存或正在进行的整本下载中挑出选中的页面。
+        章节按 ID 匹配；没有本子详情时退回按章节序号匹配。
+        """
+        chapter_photo_id = None
+        if self.chapter and album is not None and self.chapter <= len(album.episode_list):
+            chapter_photo_id = str(album.episode_list[self.chapter - 1][0])
 
-import jmcomic
+        def accept(photo_id: str, photo_index: int, page_index: int) -> bool:
+            if self.chapter:
+                if chapter_photo_id is not None and str(photo_id) != chapter_photo_id:
+                    return False
+                if chapter_photo_id is None and photo_index != self.chapter:
+                    return False
+            return page_index >= self.first_page and (not self.last_page or page_index <= self.last_page)
+
+        return accept
+
+
+class DownloadResult(NamedTuple):
+    """一次本子下载的结果，下载失败时 result_dir 为 None，size 为半成品目录的大小"""
+    result_dir: Optional[Path]
+    size: int
+    photo_ids: Dict[int, str]
+    episodes: List[str]
+
+
+class StreamingDownloader(jmcomic.JmDownloader):
+    """每张图片写入磁盘后，立即把 PageRef 交给事件循环中的 on_page 回调
+
+    loop 为 None 时在下载线程中直接调用 on_page（下载工作进程中使用）。
+    gate 在每张图片交出之前调用，可以阻塞下载线程（FetchWindow.acquire）。
+    selection 不为 None 时通过 do_filter 只下载选中的章节和页面，其余章节不会请求详情。
+    page_order 时图片按 (章节序号, 页序号) 的优先级下载（PageOrderPool，总并发仍为 图片线程数 × 章节线程数），
+    reorder_window > 0 时页面经过重排缓冲，按页面顺序交出。
+    """
+
+    def __init__(self, option: jmcomic.JmOption, loop: Optional[asyncio.AbstractEventLoop],
+                 on_page: Callable[[PageRef], None], on_total: Optional[Callable[[int], None]] = None,
+                 gate: Optional[Callable[[], None]] = None, selection: Optional[DownloadSelection] = None,
+                 page_order: bool = False, reorder_window: int = 0):
+        super().__init__(option)
+        self.loop = loop
+        self.on_page = on_page
+        self.on_total = on_total
+        self.gate = gate
+        self.selection = selection
+        download_threading = option.download.threading
+        # 每张图片开始前重新读取并发（内存调节器可能在下载中途修改）
+        self.page_pool = PageOrderPool(
+            lambda: download_threading.image * download_threading.photo
+        ) if page_order else None
+        self.reorder = PageReorderBuffer(self._emit, reorder_window) if reorder_window > 0 else None
+        # 总页数：优先取 album.page_count，API 客户端返回 0 时按章节图片数累加
+        self.total = 0
+        self._count_by_photo = False
+        self._total_lock = threading.Lock()
+        # 章节序号 -> 章节 ID，写入磁盘缓存，之后从磁盘读取时还原 PageRef
+        self.photo_ids: Dict[int, str] = {}
+        self.episodes: List[str] = []
+
+    def before_album(self, album: jmcomic.JmAlbumDetail):
+        super().before_album(album)
+        # 只下载一部分时 page_count 不是要下载的页数，按选中章节的图片数累加
+        self._count_by_photo = album.page_count <= 0 or self.selection is not None
+        self.total = 0 if self._count_by_photo else album.page_count
+        self.episodes = [str(episode[0]) for episode in album.episode_list]
+        if self.total > 0 and self.on_total is not None:
+            self.on_total(self.total)
+
+    def before_photo(self, photo: jmcomic.JmPhotoDetail):
+        super().before_photo(photo)
+        self.photo_ids[photo.index] = photo.photo_id
+        if self._count_by_photo:
+            with self._total_lock:
+                self.total += self.selection.page_count(len(photo)) if self.selection is not None else len(photo)
+                if self.on_total is not None:
+                    self.on_total(self.total)
+
+    def do_filter(self, detail):
+        is_album = detail.is_album()
+        if self.selection is not None:
+            detail = self.selection.filter_album(detail) if is_album else self.selection.filter_photo(detail)
+        # 登记要下载的章节和图片，重排缓冲据此判断前面的页面是否都已结束
+        if self.reorder is not None:
+            if is_album:
+                self.reorder.expect_chapters([photo.index for photo in detail])
+            else:
+                self.reorder.expect_pages([(image.from_photo.index, image.index) for image in detail])
+        return detail
+
+    def execute_on_condition(self, iter_objs, apply, count_batch):
+        # 章节仍按原来的方式并发获取详情；图片交给按页面顺序调度的线程池，所有章节共用
+        if self.page_pool is None or not iter_objs.is_photo():
+            return super().execute_on_condition(iter_objs, apply, count_batch)
+        images = self.do_filter(iter_objs)
+        self.page_pool.run(((image.from_photo.index, image.index), functools.partial(apply, image)) for image in images)
+
+    def download_by_photo_detail(self, photo: jmcomic.JmPhotoDetail):
+        try:
+            return super().download_by_photo_detail(photo)
+        finally:
+            if self.reorder is not None:
+                self.reorder.close_chapter(photo.index)
+
+    def download_by_image_detail(self, image: jmcomic.JmImageDetail):
+        try:
+            return super().download_by_image_detail(image)
+        finally:
+            if self.reorder is not None:
+                self.reorder.done((image.from_photo.index, image.index))
+
+    def before_image(self, image: jmcomic.JmImageDetail, img_save_path):
+        super().before_image(image, img_save_path)
+        # 已存在且启用缓存的图片不会触发 after_image，这里直接推送
+        if image.exists and self.option.decide_download_cache(image):
+            self.push_image(image, img_save_path)
+
+    def after_image(self, image: jmcomic.JmImageDetail, img_save_path):
+        super().after_image(image, img_save_path)
+        self.push_image(image, img_save_path)
+
+    def push_image(self, image: jmcomic.JmImageDetail, img_save_path):
+        photo = image.from_photo
+        page = PageRef(photo.photo_id, photo.index, image.index, path=Path(img_save_path))
+        if self.reorder is not None:
+            # 图片结束（download_by_image_detail 返回）时按顺序交出
+            self.reorder.add(page)
+        else:
+            self._emit(page)
+
+    def flush_pages(self):
+        """交出重排缓冲中剩下的页面（下载结束或出错时）"""
+        if self.reorder is not None:
+            self.reorder.flush()
+
+    def _emit(self, page: PageRef):
+        if self.gate is not None:
+            self.gate()
+        if self.loop is None:
+            self.on_page(page)
+        else:
+            self.loop.call_soon_threadsafe(self.on_page, page)
+
+
+def run_album_download(dler: StreamingDownloader, album_id: str,
+                       album: Optional[jmcomic.JmAlbumDetail]) -> DownloadResult:
+    """用 dler 下载本子（阻塞），album 为 None 时先请求详情"""
+    try:
+        return _run_album_download(dler, album_id, album)
+    finally:
+        # 结果返回之前交出所有页面，订阅者收到的最后一页总在下载结束通知之前
+        dler.flush_pages()
+
+
+def _run_album_download(dler: StreamingDownloader, album_id: str,
+                        album: Optional[jmcomic.JmAlbumDetail]) -> DownloadResult:
+    option = dler.option
+    try:
+        print(f"开始下载漫画 {album_id}")
+        with dler:
+            if album is not None:
+                detail = album
+                dler.download_by_album_detail(detail)
+            else:
+                detail = dler.download_album(album_id)
+            dler.raise_if_has_exception()
+        print(f"下载完成 {album_id}")
+
+        album_dir = Path(option.dir_rule.decide_album_root_dir(detail))
+        if album_dir.exists():
+            print(f"找到下载目录: {album_dir}")
+            return DownloadResult(album_dir, dir_size(album_dir), dler.photo_ids, dler.episodes)
+        print(f"未找到下载目录")
+
+    except Exception as e:
+        print(f"下载错误: {e}")
+        import traceback
+        traceback.print_exc()
+
+    return partial_result(option, album_id, dler.photo_ids, dler.episodes)
+
+
+def partial_result(option: jmcomic.JmOption, album_id: str,
+                   photo_ids: Optional[Dict[int, str]] = None,
+                   episodes: Optional[List[str]] = None) -> DownloadResult:
+    """下载失败：记录半成品目录的大小，之后重新下载会跳过已有的图片"""
+    partial_dir = Path(option.dir_rule.base_dir) / album_id
+    size = dir_size(partial_dir) if partial_dir.exists() else 0
+    return DownloadResult(None, size, photo_ids or {}, episodes or [])
+
+
+class FetchWindow:
+    """下载的背压控制：下载线程最多领先最慢的订阅者 size 页
+
+    下载线程在交出每张图片前调用 acquire()，超出窗口时阻塞（不再开始下一张图片）；
+    事件循环在订阅者读取页面后调用 advance()。size 为 0 表示不限制。
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.produced = 0
+        self.consumed = 0
+        self.closed = size <= 0
+        # 下载线程因为订阅者跟不上而等待的总秒数
+        self.wait_seconds = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """下载线程：窗口已满时等待订阅者读取"""
+        with self._cond:
+            if not self.closed and self.produced - self.consumed >= self.size:
+                began = time.monotonic()
+                while not self.closed and self.produced - self.consumed >= self.size:
+                    self._cond.wait()
+                self.wait_seconds += time.monotonic() - began
+            self.produced += 1
+
+    def advance(self, consumed: int):
+        """事件循环：最慢的订阅者已经读取了 consumed 页"""
+        with self._cond:
+            if consumed > self.consumed:
+                self.consumed = consumed
+                self._cond.notify_all()
+
+    def close(self):
+        """不再限制（下载结束或没有订阅者时）"""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class AlbumStream:
+    """同一个本子的一次下载，由所有请求该本子的会话共享（single-flight）
+
+    下载线程产出的页面按完成顺序追加到 pages，每个订阅者从第 0 页开始读，
+    晚加入的订阅者会先补发已经下载好的页面，再跟上实时进度。
+    selection 为 None 时下载整本，否则只下载选中的部分；preview 为 True 时在预览通道中下载。
+    只能在事件循环线程中访问。
+    """
+
+    def __init__(self, album_id: str, fetch_ahead: int = 0, selection: Optional[DownloadSelection] = None,
+                 preview: bool = False):
+        self.album_id = album_id
+        self.selection = selection
+        self.preview = preview
+        self.pages: List[PageRef] = []
+        self.window = FetchWindow(fetch_ahead)
+        # 每个正在读取的订阅者已经读取的页数
+        self._positions: Dict[object, int] = {}
+        self.finished = False
+        self.result_dir: Optional[Path] = None
+        self.downloader: Optional[StreamingDownloader] = None
+        # 从磁盘缓存读取时的总页数
+        self.total_hint = -1
+        self.subscribers = 0
+        self.task: Optional[asyncio.Future] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def total(self) -> int:
+        """总页数，未知时为 -1"""
+        dler = self.downloader
+        return dler.total if dler is not None and dler.total > 0 else self.total_hint
+
+    def covers(self, selection: Optional[DownloadSelection]) -> bool:
+        """这次下载是否包含 selection 请求的全部页面"""
+        return self.selection is None or self.selection == selection
+
+    def push(self, page: PageRef):
+        self.pages.append(page)
+        self._notify()
+
+    def finish(self, result_dir: Optional[Path]):
+        self.result_dir = result_dir
+        self.finished = True
+        self.window.close()
+        self._notify()
+
+    def _notify(self):
+        # 唤醒所有等待中的订阅者，之后的等待使用新的 Event
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def iter_pages(self):
+        """按顺序产出全部页面，下载结束后停止
+
+        调用方处理完一页、请求下一页时才算读取了这一页，下载窗口随最慢的订阅者前进
+        """
+        reader = object()
+        self._positions[reader] = 0
+        index = 0
+        try:
+            while True:
+                if index < len(self.pages):
+                    yield self.pages[index]
+                    index += 1
+                    self._positions[reader] = index
+                    self.window.advance(min(self._positions.values()))
+                elif self.finished:
+                    return
+                else:
+                    await self._changed.wait()
+        finally:
+            del self._positions[reader]
+            if self._positions:
+                self.window.advance(min(self._positions.values()))
 
 
 class JMComicAPI:
     """JMComic API 封装类"""
 
-    def __init__(self, download_dir: Path):
+    def __init__(self, download_dir: Path, cache_size: int = 256,
+                 cache_ttl: float = 300, cache_max_stale: float = 3600,
+                 fast_lane_workers: int = 2, download_lane_workers: int = 1,
+                 album_cache_bytes: int = 0, cover_cache_bytes: int = 50 * 1024 * 1024,
+                 cover_lane_workers: int = 4, index_db: Optional[Path] = None,
+                 worker_pool=None, fetch_ahead: int = 0, page_order: bool = True, reorder_window: int = 16):
         """初始化
 
         Args:
             download_dir: 下载目录
+            cache_size: 搜索结果 / 本子详情缓存条数（LRU）
+            cache_ttl: 缓存保持新鲜的秒数，过期后先返回旧值再后台刷新
+            cache_max_stale: 过期缓存最长可用秒数
+            fast_lane_workers: 元数据请求（搜索、详情）通道线程数
+            download_lane_workers: 下载、PDF 生成通道线程数
+            album_cache_bytes: 下载目录作为磁盘缓存的大小上限 (字节)，0 表示不缓存
+            cover_cache_bytes: 封面缩略图缓存的大小上限 (字节)
+            cover_lane_workers: 封面下载通道线程数（搜索结果的封面并发下载）
+            index_db: 本地本子索引数据库路径，为 None 时不建立索引
+            worker_pool: DownloadWorkerPool，设置时本子下载在独立的工作进程中执行
+            fetch_ahead: 下载最多领先最慢的订阅者多少页，超出时暂停下载；0 表示不限制
+            page_order: 图片按页面顺序下载（所有章节共用一个优先队列），第 1 页最先开始
+            reorder_window: 页面按顺序交出前最多缓冲的页数，0 表示按完成顺序交出
         """
         self.download_dir = download_dir
         self.download_dir.mkdir(exist_ok=True, parents=True)
-        # 减少线程数以降低内存占用（Railway 内存限制）
-        self.executor = ThreadPoolExecutor(max_workers=1)
+        # 元数据请求和耗时任务分开执行，下载再久也不会阻塞搜索
+        # 线程数保持很小以降低内存占用（Railway 内存限制）
+        self.fast_lane = ExecutionLane('fast', fast_lane_workers)
+        self.download_lane = ExecutionLane('download', download_lane_workers)
+        # 预取只用一个线程，排队是常态，不打印饱和警告
+        self.prefetch_lane = ExecutionLane('prefetch', 1, slow_wait=60)
+        # 预取中的本子详情：album_id -> 正式请求到来时设置的 Future（还在排队的预取改到 fast 通道）
+        self._prefetch_promotions: Dict[str, asyncio.Future] = {}
+        self.cover_lane = ExecutionLane('cover', cover_lane_workers)
+        # 预览只有几页，单独一个线程，不排在整本下载后面
+        self.preview_lane = ExecutionLane('preview', 1)
+
+        # 启动时构建一次 option，client 在首次使用时构建，之后所有请求共用，
+        # 避免每次请求都 deepcopy 默认配置、新建 Postman、重复执行 after_init
+        self.option = build_option(self.download_dir)
+        self._client = None
+        self._client_lock = threading.Lock()
+        # 搜索结果 / 本子详情 / 漫画信息缓存（stale-while-revalidate）
+        self.search_cache = MetadataCache('search', cache_size, cache_ttl, cache_max_stale)
+        self.album_cache = MetadataCache('album', cache_size, cache_ttl, cache_max_stale)
+        self.info_cache = MetadataCache('info', cache_size, cache_ttl, cache_max_stale)
+        # 搜索结果封面拼图，按 (关键词, 结果 ID) 缓存
+        self.sheet_cache = MetadataCache('sheet', SHEET_CACHE_SIZE, cache_ttl, cache_max_stale)
+
+        # album_id -> 正在进行的下载，同一本子的并发请求共享一个下载
+        self._streams: Dict[str, AlbumStream] = {}
+
+        # 下载目录作为 LRU 磁盘缓存，完整下载过的本子直接从磁盘读取
+        self.disk_cache = AlbumDiskCache(download_dir, album_cache_bytes) if album_cache_bytes > 0 else None
+
+        # 搜索结果和本子详情写入本地索引，供 inline 查询使用
+        self.index = AlbumIndex(index_db) if index_db is not None else None
+
+        # 多进程模式下执行下载的工作进程池，为 None 时在下载通道线程中直接下载
+        self.worker_pool = worker_pool
+
+        # 发送跟不上下载时暂停下载（FetchWindow），累计暂停的秒数
+        self.fetch_ahead = fetch_ahead
+        self.fetch_wait_seconds = 0.0
+        self.page_order = page_order
+        self.reorder_window = reorder_window
+
+        # 封面缩略图（目录以 . 开头，不会被当作本子目录）
+        self.covers = CoverStore(self.download_dir / '.covers', cover_cache_bytes)
+
+    @property
+    def client(self) -> jmcomic.JmcomicClient:
+        """共享的 JmcomicClient，首次使用时构建（after_init 会访问网络）
+
+        curl_cffi postman 每次请求都是无状态调用，client 可以在多个线程间共享。
+        option.build_jm_client 带有 field_cache，downloader 拿到的也是这个 client。
+        """
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    # 关闭 client 自带的永久缓存，元数据缓存统一由 MetadataCache 负责过期和刷新
+                    self._client = instrument_client(self.option.build_jm_client(cache=False))
+        return self._client
+
+    def cache_stats(self) -> Dict[str, Dict[str, int]]:
+        """各缓存的命中/未命中计数"""
+        return {
+            cache.name: cache.stats()
+            for cache in (self.search_cache, self.album_cache, self.info_cache, self.sheet_cache)
+        }
+
+    def search_local(self, keyword: str, limit: int = 20) -> List[Dict]:
+        """只在本地索引中搜索，不访问禁漫（几毫秒，可以在事件循环中直接调用）"""
+        if self.index is None:
+            return []
+        return self.index.search(keyword, limit)
 
     async def search(self, keyword: str, limit: int = 10) -> List[Dict]:
         """搜索漫画
@@ -59,14 +608,16 @@ class JMComicAPI:
         Returns:
             搜索结果列表，每个结果包含 id, title, author 等信息
         """
+        # 缓存整页结果，不同 limit 共用
+        with SEARCH_SECONDS.time():
+            results = await self.search_cache.get(keyword, lambda: self._load_search(keyword))
+        return (results or [])[:limit]
+
+    async def _load_search(self, keyword: str) -> Optional[List[Dict]]:
         def _search():
             try:
-                # 创建选项
-                option = jmcomic.JmOption.default()
-                client = option.build_jm_client()
-
                 # 搜索
-                albums = client.search_site(search_query=keyword, page=1)
+                albums = self.client.search_site(search_query=keyword, page=1)
 
                 if not albums or len(albums) == 0:
                     return []
@@ -74,9 +625,8 @@ class JMComicAPI:
                 # 注意：不能用 for in 迭代 albums，因为 __iter__ 会返回简化格式
                 # 必须使用索引访问才能获取完整数据
                 results = []
-                actual_limit = min(limit, len(albums))
 
-                for i in range(actual_limit):
+                for i in range(len(albums)):
                     album = albums[i]  # 使用索引访问获取完整数据
 
                     if isinstance(album, tuple) and len(album) >= 2:
@@ -86,7 +636,8 @@ class JMComicAPI:
                             results.append({
                                 'id': str(album_id),
                                 'title': album_data.get('name', album_data.get('title', 'Unknown')),
-                                'author': album_data.get('author', 'Unknown')
+                                'author': album_data.get('author', 'Unknown'),
+                                'tags': album_data.get('tags') or []
                             })
                         else:
                             results.append({
@@ -102,17 +653,142 @@ class JMComicAPI:
                             'author': album.author if hasattr(album, 'author') else 'Unknown'
                         })
 
+                if self.index is not None:
+                    self.index.add(results)
                 return results
 
             except Exception as e:
                 print(f"搜索错误: {e}")
                 import traceback
                 traceback.print_exc()
-                return []
+                # 返回 None，出错的结果不写入缓存
+                return None
 
-        # 在线程池中执行
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(self.executor, _search)
+        # 在元数据通道中执行
+        return await self.fast_lane.run(_search)
+
+    async def get_album_detail(self, album_id: str) -> Optional[jmcomic.JmAlbumDetail]:
+        """获取本子详情实体
+
+        Args:
+            album_id: 漫画 ID
+
+        Returns:
+            JmAlbumDetail，失败返回 None
+        """
+        # 正式请求会复用进行中的预取，预取还在低优先级通道排队时先把它改到 fast 通道
+        promotion = self._prefetch_promotions.get(album_id)
+        if promotion is not None and not promotion.done():
+            promotion.set_result(None)
+        return await self.album_cache.get(album_id, lambda: self._load_album_detail(album_id))
+
+    def _fetch_album_detail(self, album_id: str) -> Optional[jmcomic.JmAlbumDetail]:
+        try:
+            album = self.client.get_album_detail(album_id)
+            if self.index is not None:
+                self.index.add([{
+                    'id': album.album_id,
+                    'title': album.title,
+                    'author': album_author(album),
+                    'tags': list(album.tags or []),
+                }])
+            return album
+        except Exception as e:
+            print(f"获取本子详情错误: {e}")
+            return None
+
+    async def _load_album_detail(self, album_id: str) -> Optional[jmcomic.JmAlbumDetail]:
+        return await self.fast_lane.run(self._fetch_album_detail, album_id)
+
+    async def _prefetch_album_detail(self, album_id: str) -> Optional[jmcomic.JmAlbumDetail]:
+        """在预取通道中加载详情；开始执行之前有正式请求时取消排队，改在 fast 通道加载"""
+        started = threading.Event()
+
+        def _get_album_detail():
+            started.set()
+            return self._fetch_album_detail(album_id)
+
+        promotion = self._prefetch_promotions[album_id] = asyncio.get_running_loop().create_future()
+        job = asyncio.ensure_future(self.prefetch_lane.run(_get_album_detail))
+        try:
+            await asyncio.wait((job, promotion), return_when=asyncio.FIRST_COMPLETED)
+            if job.done() or started.is_set():
+                return await job
+            job.cancel()
+            return await self._load_album_detail(album_id)
+        finally:
+            if self._prefetch_promotions.get(album_id) is promotion:
+                del self._prefetch_promotions[album_id]
+            job.cancel()
+
+    async def prefetch_album(self, album_id: str, cover: bool = False):
+        """在预取通道中把本子详情（和封面）提前载入缓存
+
+        同一本子的正式请求会直接复用进行中的预取（还在排队时改到 fast 通道）；取消时还在排队的请求不会再发出。
+        """
+        if not self.album_cache.peek(album_id):
+            await self.album_cache.get(album_id, lambda: self._prefetch_album_detail(album_id))
+        if cover:
+            await self.get_cover(album_id, self.prefetch_lane)
+
+    async def get_cover(self, album_id: str, lane: Optional[ExecutionLane] = None,
+                        size: str = COVER_SIZE) -> Optional[Path]:
+        """获取本子封面缩略图，已缓存时直接返回本地文件
+
+        Args:
+            album_id: 漫画 ID
+            lane: 下载所用的执行通道，默认为封面通道
+            size: 封面尺寸后缀，默认为搜索列表页使用的小图
+
+        Returns:
+            封面图片路径，失败返回 None
+        """
+        cover_file = self.covers.get(album_id, size)
+        if cover_file is not None:
+            return cover_file
+
+        # 先写入临时文件，下载中途失败不会留下不完整的封面
+        tmp_file = self.covers.tmp_path(album_id, size)
+
+        def _download_cover():
+            try:
+                self.client.download_album_cover(album_id, str(tmp_file), size=size)
+                return True
+            except Exception as e:
+                print(f"下载封面错误: {e}")
+                tmp_file.unlink(missing_ok=True)
+                return False
+
+        if not await (lane or self.cover_lane).run(_download_cover):
+            return None
+        return self.covers.put(album_id, size, tmp_file)
+
+    @staticmethod
+    def cover_url(album_id: str, size: str = COVER_SIZE) -> str:
+        """封面图片的 CDN 地址（inline 结果的缩略图由 Telegram 直接拉取）"""
+        return jmcomic.JmcomicText.get_album_cover_url(album_id, size=size)
+
+    async def get_search_sheet(self, keyword: str, album_ids: List[str]) -> Optional[bytes]:
+        """搜索结果的封面拼图 (JPEG)
+
+        封面并发下载，拼好的图片按 (关键词, 结果 ID) 缓存。
+
+        Returns:
+            JPEG 数据，所有封面都获取失败时返回 None
+        """
+        key = (keyword, tuple(album_ids))
+        return await self.sheet_cache.get(key, lambda: self._load_search_sheet(album_ids))
+
+    async def _load_search_sheet(self, album_ids: List[str]) -> Optional[bytes]:
+        # 拼图完成前，同一批封面不会被后下载的封面挤出缓存
+        self.covers.pin(album_ids, COVER_SIZE)
+        try:
+            covers = await asyncio.gather(*(self.get_cover(album_id) for album_id in album_ids))
+            if not any(covers):
+                return None
+            return await self.cover_lane.run(make_contact_sheet, list(covers))
+        finally:
+            self.covers.unpin(album_ids, COVER_SIZE)
 
     async def get_info(self, album_id: str) -> Optional[Dict]:
         """获取漫画详细信息
@@ -123,14 +799,17 @@ class JMComicAPI:
         Returns:
             漫画详细信息字典
         """
-        def _get_info():
-            try:
-                option = jmcomic.JmOption.default()
-                client = option.build_jm_client()
+        # 页数需要额外请求一次章节详情，所以整个信息字典单独缓存
+        return await self.info_cache.get(album_id, lambda: self._load_info(album_id))
 
-                # 获取专辑信息
-                album = client.get_album_detail(album_id)
+    async def _load_info(self, album_id: str) -> Optional[Dict]:
+        # 专辑信息与下载流程共用 album_cache
+        album = await self.get_album_detail(album_id)
+        if album is None:
+            return None
 
+        def _get_info():
+            try:
                 # 获取页数 - 需要从 episode 获取
                 page_count = 0
                 if hasattr(album, 'episode_list') and album.episode_list:
@@ -139,26 +818,20 @@ class JMComicAPI:
                     if isinstance(first_episode, tuple) and len(first_episode) >= 1:
                         episode_id = first_episode[0]
                         try:
-                            photo_detail = client.get_photo_detail(episode_id, fetch_album=False, fetch_scramble_id=False)
+                            photo_detail = self.client.get_photo_detail(episode_id, fetch_album=False, fetch_scramble_id=False)
                             if hasattr(photo_detail, 'page_arr') and photo_detail.page_arr:
                                 page_count = len(photo_detail.page_arr)
                         except:
                             page_count = 0
 
-                # 处理作者信息
-                author = 'Unknown'
-                if hasattr(album, 'authors') and album.authors:
-                    author = ', '.join(album.authors) if isinstance(album.authors, list) else str(album.authors)
-                elif hasattr(album, 'author') and album.author:
-                    author = ', '.join(album.author) if isinstance(album.author, list) else str(album.author)
-
                 return {
                     'id': album_id,
                     'title': album.title if hasattr(album, 'title') else 'Unknown',
-                    'author': author,
+                    'author': album_author(album) or 'Unknown',
                     'tags': album.tags if hasattr(album, 'tags') else [],
                     'category': 'Unknown',
                     'page_count': page_count,
+                    'chapter_count': len(album.episode_list) if hasattr(album, 'episode_list') else 0,
                     'update_date': album.update_date if hasattr(album, 'update_date') else 'Unknown'
                 }
 
@@ -168,141 +841,228 @@ class JMComicAPI:
                 traceback.print_exc()
                 return None
 
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(self.executor, _get_info)
+        return await self.fast_lane.run(_get_info)
 
     async def download_with_streaming(
         self,
         album_id: str,
-        image_callback: Optional[Callable[[Path], None]] = None,
-        progress_callback: Optional[Callable[[int, int], None]] = None
+        image_callback: Optional[Callable[[PageRef], None]] = None,
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+        complete_callback: Optional[Callable[[], None]] = None,
+        cleanup: bool = False,
+        selection: Optional[DownloadSelection] = None,
+        preview: bool = False,
+        limit: int = 0
     ) -> Optional[Path]:
         """流式下载漫画，每下载一张就通过回调返回
 
+        同一个本子同时只会有一个下载：正在下载时再次请求会订阅已有的 AlbumStream，
+        先收到已下载的页面，之后和其他订阅者一起实时收到新页面。
+        只请求一部分时可以共享正在进行的整本下载（只回调选中的页面）；
+        正在进行的下载不包含请求的页面时，等它结束后再下载（两次下载写入同一个目录）。
+
         Args:
             album_id: 漫画 ID
-            image_callback: 图片回调函数 (image_path)
-            progress_callback: 进度回调函数 (current, total)
+            image_callback: 图片回调函数 (page)，page.path 为图片路径
+            progress_callback: 进度回调函数 (current, total)，total 未知时为 -1
+            complete_callback: 全部页面回调完成后调用（例如发送最后一组图片），在清理目录之前执行
+            cleanup: 未启用磁盘缓存时，最后一个订阅者结束后删除下载目录
+            selection: 只下载的章节/页码范围，为 None 时下载整本
+            preview: 预览（只有几页）：在预览通道中、机器人进程内下载，不等待整本下载占用的通道和工作进程
+            limit: 收到这么多页后立即结束（调用 complete_callback 并返回），不等共享的下载结束；0 表示不限制
 
         Returns:
-            下载目录路径，失败返回 None
+            下载目录路径，失败返回 None（cleanup 时目录可能已被删除）
         """
-        download_complete = False
-        result_holder = [None]
-        sent_images = set()
-
-        def _download():
-            nonlocal download_complete
-            try:
-                # 创建选项，使用配置字典限制并发
-                config = {
-                    'dir_rule': {
-                        'base_dir': str(self.download_dir)
-                    },
-                    'download': {
-                        'image': {
-                            'thread_count': 1  # 强制单线程
-                        }
-                    }
-                }
-
-                print(f"创建配置: thread_count=1")
-                option = jmcomic.JmOption.construct(config, cover_default=True)
-                print(f"选项已创建")
-
-                # 下载
-                print(f"开始下载漫画 {album_id}")
-                jmcomic.download_album(album_id, option)
-                print(f"下载完成 {album_id}")
-
-                # 查找下载的目录
-                downloaded_dirs = list(self.download_dir.glob(f"*{album_id}*"))
-                if not downloaded_dirs:
-                    # 查找所有新目录
-                    downloaded_dirs = sorted(
-                        self.download_dir.iterdir(),
-                        key=lambda x: x.stat().st_mtime,
-                        reverse=True
-                    )
-
-                if downloaded_dirs:
-                    print(f"找到下载目录: {downloaded_dirs[0]}")
-                    result_holder[0] = downloaded_dirs[0]
-                else:
-                    print(f"未找到下载目录")
-
-            except Exception as e:
-                print(f"下载错误: {e}")
-                import traceback
-                traceback.print_exc()
-            finally:
-                download_complete = True
-
-        # 启动下载线程
         loop = asyncio.get_event_loop()
-        download_task = loop.run_in_executor(self.executor, _download)
-
-        # 监控下载目录，每秒检查新图片
-        heartbeat_count = 0
-        last_progress_update = 0
-
-        while not download_complete:
-            await asyncio.sleep(1)
-            heartbeat_count += 1
-
-            # 查找下载目录
-            download_dirs = list(self.download_dir.glob(f"*{album_id}*"))
-            if download_dirs:
-                download_dir = download_dirs[0]
-
-                # 查找所有图片
-                image_files = sorted(download_dir.glob("*.webp"))
-                if not image_files:
-                    image_files = sorted(download_dir.glob("*.jpg"))
-                if not image_files:
-                    image_files = sorted(download_dir.glob("*.png"))
-
-                # 发送新图片
-                for img_file in image_files:
-                    if img_file not in sent_images and img_file.stat().st_size > 0:
-                        sent_images.add(img_file)
-                        if image_callback:
-                            try:
-                                await image_callback(img_file)
-                            except Exception as e:
-                                print(f"图片回调错误: {e}")
-
-                # 每5秒发送进度更新
-                if heartbeat_count - last_progress_update >= 5:
-                    last_progress_update = heartbeat_count
-                    if progress_callback:
+        if selection is not None and selection.is_full:
+            selection = None
+
+        running = self._streams.get(album_id)
+        while running is not None and not running.finished and not running.covers(selection):
+            print(f"漫画 {album_id} 正在下载其他范围，等待其结束")
+            await asyncio.wait([running.task])
+            running = self._streams.get(album_id)
+        stream = self._subscribe(album_id, selection, preview)
+
+        # 每下载完成一张图片就立即回调，进度最多每5秒更新一次
+        sent_count = 0
+        last_progress_update = loop.time()
+
+        try:
+            # 共享整本下载时只回调选中的页面，总页数未知
+            # （在 try 中获取详情：取消或出错时也要经过 finally 退订）
+            accept = None
+            if stream.selection != selection:
+                accept = selection.page_filter(await self.get_album_detail(album_id))
+
+            # 中途出错时立即关闭迭代器，不再占用下载窗口
+            async with contextlib.aclosing(stream.iter_pages()) as pages:
+                async for page in pages:
+                    if accept is not None and not accept(page.photo_id, page.photo_index, page.page_index):
+                        continue
+                    sent_count += 1
+                    if image_callback:
                         try:
-                            await progress_callback(len(sent_images), -1)
+                            await image_callback(page)
                         except Exception as e:
-                            print(f"进度回调错误: {e}")
-
-        # 等待下载完成
-        await download_task
-
-        # 发送剩余的图片
-        if result_holder[0]:
-            download_dir = result_holder[0]
-            image_files = sorted(download_dir.glob("*.webp"))
-            if not image_files:
-                image_files = sorted(download_dir.glob("*.jpg"))
-            if not image_files:
-                image_files = sorted(download_dir.glob("*.png"))
+                            print(f"图片回调错误: {e}")
 
-            for img_file in image_files:
-                if img_file not in sent_images:
-                    sent_images.add(img_file)
-                    if image_callback:
+                    if progress_callback and loop.time() - last_progress_update >= 5:
+                        last_progress_update = loop.time()
                         try:
-                            await image_callback(img_file)
+                            await progress_callback(sent_count, stream.total if accept is None else -1)
                         except Exception as e:
-                            print(f"图片回调错误: {e}")
+                            print(f"进度回调错误: {e}")
 
-        return result_holder[0]
+                    if limit and sent_count >= limit:
+                        # 例如预览共享了正在进行的整本下载：需要的页面已经到齐，不等整本下载完
+                        break
+
+            stopped_early = bool(limit) and sent_count >= limit and not stream.finished
+            if not stopped_early:
+                # 等待下载线程退出
+                await stream.task
+
+            if complete_callback:
+                try:
+                    await complete_callback()
+                except Exception as e:
+                    print(f"完成回调错误: {e}")
+            if stopped_early:
+                # 下载仍在进行，图片已经在本子目录中
+                return Path(self.option.dir_rule.base_dir) / album_id
+            return stream.result_dir
+        finally:
+            self._unsubscribe(stream, cleanup)
+
+    def _subscribe(self, album_id: str, selection: Optional[DownloadSelection] = None,
+                   preview: bool = False) -> AlbumStream:
+        """订阅本子的下载流，没有包含 selection 的下载时启动一个"""
+        stream = self._streams.get(album_id)
+        if stream is None or not stream.covers(selection):
+            stream = self._streams[album_id] = AlbumStream(album_id, self.fetch_ahead, selection, preview)
+            if self.disk_cache is not None:
+                self.disk_cache.pin(album_id)
+            stream.task = asyncio.ensure_future(self._run_download(stream))
+        else:
+            print(f"漫画 {album_id} 正在下载，共享已有下载 (已有 {len(stream.pages)} 张)")
+        stream.subscribers += 1
+        return stream
+
+    def _unsubscribe(self, stream: AlbumStream, cleanup: bool):
+        stream.subscribers -= 1
+        if stream.subscribers > 0:
+            return
+
+        if not stream.finished:
+            # 订阅者全部中途退出时等下载线程结束再释放，期间新的请求仍会共享这个下载；
+            # 没有订阅者读取，不再限制下载窗口
+            stream.window.close()
+            def _on_done(_):
+                if stream.subscribers == 0:
+                    self._release(stream, cleanup)
+
+            stream.task.add_done_callback(_on_done)
+            return
+        self._release(stream, cleanup)
+
+    def _release(self, stream: AlbumStream, cleanup: bool):
+        # 最后一个订阅者：之后的请求会重新下载
+        if self._streams.get(stream.album_id) is stream:
+            del self._streams[stream.album_id]
+        if self.disk_cache is not None:
+            # 目录留在磁盘缓存中，超出大小上限时由缓存淘汰
+            self.disk_cache.unpin(stream.album_id)
+        elif cleanup and stream.album_id not in self._streams:
+            # 同一本子的下一次下载已经开始时，目录由那次下载的最后一个订阅者删除
+            # 下载失败或取消时同样删除半成品目录，没有磁盘缓存时不会再被使用
+            # 在事件循环中同步删除，保证新的下载不会和删除交错
+            album_dir = stream.result_dir or Path(self.option.dir_rule.base_dir) / stream.album_id
+            if album_dir.exists():
+                shutil.rmtree(album_dir, ignore_errors=True)
+                print(f"已清理下载目录: {album_dir}")
+
+    async def _run_download(self, stream: AlbumStream):
+        loop = asyncio.get_event_loop()
+        album_id = stream.album_id
+
+        # 详情通常已经在缓存中（搜索结果预取、查看信息），下载时不再重复请求
+        album = await self.get_album_detail(album_id)
+
+        if self.disk_cache is not None:
+            # 章节列表取自元数据缓存，本子更新（章节变化）时不使用旧的磁盘副本
+            episodes = [str(episode[0]) for episode in album.episode_list] if album is not None else None
+            entry = self.disk_cache.lookup(album_id, episodes)
+            if entry is not None:
+                accept = stream.selection.page_filter(album) if stream.selection is not None else None
+                await self._serve_from_disk(stream, entry, accept)
+                return
+
+        def _download() -> DownloadResult:
+            if self.worker_pool is not None and not stream.preview:
+                # 多进程模式：在下载工作进程中执行，并发数取自 MemoryGovernor 调整后的 option
+                download_threading = self.option.download.threading
+                try:
+                    def on_page(page: PageRef):
+                        # 工作进程的页面在这里过窗口：窗口满时停止读取连接，工作进程发送阻塞，下载随之暂停
+                        stream.window.acquire()
+                        loop.call_soon_threadsafe(stream.push, page)
+
+                    return self.worker_pool.run(
+                        album_id, album, download_threading.image, download_threading.photo,
+                        on_page=on_page,
+                        selection=stream.selection,
+                        page_order=self.page_order, reorder_window=self.reorder_window,
+                        on_total=lambda total: loop.call_soon_threadsafe(setattr, stream, 'total_hint', total)
+                    )
+                except Exception as e:
+                    print(f"下载进程错误: {e}")
+                    return partial_result(self.option, album_id)
+
+            # 复用共享 option，先构建 client 保证 downloader 拿到同一个 client
+            _ = self.client
+            dler = StreamingDownloader(self.option, loop, stream.push, gate=stream.window.acquire,
+                                       selection=stream.selection,
+                                       page_order=self.page_order, reorder_window=self.reorder_window)
+            stream.downloader = dler
+            return run_album_download(dler, album_id, album)
+
+        result_dir = None
+        try:
+            lane = self.preview_lane if stream.preview else self.download_lane
+            result = await lane.run(_download)
+            result_dir = result.result_dir
+            if self.disk_cache is not None and result.size > 0:
+                # 只下载了一部分的目录记为未完成，之后下载整本时跳过已有的图片
+                self.disk_cache.put(
+                    album_id, result.size, complete=result_dir is not None and stream.selection is None,
+                    photo_ids=result.photo_ids, episodes=result.episodes
+                )
+        finally:
+            # 通知订阅者下载已结束（push 同样经由 call_soon_threadsafe，保证在最后一页之后）
+            stream.finish(result_dir)
+            self.fetch_wait_seconds += stream.window.wait_seconds
+
+    async def _serve_from_disk(self, stream: AlbumStream, entry: dict,
+                               accept: Optional[Callable[[str, int, int], bool]] = None):
+        """磁盘缓存命中：按页面顺序推送已下载的图片（accept 不为 None 时只推送选中的页面），不访问禁漫"""
+        album_dir = self.disk_cache.album_dir(stream.album_id)
+        print(f"磁盘缓存命中: {stream.album_id}")
+        try:
+            image_files = await self.fast_lane.run(list_album_images, album_dir)
+            pages = []
+            for img_file in image_files:
+                photo_index = int(img_file.parent.name)
+                photo_id = entry['photo_ids'].get(str(photo_index), f'{stream.album_id}-{photo_index}')
+                page = PageRef(photo_id, photo_index, int(img_file.stem), path=img_file)
+                if accept is None or accept(page.photo_id, page.photo_index, page.page_index):
+                    pages.append(page)
+            stream.total_hint = len(pages)
+            for page in pages:
+                stream.push(page)
+        finally:
+            stream.finish(album_dir)
 
     async def create_pdf(
         self,
@@ -310,7 +1070,7 @@ class JMComicAPI:
         output_file: Path,
         quality: int = 95
     ) -> bool:
-        """将图片合并为 PDF
+        """将图片合并为 PDF，逐页写入，内存占用与页数无关
 
         Args:
             source_dir: 图片源目录
@@ -321,14 +1081,9 @@ class JMComicAPI:
             是否成功
         """
         def _create_pdf():
-            images_to_close = []
             try:
-                # 获取所有图片文件并排序
-                image_files = sorted(source_dir.glob("*.webp"))
-                if not image_files:
-                    image_files = sorted(source_dir.glob("*.jpg"))
-                if not image_files:
-                    image_files = sorted(source_dir.glob("*.png"))
+                # 获取所有图片文件并按页面顺序排序
+                image_files = list_album_images(source_dir)
 
                 if not image_files:
                     print("未找到图片文件")
@@ -336,38 +1091,24 @@ class JMComicAPI:
 
                 print(f"找到 {len(image_files)} 个图片文件")
 
-                # 打开第一张图片
-                first_img = Image.open(image_files[0]).convert('RGB')
-                images_to_close.append(first_img)
-                print(f"第一张图片: {image_files[0]}, 尺寸: {first_img.size}")
-
-                # 逐个加载剩余图片，添加到列表
-                images = []
-                for i, img_file in enumerate(image_files[1:], 2):
-                    try:
-                        img = Image.open(img_file).convert('RGB')
-                        images.append(img)
-                        images_to_close.append(img)
+                # 逐页写入：同一时间只有一张图片在内存中
+                print(f"开始写入 PDF: {output_file}")
+                with StreamingPdfWriter(output_file, resolution=100.0, quality=quality) as writer:
+                    for i, img_file in enumerate(image_files, 1):
+                        try:
+                            writer.add_image(img_file)
+                        except Exception as e:
+                            print(f"加载图片失败 {img_file}: {e}")
+                            continue
 
                         # 每处理5张图片打印一次进度
                         if i % 5 == 0:
-                            print(f"已加载 {i}/{len(image_files)} 张图片")
-                    except Exception as e:
-                        print(f"加载图片失败 {img_file}: {e}")
-                        continue
+                            print(f"已写入 {i}/{len(image_files)} 张图片")
 
-                print(f"成功加载所有 {len(image_files)} 张图片")
-
-                # 保存为 PDF
-                print(f"开始保存 PDF: {output_file}")
-                first_img.save(
-                    output_file,
-                    save_all=True,
-                    append_images=images,
-                    resolution=100.0,
-                    quality=quality,
-                    optimize=False
-                )
+                if writer.page_count == 0:
+                    print("没有可写入的图片")
+                    output_file.unlink(missing_ok=True)
+                    return False
 
                 print(f"PDF 创建成功: {output_file.stat().st_size / (1024*1024):.2f}MB")
                 return True
@@ -380,18 +1121,18 @@ class JMComicAPI:
                 import traceback
                 traceback.print_exc()
                 return False
-            finally:
-                # 确保关闭所有图片
-                print(f"关闭 {len(images_to_close)} 张图片")
-                for img in images_to_close:
-                    try:
-                        img.close()
-                    except:
-                        pass
 
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(self.executor, _create_pdf)
+        return await self.download_lane.run(_create_pdf)
 
     def cleanup(self):
         """清理资源"""
-        self.executor.shutdown(wait=False)
+        self.fast_lane.shutdown()
+        self.download_lane.shutdown()
+        self.prefetch_lane.shutdown()
+        self.cover_lane.shutdown()
+        self.preview_lane.shutdown()
+
+    def lane_stats(self) -> Dict[str, Dict[str, float]]:
+        """各执行通道的排队时间统计"""
+        lanes = (self.fast_lane, self.download_lane, self.prefetch_lane, self.cover_lane, self.preview_lane)
+        return {lane.name: lane.stats() for lane in lanes}
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+下载任务日志
+把每个下载任务（会话、本子、状态、已发送的页面）记录在 sqlite 中，
+容器重启后重新排队未完成的任务，并跳过已经发送过的页面
+"""
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, List, NamedTuple, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 任务状态：queued / running 为未完成，重启后恢复；done / failed 为已结束
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# (photo_index, page_index, part)
+PageKey = Tuple[int, int, int]
+
+# jobs 表结构版本，记录在 PRAGMA user_version 中
+SCHEMA_VERSION = 2
+
+
+class JournalJob(NamedTuple):
+    job_id: int
+    chat_id: int
+    chat_type: str
+    user_id: int
+    album_id: str
+    attempts: int
+    selection: str  # DownloadSelection.spec，整本时为空
+
+
+class JobJournal:
+    """基于 sqlite 的下载任务日志"""
+
+    def __init__(self, db_path: Path, keep_finished: float = 86400):
+        """初始化
+
+        Args:
+            db_path: sqlite 数据库文件路径
+            keep_finished: 已结束的任务保留时间 (秒)，启动时清理更早的记录
+        """
+        db_path.parent.mkdir(exist_ok=True, parents=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id     INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id    INTEGER NOT NULL,
+                chat_type  TEXT NOT NULL,
+                user_id    INTEGER NOT NULL,
+                album_id   TEXT NOT NULL,
+                selection  TEXT NOT NULL DEFAULT '',
+                status     TEXT NOT NULL,
+                attempts   INTEGER NOT NULL DEFAULT 0,
+                volumes    INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS delivered (
+                job_id      INTEGER NOT NULL,
+                photo_index INTEGER NOT NULL,
+                page_index  INTEGER NOT NULL,
+                part        INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (job_id, photo_index, page_index, part)
+            );
+        ''')
+        if self._conn.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+            # 旧版本的 jobs 表没有 selection 列（旧任务都是整本下载）和 volumes 列，补上
+            columns = [row[1] for row in self._conn.execute('PRAGMA table_info(jobs)')]
+            if 'selection' not in columns:
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN selection TEXT NOT NULL DEFAULT ''")
+            if 'volumes' not in columns:
+                self._conn.execute('ALTER TABLE jobs ADD COLUMN volumes INTEGER NOT NULL DEFAULT 0')
+            self._conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        self._conn.commit()
+        self.prune(keep_finished)
+
+    def add(self, chat_id: int, chat_type: str, user_id: int, album_id: str, selection: str = '') -> int:
+        """记录一个新排队的任务，返回 job_id
+
+        selection 为只下载一部分时的 DownloadSelection.spec
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                'INSERT INTO jobs (chat_id, chat_type, user_id, album_id, selection, status, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (chat_id, chat_type, user_id, album_id, selection, QUEUED, now, now)
+            )
+            return cursor.lastrowid
+
+    def start(self, job_id: int):
+        """任务开始执行"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ? WHERE job_id = ?',
+                (RUNNING, time.time(), job_id)
+            )
+
+    def finish(self, job_id: int, success: bool):
+        """任务结束，不再恢复"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'UPDATE jobs SET status = ?, updated_at = ? WHERE job_id = ?',
+                (DONE if success else FAILED, time.time(), job_id)
+            )
+            self._conn.execute('DELETE FROM delivered WHERE job_id = ?', (job_id,))
+
+    def mark_delivered(self, job_id: int, pages: Iterable[PageKey]):
+        """记录已经发送到会话的页面（每发送一组调用一次）"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO delivered (job_id, photo_index, page_index, part) VALUES (?, ?, ?, ?)',
+                [(job_id, *page) for page in pages]
+            )
+
+    def mark_volume(self, job_id: int, index: int):
+        """记录已经发送的 ZIP/CBZ 分卷序号"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'UPDATE jobs SET volumes = MAX(volumes, ?), updated_at = ? WHERE job_id = ?',
+                (index, time.time(), job_id)
+            )
+
+    def sent_volumes(self, job_id: int) -> int:
+        """任务已经发送过的分卷数，恢复时从下一个序号继续"""
+        with self._lock:
+            row = self._conn.execute('SELECT volumes FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        return row[0] if row else 0
+
+    def delivered(self, job_id: int) -> Set[PageKey]:
+        """任务已经发送过的页面"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT photo_index, page_index, part FROM delivered WHERE job_id = ?',
+                (job_id,)
+            ).fetchall()
+        return set(rows)
+
+    def unfinished(self, max_attempts: int = 3) -> List[JournalJob]:
+        """上次运行时未完成的任务，按提交顺序排列
+
+        已经尝试过 max_attempts 次的任务（例如每次都让进程崩溃）标记为失败，不再恢复。
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                'UPDATE jobs SET status = ?, updated_at = ? WHERE status IN (?, ?) AND attempts >= ?',
+                (FAILED, time.time(), QUEUED, RUNNING, max_attempts)
+            )
+            rows = self._conn.execute(
+                'SELECT job_id, chat_id, chat_type, user_id, album_id, attempts, selection FROM jobs '
+                'WHERE status IN (?, ?) ORDER BY job_id',
+                (QUEUED, RUNNING)
+            ).fetchall()
+        return [JournalJob(*row) for row in rows]
+
+    def prune(self, max_age: float):
+        """删除结束超过 max_age 秒的任务"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                'DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?',
+                (DONE, FAILED, time.time() - max_age)
+            )
+        if cursor.rowcount:
+            logger.info(f"清理已结束的下载任务记录 {cursor.rowcount} 条")
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
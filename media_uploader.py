@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片组上传
+把下载好的页面按顺序打包成 send_media_group 批次发送，减少 Telegram 请求次数；
+或者写入 ZIP/CBZ，整本（按大小切分为分卷）作为文件发送
+"""
+import asyncio
+import logging
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+from telegram import InputMediaPhoto
+from telegram.error import RetryAfter
+
+from metrics import PAGES_SENT, UPLOAD_BYTES, UPLOAD_SECONDS
+from zip_writer import StreamingZipWriter, ZipVolume
+
+logger = logging.getLogger(__name__)
+
+# Telegram 限制：一个图片组 2-10 个元素
+MEDIA_GROUP_MAX = 10
+
+
+def _notify_sent(on_sent: Optional[Callable], pages: list):
+    if on_sent is None:
+        return
+    try:
+        on_sent(pages)
+    except Exception as e:
+        logger.warning(f"记录已发送页面失败: {e}")
+
+
+class MediaGroupUploader:
+    """按页面顺序把图片攒成图片组发送
+
+    - 每攒满 batch_size 张就发送一组，flush() 发送剩余部分
+    - 整组发送失败时（例如某张图片不合法），退回为逐张 send_photo，跳过失败的那张
+    - 遇到 RetryAfter（触发限流）时等待后重发同一组
+    - 页面可以是本地文件 (page.path)、预处理后的数据 (page.data) 或已上传过的 file_id (page.file_id)，
+      上传成功后通过 on_uploaded(page, file_id) 回报 Telegram 返回的 file_id
+    - 图片组在后台发送，add() 在发送中的组数达到 concurrency 时才等待，调用方可以同时准备下一组
+    """
+
+    def __init__(self, chat, album_id: str, batch_size: int = MEDIA_GROUP_MAX,
+                 read_timeout: int = 60, write_timeout: int = 60,
+                 on_uploaded: Optional[Callable] = None,
+                 on_sent: Optional[Callable] = None,
+                 concurrency: int = 1, caption: Optional[str] = None):
+        """初始化
+
+        Args:
+            chat: 目标会话（telegram.Chat）
+            album_id: 漫画 ID，用于 caption
+            batch_size: 每组图片数量，范围 1-10
+            read_timeout: 请求读超时（秒）
+            write_timeout: 请求写超时（秒）
+            on_uploaded: 上传成功回调 (page, file_id)
+            on_sent: 一组页面发送成功后的回调 (pages)
+            concurrency: 同时发送的图片组数；1 表示逐组发送，保证会话中的顺序，
+                大于 1 时相邻的组可能乱序显示（caption 中有页码）
+            caption: 每组第一张图片使用的固定 caption（例如预览），为 None 时按页码生成
+        """
+        self.chat = chat
+        self.album_id = album_id
+        self.batch_size = max(1, min(batch_size, MEDIA_GROUP_MAX))
+        self.concurrency = max(1, concurrency)
+        self.read_timeout = read_timeout
+        self.write_timeout = write_timeout
+        self.on_uploaded = on_uploaded
+        self.on_sent = on_sent
+        self.fixed_caption = caption
+
+        self.pending: list = []
+        self.sent_count = 0
+        self.failed_count = 0
+        # 第一张图片发送成功的时间 (time.monotonic)，用于统计首图延迟
+        self.first_sent_at: Optional[float] = None
+
+        # 发送中的图片组
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._inflight: set = set()
+        # 已经分配了编号的页数（组在后台发送，编号在切分时确定）；首次切分时从 sent_count 开始
+        self._numbered: Optional[int] = None
+
+    async def add(self, page):
+        """加入一张页面（PageRef），攒满一组时交给后台发送"""
+        self.pending.append(page)
+        if len(self.pending) >= self.batch_size:
+            await self._dispatch()
+
+    async def flush(self):
+        """发送所有未发送的图片，等待全部发送完成"""
+        while self.pending:
+            await self._dispatch()
+        while self._inflight:
+            await asyncio.wait(set(self._inflight))
+
+    def cancel(self):
+        """取消后台发送中的图片组（任务被取消时调用）"""
+        for task in self._inflight:
+            task.cancel()
+
+    async def _dispatch(self):
+        batch = self.pending[:self.batch_size]
+        self.pending = self.pending[self.batch_size:]
+        if self._numbered is None:
+            self._numbered = self.sent_count + self.failed_count
+        first = self._numbered + 1
+        self._numbered += len(batch)
+
+        # 发送中的组数达到上限时等待，上传跟不上时调用方在这里暂停
+        await self._slots.acquire()
+        task = asyncio.ensure_future(self._send_batch(batch, first))
+        self._inflight.add(task)
+        task.add_done_callback(self._on_batch_done)
+
+    def _on_batch_done(self, task: asyncio.Task):
+        self._inflight.discard(task)
+        self._slots.release()
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"图片组发送错误: {task.exception()}")
+
+    def caption(self, first: int, last: int) -> str:
+        if self.fixed_caption is not None:
+            return self.fixed_caption
+        if first == last:
+            return f"📖 漫画 ID: {self.album_id}\n📄 图片 #{first}"
+        return f"📖 漫画 ID: {self.album_id}\n📄 图片 #{first}-{last}"
+
+    async def _send_batch(self, batch: list, first: int):
+        last = first + len(batch) - 1
+
+        # 单张图片不能作为图片组发送
+        if len(batch) == 1:
+            await self._send_single(batch[0], first)
+            return
+
+        media = [
+            self.input_media(page, self.caption(first, last) if i == 0 else None)
+            for i, page in enumerate(batch)
+        ]
+
+        try:
+            messages = await self._with_flood_retry(
+                self.chat.send_media_group,
+                'group',
+                media=media,
+                read_timeout=self.read_timeout,
+                write_timeout=self.write_timeout,
+            )
+            self._on_sent(batch)
+            logger.info(f"图片组 #{first}-{last} 发送成功")
+        except Exception as e:
+            logger.warning(f"图片组 #{first}-{last} 发送失败，改为逐张发送: {e}")
+            for i, page in enumerate(batch):
+                await self._send_single(page, first + i)
+            return
+
+        for page, message in zip(batch, messages):
+            self._report_uploaded(page, message)
+
+    async def _send_single(self, page, number: int):
+        try:
+            message = await self._with_flood_retry(
+                self.chat.send_photo,
+                'photo',
+                photo=self.media_of(page),
+                caption=self.caption(number, number),
+                read_timeout=self.read_timeout,
+                write_timeout=self.write_timeout,
+            )
+            self._on_sent([page])
+        except Exception as e:
+            self.failed_count += 1
+            logger.error(f"发送图片 #{number} 失败: {page.path or page.file_id}, {e}")
+            return
+
+        self._report_uploaded(page, message)
+
+    @staticmethod
+    def media_of(page):
+        """已有 file_id 时直接转发，否则上传预处理后的数据或本地文件"""
+        return page.file_id or page.data or page.path
+
+    @staticmethod
+    def input_media(page, caption: Optional[str]) -> InputMediaPhoto:
+        # InputMediaPhoto 会把本地路径转成 file:// URI（仅本地 Bot API 服务器可用），
+        # 所以本地文件要读成 bytes 上传
+        if page.file_id:
+            return InputMediaPhoto(media=page.file_id, caption=caption)
+        if page.data:
+            return InputMediaPhoto(media=page.data, caption=caption, filename=f"{page.path.stem}_{page.part}.jpg")
+        return InputMediaPhoto(media=page.path.read_bytes(), caption=caption, filename=page.path.name)
+
+    def _on_sent(self, pages: list):
+        if self.first_sent_at is None:
+            self.first_sent_at = time.monotonic()
+        self.sent_count += len(pages)
+        for page in pages:
+            if page.file_id:
+                PAGES_SENT.labels('file_id').inc()
+                continue
+            PAGES_SENT.labels('upload').inc()
+            UPLOAD_BYTES.inc(len(page.data) if page.data else page.path.stat().st_size)
+        _notify_sent(self.on_sent, pages)
+
+    def _report_uploaded(self, page, message):
+        if self.on_uploaded is None or not message.photo:
+            return
+        try:
+            self.on_uploaded(page, message.photo[-1].file_id)
+        except Exception as e:
+            logger.warning(f"记录 file_id 失败: {e}")
+
+    @staticmethod
+    async def _with_flood_retry(send, kind: str, retries: int = 3, **kwargs):
+        for attempt in range(retries + 1):
+            try:
+                # 只统计请求本身的耗时，不含限流等待
+                with UPLOAD_SECONDS.labels(kind).time():
+                    return await send(**kwargs)
+            except RetryAfter as e:
+                if attempt == retries:
+                    raise
+                delay = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+                logger.warning(f"触发 Telegram 限流，{delay} 秒后重试")
+                await asyncio.sleep(delay)
+
+
+class ArchiveUploader:
+    """把页面写入 ZIP/CBZ，作为文件发送
+
+    与 MediaGroupUploader 接口一致 (add / flush / cancel / sent_count / failed_count / first_sent_at)：
+    - 页面到达时在线程池中写入 ZIP，分卷写在临时文件中（StreamingZipWriter），上传时直接读取这个文件
+    - 分卷超过 max_bytes 时立即发送这一卷，同时最多只有一个分卷
+    - 只有一个分卷时文件名为 <album_id>.<suffix>，否则为 <album_id>_part<N>.<suffix>；
+      任务恢复时从 first_volume 接着编号，不会出现同一本子的 part1 和不带编号的文件
+    """
+
+    def __init__(self, chat, album_id: str, max_bytes: int, suffix: str = 'cbz',
+                 read_timeout: int = 120, write_timeout: int = 120,
+                 on_sent: Optional[Callable] = None, first_volume: int = 1,
+                 on_volume_sent: Optional[Callable[[int], None]] = None,
+                 temp_dir: Optional[Path] = None):
+        """初始化
+
+        Args:
+            chat: 目标会话（telegram.Chat）
+            album_id: 漫画 ID，用于文件名和 caption
+            max_bytes: 单个分卷的大小上限 (字节)
+            suffix: 文件扩展名 (zip / cbz)
+            read_timeout: 请求读超时（秒）
+            write_timeout: 请求写超时（秒）
+            on_sent: 一个分卷发送成功后的回调 (pages)
+            first_volume: 第一个分卷的序号（重启前已经发送过 first_volume - 1 个分卷）
+            on_volume_sent: 一个分卷发送成功后的回调 (分卷序号)，在 on_sent 之后调用
+            temp_dir: 分卷临时文件所在目录
+        """
+        self.chat = chat
+        self.album_id = album_id
+        self.suffix = suffix
+        self.read_timeout = read_timeout
+        self.write_timeout = write_timeout
+        self.on_sent = on_sent
+        self.on_volume_sent = on_volume_sent
+        self.first_volume = first_volume
+        self.writer = StreamingZipWriter(max_bytes, first_index=first_volume, temp_dir=temp_dir)
+        # 已写入当前分卷、还没有发送的页面
+        self._volume_pages: list = []
+
+        self.sent_count = 0
+        self.failed_count = 0
+        self.first_sent_at: Optional[float] = None
+
+    @staticmethod
+    def entry_name(page) -> str:
+        # 章节序号 + 页码，阅读器按文件名排序即为阅读顺序
+        stem = f"{page.photo_index:04d}-{page.page_index:05d}"
+        if page.data:
+            return f"{stem}_{page.part}.jpg"
+        return f"{stem}{page.path.suffix}"
+
+    async def add(self, page):
+        """写入一张页面（PageRef），当前分卷写满时发送"""
+        loop = asyncio.get_running_loop()
+        if page.data:
+            volume = await loop.run_in_executor(None, self.writer.add, self.entry_name(page), page.data)
+        else:
+            volume = await loop.run_in_executor(None, self.writer.add_file, self.entry_name(page), page.path)
+        if volume is not None:
+            # 返回的分卷不包含刚写入的这一页
+            pages, self._volume_pages = self._volume_pages, []
+            await self._send_volume(volume, pages, last=False)
+        self._volume_pages.append(page)
+
+    def cancel(self):
+        """分卷在 add / flush 中直接发送，没有后台任务；删除还没有发送的分卷"""
+        self.writer.close()
+
+    async def flush(self):
+        """结束并发送最后一个分卷"""
+        volume = self.writer.finish()
+        pages, self._volume_pages = self._volume_pages, []
+        if volume is not None:
+            await self._send_volume(volume, pages, last=True)
+
+    def filename(self, volume: ZipVolume, last: bool) -> str:
+        if last and volume.index == 1 and self.first_volume == 1:
+            return f"{self.album_id}.{self.suffix}"
+        return f"{self.album_id}_part{volume.index}.{self.suffix}"
+
+    async def _send_volume(self, volume: ZipVolume, pages: list, last: bool):
+        filename = self.filename(volume, last)
+        first = self.sent_count + self.failed_count + 1
+        caption = f"📖 漫画 ID: {self.album_id}\n📄 图片 #{first}-{first + volume.pages - 1}"
+
+        async def send_document(**kwargs):
+            # 限流重试时从头重新读取分卷文件
+            volume.file.seek(0)
+            return await self.chat.send_document(document=volume.file, **kwargs)
+
+        try:
+            await MediaGroupUploader._with_flood_retry(
+                send_document,
+                'document',
+                filename=filename,
+                caption=caption,
+                read_timeout=self.read_timeout,
+                write_timeout=self.write_timeout,
+            )
+        except Exception as e:
+            self.failed_count += volume.pages
+            logger.error(f"发送文件失败: {filename}, {e}")
+            return
+        finally:
+            volume.file.close()
+
+        if self.first_sent_at is None:
+            self.first_sent_at = time.monotonic()
+        self.sent_count += volume.pages
+        PAGES_SENT.labels('archive').inc(volume.pages)
+        UPLOAD_BYTES.inc(volume.size)
+        _notify_sent(self.on_sent, pages)
+        if self.on_volume_sent is not None:
+            try:
+                self.on_volume_sent(volume.index)
+            except Exception as e:
+                logger.warning(f"记录分卷失败: {e}")
+        logger.info(f"文件 {filename} 发送成功 ({volume.size / 1048576:.1f}MB, {volume.pages} 张)")
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+内存预算控制
+定期采样进程 RSS，根据配置的内存预算：
+- 调整 jmcomic 下载的并发数 (download.threading.image / photo)
+- 内存紧张时暂缓启动排队中的下载任务
+- 每个下载任务结束后执行 gc.collect() 和 malloc_trim，把空闲内存还给系统
+"""
+import asyncio
+import ctypes
+import ctypes.util
+import gc
+import logging
+import os
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def read_rss() -> int:
+    """当前进程的常驻内存 (字节)，无法读取时返回 0"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _load_malloc_trim():
+    libc_name = ctypes.util.find_library('c')
+    if not libc_name:
+        return None
+    try:
+        return ctypes.CDLL(libc_name).malloc_trim
+    except (OSError, AttributeError):
+        # 非 glibc（例如 musl、macOS）没有 malloc_trim
+        return None
+
+
+_malloc_trim = _load_malloc_trim()
+
+
+def release_memory():
+    """回收循环引用，并把 glibc 堆中的空闲内存归还给系统"""
+    gc.collect()
+    if _malloc_trim is not None:
+        _malloc_trim(0)
+
+
+class MemoryGovernor:
+    """按内存预算调整下载并发
+
+    - RSS 超过 high_ratio * budget：图片并发减半，章节并发降为 1，暂停启动新任务
+    - RSS 低于 low_ratio * budget：图片、章节并发逐步加 1，直到上限；两次提高之间至少间隔 interval 秒，
+      新的并发对内存的影响要等下一次采样才能看到
+    - RSS 低于 admit_ratio * budget 时才允许启动新的下载任务
+    """
+
+    def __init__(self, option, budget_bytes: int,
+                 max_image_threads: int = 4, max_photo_threads: int = 1,
+                 interval: float = 5.0,
+                 low_ratio: float = 0.6, admit_ratio: float = 0.75, high_ratio: float = 0.85):
+        """初始化
+
+        Args:
+            option: 下载使用的 JmOption，直接修改其 download.threading
+            budget_bytes: 内存预算 (字节)，<= 0 表示不限制
+            max_image_threads: 单个章节同时下载的图片数上限
+            max_photo_threads: 同时下载的章节数上限
+            interval: 采样间隔 (秒)
+            low_ratio: 低于该比例时提高并发
+            admit_ratio: 低于该比例时允许启动新任务
+            high_ratio: 高于该比例时降低并发
+        """
+        self.option = option
+        self.budget = budget_bytes
+        self.max_image_threads = max(1, max_image_threads)
+        self.max_photo_threads = max(1, max_photo_threads)
+        self.interval = interval
+        self.low_ratio = low_ratio
+        self.admit_ratio = admit_ratio
+        self.high_ratio = high_ratio
+
+        self.rss = 0
+        self._task: Optional[asyncio.Task] = None
+        # 上一次提高并发的时间（time.monotonic()）
+        self._raised_at = float('-inf')
+        # 从最保守的并发开始，内存充足时再逐步提高
+        self._set_threads(1, 1)
+
+    @property
+    def image_threads(self) -> int:
+        return self.option.download.threading.image
+
+    @property
+    def photo_threads(self) -> int:
+        return self.option.download.threading.photo
+
+    def _set_threads(self, image: int, photo: int):
+        # jmcomic 在每个章节/本子开始下载时读取这两个值，修改会在下一个章节生效；
+        # 按页面顺序下载（PageOrderPool）时在下一张图片开始时生效
+        self.option.download.threading.image = image
+        self.option.download.threading.photo = photo
+
+    def start(self):
+        """在事件循环中启动定期采样"""
+        if self._task is None and self.budget > 0:
+            self._task = asyncio.create_task(self._sample_loop(), name='memory-governor')
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def adjust(self) -> int:
+        """采样一次 RSS 并调整并发，返回 RSS"""
+        self.rss = read_rss()
+        if self.budget <= 0 or self.rss <= 0:
+            return self.rss
+
+        usage = self.rss / self.budget
+        image, photo = self.image_threads, self.photo_threads
+        if usage >= self.high_ratio:
+            image, photo = max(1, image // 2), 1
+        elif usage <= self.low_ratio and time.monotonic() - self._raised_at >= self.interval:
+            # can_admit() 也会调用 adjust()：同时到达的多个任务不能连续提高并发
+            image = min(self.max_image_threads, image + 1)
+            photo = min(self.max_photo_threads, photo + 1)
+            if (image, photo) != (self.image_threads, self.photo_threads):
+                self._raised_at = time.monotonic()
+
+        if (image, photo) != (self.image_threads, self.photo_threads):
+            logger.info(f"内存 {self.rss / 1048576:.0f}MB / {self.budget / 1048576:.0f}MB，"
+                        f"下载并发调整为 图片 {image}、章节 {photo}")
+            self._set_threads(image, photo)
+        return self.rss
+
+    def can_admit(self) -> bool:
+        """是否有足够的内存启动一个新的下载任务"""
+        if self.budget <= 0:
+            return True
+        rss = self.adjust()
+        return rss <= 0 or rss < self.admit_ratio * self.budget
+
+    def after_job(self):
+        """下载任务之间回收内存"""
+        before = read_rss()
+        release_memory()
+        after = self.adjust()
+        if before and after:
+            logger.info(f"任务结束回收内存: {before / 1048576:.0f}MB -> {after / 1048576:.0f}MB")
+
+    def stats(self) -> dict:
+        return {
+            'rss': self.rss,
+            'budget': self.budget,
+            'image_threads': self.image_threads,
+            'photo_threads': self.photo_threads,
+        }
+
+    async def _sample_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.adjust()
+            except Exception as e:
+                logger.warning(f"内存采样错误: {e}")
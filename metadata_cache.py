@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+元数据缓存（搜索结果、本子详情）
+- LRU 淘汰，最多 maxsize 条
+- 未超过 ttl 的条目直接返回
+- 超过 ttl 但未超过 max_stale 的条目也立即返回，同时在后台刷新（stale-while-revalidate）
+- 同一个 key 同时只有一个加载/刷新请求，所有等待者都取消时加载才会被取消
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class MetadataCache:
+    """异步的 TTL + LRU 缓存，只能在事件循环线程中使用"""
+
+    def __init__(self, name: str, maxsize: int = 256, ttl: float = 300, max_stale: float = 3600):
+        """初始化
+
+        Args:
+            name: 缓存名称（日志用）
+            maxsize: 最多缓存条数
+            ttl: 条目保持新鲜的秒数
+            max_stale: 条目最长可用秒数，超过后必须重新加载
+        """
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_stale = max(ttl, max_stale)
+
+        # key -> (写入时间, 值)
+        self._entries: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        # key -> 进行中的加载
+        self._loading: Dict[Hashable, asyncio.Future] = {}
+        # key -> 等待该加载的请求数（后台刷新也算一个）
+        self._waiters: Dict[Hashable, int] = {}
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refresh_errors = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'refresh_errors': self.refresh_errors,
+        }
+
+    async def get(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """获取 key 对应的值，没有可用缓存时调用 loader 加载
+
+        loader 抛出异常或返回 None 时不写入缓存，异常会原样抛出。
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry[0]
+            if age <= self.max_stale:
+                self._entries.move_to_end(key)
+                if age <= self.ttl:
+                    self.hits += 1
+                else:
+                    self.stale_hits += 1
+                    self._refresh_in_background(key, loader)
+                return entry[1]
+            del self._entries[key]
+
+        self.misses += 1
+        return await self._wait(key, self._load(key, loader))
+
+    def peek(self, key: Hashable) -> bool:
+        """是否有未过期的缓存（不计入命中统计）"""
+        entry = self._entries.get(key)
+        return entry is not None and time.monotonic() - entry[0] <= self.ttl
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def _put(self, key: Hashable, value: Any):
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def _wait(self, key: Hashable, future: asyncio.Future) -> Any:
+        # 一个等待者被取消（例如预取被放弃）时不影响其他等待者，最后一个等待者离开时才取消加载
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if self._waiters[key] == 1 and not future.done():
+                future.cancel()
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if self._waiters[key] == 0:
+                del self._waiters[key]
+
+    def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        future = self._loading.get(key)
+        if future is not None:
+            return future
+
+        async def _run():
+            try:
+                value = await loader()
+                if value is not None:
+                    self._put(key, value)
+                return value
+            finally:
+                del self._loading[key]
+
+        future = self._loading[key] = asyncio.ensure_future(_run())
+        return future
+
+    def _refresh_in_background(self, key: Hashable, loader: Callable[[], Awaitable[Any]]):
+        if key in self._loading:
+            return
+
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+
+        def _on_done(future: asyncio.Future):
+            self._waiters[key] -= 1
+            if self._waiters[key] == 0:
+                del self._waiters[key]
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                self.refresh_errors += 1
+                logger.warning(f"{self.name} 缓存后台刷新失败: {key}, {future.exception()}")
+
+        self._load(key, loader).add_done_callback(_on_done)
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prometheus 指标
+不依赖 prometheus_client 的极简实现：Counter / Gauge / Histogram / CallbackGauge，
+由 healthcheck 的 /metrics 以文本格式输出。所有指标都可以在任意线程中更新。
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple, Union
+
+# 延迟直方图的默认分桶 (秒)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    body = ','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels.items()
+    )
+    return '{' + body + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """输出 Prometheus 文本格式"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values, **kwargs):
+        """取得一组标签值对应的子指标"""
+        if kwargs:
+            values = tuple(str(kwargs[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(value) for value in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f'{self.name} 需要标签 {self.labelnames}')
+
+        with self._lock:
+            child = self._children.get(values)
+            if child is None:
+                child = self._children[values] = self._new_child()
+            return child
+
+    def _default(self):
+        # 没有标签的指标直接在自身上调用 inc/set/observe
+        return self.labels()
+
+    def _items(self) -> List[Tuple[Dict[str, str], object]]:
+        with self._lock:
+            return [(dict(zip(self.labelnames, values)), child) for values, child in self._children.items()]
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def collect(self) -> List[str]:
+        raise NotImplementedError
+
+
+class _Value:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    def set(self, value: float):
+        with self._lock:
+            self.value = value
+
+
+class Counter(_Metric):
+    """只增不减的计数"""
+    type = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self._default().inc(amount)
+
+    def collect(self) -> List[str]:
+        return [f'{self.name}{_format_labels(labels)} {_format_value(child.value)}'
+                for labels, child in self._items()]
+
+
+class Gauge(Counter):
+    """可增可减的当前值"""
+    type = 'gauge'
+
+    def set(self, value: float):
+        self._default().set(value)
+
+    def dec(self, amount: float = 1):
+        self._default().dec(amount)
+
+
+class _HistogramValue:
+    def __init__(self, buckets: Sequence[float]):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    @contextmanager
+    def time(self):
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - begin)
+
+
+class Histogram(_Metric):
+    """分桶统计（延迟等）"""
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+    def collect(self) -> List[str]:
+        lines = []
+        for labels, child in self._items():
+            with child._lock:
+                counts, total, count = list(child.counts), child.sum, child.count
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = dict(labels, le=_format_value(bound))
+                lines.append(f'{self.name}_bucket{_format_labels(bucket_labels)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(labels)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(labels)} {count}')
+        return lines
+
+
+class CallbackGauge(_Metric):
+    """输出时调用 func 取值的 gauge
+
+    func 返回一个数值，或 [(标签字典, 数值), ...]
+    """
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str,
+                 func: Callable[[], Union[float, Iterable[Tuple[Dict[str, str], float]]]],
+                 registry=REGISTRY, metric_type: str = 'gauge'):
+        self.func = func
+        self.type = metric_type
+        super().__init__(name, documentation, (), registry)
+
+    def collect(self) -> List[str]:
+        result = self.func()
+        if isinstance(result, (int, float)):
+            return [f'{self.name} {_format_value(result)}']
+        return [f'{self.name}{_format_labels(labels)} {_format_value(value)}' for labels, value in result]
+
+
+# ============ 下载/发送流水线指标 ============
+
+TIME_TO_FIRST_IMAGE = Histogram(
+    'jm_time_to_first_image_seconds',
+    '从开始处理下载请求到第一张图片发送到会话的时间',
+)
+PAGE_DOWNLOAD_SECONDS = Histogram(
+    'jm_page_download_seconds',
+    '单张图片从禁漫下载的耗时（不含解码）',
+)
+PAGE_DECODE_SECONDS = Histogram(
+    'jm_page_decode_seconds',
+    '单张图片解码（还原分割）并写入磁盘的耗时',
+)
+PAGE_PREPROCESS_SECONDS = Histogram(
+    'jm_page_preprocess_seconds',
+    '超出 Telegram 限制的图片缩放/切分耗时',
+)
+UPLOAD_SECONDS = Histogram(
+    'jm_upload_seconds',
+    '一次 Telegram 图片上传请求的耗时',
+    labelnames=('kind',),
+)
+SEARCH_SECONDS = Histogram(
+    'jm_search_seconds',
+    '搜索请求耗时（含缓存）',
+)
+DOWNLOAD_BYTES = Counter(
+    'jm_download_bytes_total',
+    '从禁漫下载的图片字节数',
+)
+UPLOAD_BYTES = Counter(
+    'jm_upload_bytes_total',
+    '上传到 Telegram 的图片字节数（file_id 转发不计）',
+)
+PAGES_SENT = Counter(
+    'jm_pages_sent_total',
+    '发送到会话的页面数',
+    labelnames=('source',),
+)
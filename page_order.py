@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按页面顺序下载
+- PageOrderPool: 所有章节的图片放进同一个优先队列，空闲线程总是先开始 (章节序号, 页序号) 最小的图片，
+  第 1 页最先开始下载，而不是和其他图片一起随机完成
+- PageReorderBuffer: 页面按完成顺序到达，缓冲后按页面顺序交出；缓冲的页面超过上限时不再等待
+  前面较慢的页面，直接交出最小的一张，不会因为一张图片卡住整本
+"""
+import heapq
+import itertools
+import logging
+import threading
+from collections import deque
+from typing import Callable, Dict, Iterable, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (章节序号, 页序号)
+PageKey = Tuple[int, int]
+
+
+class _Batch:
+    """一次 run() 提交的任务，全部结束时唤醒提交的线程"""
+
+    def __init__(self, count: int):
+        self.remaining = count
+        self.done = threading.Event()
+        if count == 0:
+            self.done.set()
+
+
+class PageOrderPool:
+    """按页面顺序执行图片下载的线程池（一个 downloader 一个）
+
+    线程在有任务时按需启动（最多 workers() 个），队列为空时退出，不需要关闭。
+    workers 在每次取任务时重新读取：上限降低时多出的线程做完手上的图片就退出，升高时补充线程，
+    内存调节器修改并发后从下一张图片开始生效。
+    """
+
+    def __init__(self, workers: Callable[[], int]):
+        self._workers = workers
+        self._heap: list = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = 0
+
+    def run(self, tasks: Iterable[Tuple[PageKey, Callable[[], None]]]):
+        """加入一批 (key, 任务) 并阻塞到这批任务全部结束
+
+        任务抛出的异常在这里忽略：图片下载失败已经由 JmDownloader 的 catch_exception 记录
+        """
+        tasks = list(tasks)
+        batch = _Batch(len(tasks))
+        with self._cond:
+            for key, task in tasks:
+                heapq.heappush(self._heap, (key, next(self._seq), task, batch))
+            spawn = self._reserve()
+        self._spawn(spawn)
+        batch.done.wait()
+
+    @property
+    def workers(self) -> int:
+        return max(1, self._workers())
+
+    def _reserve(self) -> int:
+        """（持有 _cond 时调用）按当前上限需要补充的线程数，并计入 _threads"""
+        spawn = max(0, min(self.workers - self._threads, len(self._heap)))
+        self._threads += spawn
+        return spawn
+
+    def _spawn(self, count: int):
+        for _ in range(count):
+            threading.Thread(target=self._work, name='page-order', daemon=True).start()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                # 队列为空或线程数超过当前上限时退出
+                if not self._heap or self._threads > self.workers:
+                    self._threads -= 1
+                    return
+                _, _, task, batch = heapq.heappop(self._heap)
+                spawn = self._reserve()
+            self._spawn(spawn)
+            try:
+                task()
+            except Exception:
+                pass
+            finally:
+                with self._cond:
+                    batch.remaining -= 1
+                    if batch.remaining == 0:
+                        batch.done.set()
+
+
+class PageReorderBuffer:
+    """把按完成顺序到达的页面按 (章节序号, 页序号) 顺序交给 emit（线程安全）
+
+    一张页面可以交出的条件：排在它前面的章节都已结束，同一章节中排在它前面、已登记的图片都已结束（成功或失败）。
+    下载线程在 emit 中可能阻塞（FetchWindow）。emit 在状态锁之外调用，期间其他线程仍可以登记和完成图片；
+    可以交出的页面按顺序进入队列，由持有 _emit_lock 的线程依次交出，交出了页面的线程等到队列排空才返回（保持背压）。
+    """
+
+    def __init__(self, emit: Callable, window: int):
+        """初始化
+
+        Args:
+            emit: 按顺序交出页面的回调 (page)
+            window: 最多缓冲的页面数，超出时不再等待前面的页面
+        """
+        self.emit = emit
+        self.window = max(1, window)
+        # 因为缓冲已满而提前交出的页面数
+        self.overflows = 0
+        self._lock = threading.Lock()
+        self._emit_lock = threading.Lock()
+        # 已经可以交出、等待 emit 的页面（按顺序）
+        self._ready = deque()
+        # 已完成、还不能交出的页面
+        self._buffer: Dict[PageKey, object] = {}
+        # 还没结束的章节，以及已登记、还没结束的图片
+        self._open_chapters: Set[int] = set()
+        self._unresolved: Set[PageKey] = set()
+
+    def expect_chapters(self, photo_indexes: Iterable[int]):
+        """本子要下载的章节（do_filter 之后）"""
+        with self._lock:
+            self._open_chapters.update(photo_indexes)
+
+    def expect_pages(self, keys: Iterable[PageKey]):
+        """章节要下载的图片（do_filter 之后）"""
+        with self._lock:
+            self._unresolved.update(keys)
+
+    def add(self, page):
+        """一张页面已经保存到磁盘（还没有结束，结束时调用 done）"""
+        with self._lock:
+            self._buffer[(page.photo_index, page.page_index)] = page
+
+    def done(self, key: PageKey):
+        """一张图片结束（下载成功、已存在或失败），交出所有可以交出的页面"""
+        with self._lock:
+            self._unresolved.discard(key)
+            released = self._release()
+        if released:
+            self._drain()
+
+    def close_chapter(self, photo_index: int):
+        """章节结束（包括章节详情获取失败）"""
+        with self._lock:
+            self._open_chapters.discard(photo_index)
+            self._unresolved = {key for key in self._unresolved if key[0] != photo_index}
+            released = self._release()
+        if released:
+            self._drain()
+
+    def flush(self):
+        """下载结束：按顺序交出剩下的全部页面"""
+        with self._lock:
+            for key in sorted(self._buffer):
+                self._ready.append(self._buffer.pop(key))
+        self._drain()
+
+    def _blocked(self, key: PageKey) -> bool:
+        if any(chapter < key[0] for chapter in self._open_chapters):
+            return True
+        return any(pending < key for pending in self._unresolved)
+
+    def _release(self) -> int:
+        """（持有 _lock 时调用）把可以交出的页面按顺序移入 _ready，返回移入的数量"""
+        released = 0
+        while self._buffer:
+            key = min(self._buffer)
+            if self._blocked(key):
+                if len(self._buffer) <= self.window:
+                    break
+                self.overflows += 1
+                logger.debug(f"重排缓冲已满，提前交出页面 {key}")
+            self._ready.append(self._buffer.pop(key))
+            released += 1
+        return released
+
+    def _drain(self):
+        """在 _lock 之外按顺序交出 _ready 中的页面，同一时间只有一个线程调用 emit"""
+        with self._emit_lock:
+            while True:
+                with self._lock:
+                    if not self._ready:
+                        return
+                    page = self._ready.popleft()
+                self.emit(page)
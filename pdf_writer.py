@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式 PDF 写入
+每次只处理一页：JPEG 原样嵌入（DCTDecode），其他格式解码后立刻转成 JPEG 嵌入并释放，
+内存占用与页数无关
+"""
+import io
+from pathlib import Path
+from typing import BinaryIO, List, Tuple
+
+from PIL import Image
+
+# 可以直接嵌入 PDF 的 JPEG 色彩模式
+_JPEG_COLORSPACE = {
+    'RGB': '/DeviceRGB',
+    'L': '/DeviceGray',
+}
+
+
+class StreamingPdfWriter:
+    """逐页写入的 PDF 生成器
+
+    页面尺寸与 Pillow 的 save(resolution=...) 一致：宽高 = 像素 * 72 / resolution。
+
+    用法:
+        with StreamingPdfWriter(output_file) as writer:
+            for img_file in image_files:
+                writer.add_image(img_file)
+    """
+
+    # 对象 1 为 Catalog，对象 2 为 Pages（Pages 在最后写入，因为需要所有页面的引用）
+    CATALOG_ID = 1
+    PAGES_ID = 2
+
+    def __init__(self, output_file: Path, resolution: float = 100.0, quality: int = 95):
+        """初始化
+
+        Args:
+            output_file: 输出 PDF 文件路径
+            resolution: 图片分辨率 (DPI)，决定页面尺寸
+            quality: 非 JPEG 图片转码为 JPEG 时的质量 (1-100)
+        """
+        self.output_file = output_file
+        self.resolution = resolution
+        self.quality = quality
+
+        self._fp: BinaryIO = None
+        self._offsets: List[Tuple[int, int]] = []  # (对象 ID, 文件偏移)
+        self._page_ids: List[int] = []
+        self._next_id = self.PAGES_ID + 1
+
+    @property
+    def page_count(self) -> int:
+        return len(self._page_ids)
+
+    def open(self):
+        self._fp = open(self.output_file, 'wb')
+        # 二进制注释行，提示这是一个包含二进制数据的 PDF
+        self._fp.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        self._write_object(self.CATALOG_ID, f'<< /Type /Catalog /Pages {self.PAGES_ID} 0 R >>'.encode())
+        return self
+
+    def add_image(self, img_file: Path):
+        """把一张图片写成一页，写完即释放
+
+        写入失败时回滚到这一页之前（文件中不留下写了一半的对象和没有写入的对象编号），异常原样抛出
+        """
+        jpeg_data, (width, height), colorspace = self._to_jpeg(img_file)
+
+        start = self._fp.tell()
+        next_id = self._next_id
+        offset_count = len(self._offsets)
+        try:
+            self._write_page(jpeg_data, width, height, colorspace)
+        except BaseException:
+            self._fp.seek(start)
+            self._fp.truncate()
+            self._next_id = next_id
+            del self._offsets[offset_count:]
+            raise
+
+    def _write_page(self, jpeg_data: bytes, width: int, height: int, colorspace: str):
+        image_id = self._alloc_id()
+        content_id = self._alloc_id()
+        page_id = self._alloc_id()
+
+        self._write_stream(
+            image_id,
+            f'<< /Type /XObject /Subtype /Image /Width {width} /Height {height} '
+            f'/ColorSpace {colorspace} /BitsPerComponent 8 /Filter /DCTDecode '
+            f'/Length {len(jpeg_data)} >>'.encode(),
+            jpeg_data,
+        )
+
+        page_width = width * 72.0 / self.resolution
+        page_height = height * 72.0 / self.resolution
+        content = f'q {page_width:.4f} 0 0 {page_height:.4f} 0 0 cm /image Do Q'.encode()
+        self._write_stream(content_id, f'<< /Length {len(content)} >>'.encode(), content)
+
+        self._write_object(
+            page_id,
+            f'<< /Type /Page /Parent {self.PAGES_ID} 0 R '
+            f'/MediaBox [0 0 {page_width:.4f} {page_height:.4f}] '
+            f'/Resources << /XObject << /image {image_id} 0 R >> >> '
+            f'/Contents {content_id} 0 R >>'.encode()
+        )
+        self._page_ids.append(page_id)
+
+    def close(self):
+        """写入 Pages、交叉引用表和 trailer"""
+        if self._fp is None:
+            return
+
+        kids = ' '.join(f'{page_id} 0 R' for page_id in self._page_ids)
+        self._write_object(
+            self.PAGES_ID,
+            f'<< /Type /Pages /Kids [{kids}] /Count {len(self._page_ids)} >>'.encode()
+        )
+
+        xref_offset = self._fp.tell()
+        offsets = dict(self._offsets)
+        size = self._next_id
+        lines = [f'xref\n0 {size}\n', '0000000000 65535 f \n']
+        for obj_id in range(1, size):
+            lines.append(f'{offsets[obj_id]:010d} 00000 n \n')
+        self._fp.write(''.join(lines).encode())
+        self._fp.write(
+            f'trailer\n<< /Size {size} /Root {self.CATALOG_ID} 0 R >>\n'
+            f'startxref\n{xref_offset}\n%%EOF\n'.encode()
+        )
+
+        self._fp.close()
+        self._fp = None
+
+    def _to_jpeg(self, img_file: Path):
+        """返回 (JPEG 数据, (宽, 高), PDF 色彩空间)
+
+        RGB/灰度 JPEG 直接读取原始字节，不做解码；其他图片解码一张、转码一张。
+        """
+        with Image.open(img_file) as img:
+            size = img.size
+            if img.format == 'JPEG' and img.mode in _JPEG_COLORSPACE:
+                return Path(img_file).read_bytes(), size, _JPEG_COLORSPACE[img.mode]
+
+            rgb = img.convert('RGB')
+            try:
+                buffer = io.BytesIO()
+                rgb.save(buffer, format='JPEG', quality=self.quality)
+            finally:
+                rgb.close()
+
+        return buffer.getvalue(), size, _JPEG_COLORSPACE['RGB']
+
+    def _alloc_id(self) -> int:
+        obj_id = self._next_id
+        self._next_id += 1
+        return obj_id
+
+    def _write_object(self, obj_id: int, body: bytes):
+        self._offsets.append((obj_id, self._fp.tell()))
+        self._fp.write(f'{obj_id} 0 obj\n'.encode())
+        self._fp.write(body)
+        self._fp.write(b'\nendobj\n')
+
+    def _write_stream(self, obj_id: int, header: bytes, data: bytes):
+        self._offsets.append((obj_id, self._fp.tell()))
+        self._fp.write(f'{obj_id} 0 obj\n'.encode())
+        self._fp.write(header)
+        self._fp.write(b'\nstream\n')
+        self._fp.write(data)
+        self._fp.write(b'\nendstream\nendobj\n')
+
+    def __enter__(self):
+        return self.open()
+
+    def abort(self):
+        """放弃写入：关闭并删除输出文件"""
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+        Path(self.output_file).unlink(missing_ok=True)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.abort()
+            return
+        try:
+            self.close()
+        except BaseException:
+            self.abort()
+            raise
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+搜索结果预取
+搜索结果显示后，用户通常会点击其中一个下载按钮。在低优先级的 prefetch 通道中
+提前载入前几个结果的本子详情（可选封面），点击下载时详情已经在缓存里。
+每个用户同时只保留一组预取，用户的下一个操作会取消不再需要的预取。
+"""
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """按用户管理的可取消预取任务，只能在事件循环线程中使用"""
+
+    def __init__(self, api, max_albums: int = 5, covers: bool = False):
+        """初始化
+
+        Args:
+            api: JMComicAPI
+            max_albums: 每次搜索最多预取的结果数，0 表示关闭预取
+            covers: 是否同时预取封面
+        """
+        self.api = api
+        self.max_albums = max_albums
+        self.covers = covers
+        # user_id -> {album_id: task}
+        self._tasks: Dict[int, Dict[str, asyncio.Task]] = {}
+
+        self.scheduled = 0
+        self.completed = 0
+        self.cancelled = 0
+
+    def schedule(self, user_id: int, album_ids: List[str]):
+        """按顺序预取 album_ids 的前 max_albums 个，取消该用户之前的预取"""
+        self.cancel(user_id)
+        if self.max_albums <= 0:
+            return
+
+        tasks = self._tasks[user_id] = {}
+        for album_id in album_ids[:self.max_albums]:
+            task = asyncio.create_task(self.api.prefetch_album(album_id, self.covers), name=f'prefetch-{album_id}')
+            task.add_done_callback(lambda t, album_id=album_id: self._on_done(user_id, album_id, t))
+            tasks[album_id] = task
+            self.scheduled += 1
+
+    def cancel(self, user_id: int, keep: Optional[str] = None):
+        """取消用户的预取
+
+        Args:
+            user_id: 用户 ID
+            keep: 保留这个本子的预取（用户正好选了它，正式请求会复用这次预取）
+        """
+        tasks = self._tasks.pop(user_id, None)
+        if not tasks:
+            return
+        for album_id, task in tasks.items():
+            if album_id != keep:
+                task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            'pending': sum(len(tasks) for tasks in self._tasks.values()),
+            'scheduled': self.scheduled,
+            'completed': self.completed,
+            'cancelled': self.cancelled,
+        }
+
+    def _on_done(self, user_id: int, album_id: str, task: asyncio.Task):
+        tasks = self._tasks.get(user_id)
+        if tasks is not None and tasks.get(album_id) is task:
+            del tasks[album_id]
+            if not tasks:
+                del self._tasks[user_id]
+
+        if task.cancelled():
+            self.cancelled += 1
+            return
+        self.completed += 1
+        if task.exception() is not None:
+            logger.warning(f"预取失败: {album_id}, {task.exception()}")
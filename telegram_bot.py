@@ -6,16 +6,20 @@ JMComic Telegram Bot
 """
 import asyncio
 import logging
-from pathlib import Path
-import shutil
+import signal
+import time
 from typing import Optional
 from functools import wraps
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton, InputMediaPhoto
+from telegram import (
+    Chat, Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton, InputMediaPhoto,
+    InlineQueryResultArticle, InputTextMessageContent
+)
 from telegram.ext import (
     Application,
     CommandHandler,
     CallbackQueryHandler,
+    InlineQueryHandler,
     ContextTypes,
     MessageHandler,
     filters,
@@ -23,8 +27,18 @@ from telegram.ext import (
 )
 
 from telegram_config import TelegramConfig
-from jmcomic_wrapper import JMComicAPI
+from jmcomic_wrapper import DownloadSelection, JMComicAPI, PageRef
+from download_workers import DownloadWorkerPool
 from healthcheck import start_healthcheck_server
+from media_uploader import MEDIA_GROUP_MAX, ArchiveUploader, MediaGroupUploader
+from delivery_pipeline import DeliveryPipeline
+from file_id_cache import FileIdCache, album_version
+from job_journal import JobJournal
+from prefetcher import Prefetcher
+from download_scheduler import DownloadScheduler, RateLimiter
+from image_preprocess import ImagePreprocessor
+from memory_governor import MemoryGovernor, read_rss
+from metrics import REGISTRY, TIME_TO_FIRST_IMAGE, CallbackGauge
 
 # 配置日志
 logging.basicConfig(
@@ -33,8 +47,106 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 多进程模式：本子下载在独立的工作进程中执行
+download_workers = DownloadWorkerPool(
+    TelegramConfig.DOWNLOAD_PROCESSES,
+    TelegramConfig.DOWNLOAD_DIR,
+    max_jobs=TelegramConfig.WORKER_MAX_JOBS,
+    max_rss_bytes=TelegramConfig.WORKER_MAX_RSS_MB * 1024 * 1024
+) if TelegramConfig.DOWNLOAD_PROCESSES > 0 else None
+
 # 初始化 JMComic API
-jm_api = JMComicAPI(TelegramConfig.DOWNLOAD_DIR)
+jm_api = JMComicAPI(
+    TelegramConfig.DOWNLOAD_DIR,
+    cache_size=TelegramConfig.METADATA_CACHE_SIZE,
+    cache_ttl=TelegramConfig.METADATA_CACHE_TTL,
+    cache_max_stale=TelegramConfig.METADATA_CACHE_MAX_STALE,
+    fast_lane_workers=TelegramConfig.FAST_LANE_WORKERS,
+    download_lane_workers=TelegramConfig.DOWNLOAD_LANE_WORKERS,
+    album_cache_bytes=TelegramConfig.ALBUM_CACHE_MAX_MB * 1024 * 1024,
+    cover_cache_bytes=TelegramConfig.COVER_CACHE_MAX_MB * 1024 * 1024,
+    cover_lane_workers=TelegramConfig.COVER_WORKERS,
+    index_db=TelegramConfig.ALBUM_INDEX_DB,
+    worker_pool=download_workers,
+    fetch_ahead=TelegramConfig.FETCH_AHEAD_PAGES,
+    page_order=TelegramConfig.PAGE_ORDER_DOWNLOAD,
+    reorder_window=TelegramConfig.REORDER_WINDOW_PAGES
+)
+
+# Telegram file_id 缓存（同一本子再次请求时直接转发）
+file_id_cache = FileIdCache(TelegramConfig.FILE_ID_CACHE_DB)
+
+# 下载任务日志（重启后恢复未完成的任务）
+job_journal = JobJournal(TelegramConfig.JOB_JOURNAL_DB)
+
+# 搜索结果的详情/封面预取
+prefetcher = Prefetcher(jm_api, TelegramConfig.PREFETCH_COUNT, TelegramConfig.PREFETCH_COVERS)
+
+# 上传前把超出 Telegram 图片限制的页面缩放/切分（进程池）
+image_preprocessor = ImagePreprocessor(
+    max_workers=TelegramConfig.PREPROCESS_WORKERS,
+    quality=TelegramConfig.COMPRESS_QUALITY,
+    max_bytes=TelegramConfig.MAX_FILE_SIZE_MB * 1024 * 1024
+)
+
+# 按内存预算调整下载并发，任务之间回收内存
+memory_governor = MemoryGovernor(
+    jm_api.option,
+    TelegramConfig.MEMORY_BUDGET_MB * 1024 * 1024,
+    max_image_threads=TelegramConfig.MAX_IMAGE_THREADS,
+    max_photo_threads=TelegramConfig.MAX_PHOTO_THREADS
+)
+
+# 下载任务调度（全局并发上限 + 用户间轮询 + 内存准入）和每用户每小时限额
+download_scheduler = DownloadScheduler(
+    TelegramConfig.MAX_CONCURRENT_DOWNLOADS,
+    admission=memory_governor.can_admit,
+    after_job=memory_governor.after_job
+)
+download_limiter = RateLimiter(TelegramConfig.MAX_DOWNLOADS_PER_HOUR)
+search_limiter = RateLimiter(TelegramConfig.MAX_SEARCHES_PER_HOUR)
+
+# /metrics 中按需取值的指标
+CallbackGauge('jm_lane_queue_depth', '执行通道中等待执行的任务数',
+              lambda: [({'lane': name}, lane['queued']) for name, lane in jm_api.lane_stats().items()])
+CallbackGauge('jm_lane_running', '执行通道中正在执行的任务数',
+              lambda: [({'lane': name}, lane['running']) for name, lane in jm_api.lane_stats().items()])
+CallbackGauge('jm_lane_wait_p95_seconds', '执行通道最近任务排队时间的 p95',
+              lambda: [({'lane': name}, lane['wait_p95']) for name, lane in jm_api.lane_stats().items()])
+CallbackGauge('jm_download_jobs_active', '正在执行的下载任务数', lambda: download_scheduler.active_jobs)
+CallbackGauge('jm_download_jobs_queued', '排队中的下载任务数', lambda: download_scheduler.queued_jobs)
+CallbackGauge('jm_cache_requests_total', '元数据缓存请求数，result 为 hit / stale / miss',
+              lambda: [
+                  ({'cache': name, 'result': result}, stats[key])
+                  for name, stats in jm_api.cache_stats().items()
+                  for result, key in (('hit', 'hits'), ('stale', 'stale_hits'), ('miss', 'misses'))
+              ],
+              metric_type='counter')
+CallbackGauge('jm_album_cache_bytes', '本子磁盘缓存占用的字节数',
+              lambda: jm_api.disk_cache.total_bytes if jm_api.disk_cache else 0)
+CallbackGauge('jm_album_cache_requests_total', '本子磁盘缓存请求数，result 为 hit / miss',
+              lambda: [
+                  ({'result': result}, getattr(jm_api.disk_cache, key) if jm_api.disk_cache else 0)
+                  for result, key in (('hit', 'hits'), ('miss', 'misses'))
+              ],
+              metric_type='counter')
+CallbackGauge('jm_process_rss_bytes', '进程常驻内存', read_rss)
+CallbackGauge('jm_memory_budget_bytes', '内存预算', lambda: memory_governor.budget)
+
+# 排队中/下载中的 (chat_id, album_id, 范围)，同一会话重复点击不会重复发送
+pending_downloads = set()
+
+# 发送中的预览 (chat_id, album_id)
+pending_previews = set()
+
+# 页面准备好后最多再等封面几秒，超时则不带封面发送预览（封面仍在后台下载并缓存）
+PREVIEW_COVER_WAIT = 2
+
+# 章节选择按钮每页显示的章节数
+CHAPTERS_PER_PAGE = 24
+
+# user_id -> 最近一次 inline 查询的序号，用于丢弃被新输入取代的查询
+inline_generations = {}
 
 # 存储用户状态
 user_states = {}
@@ -83,7 +195,8 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "2️⃣ 输入关键词或漫画 ID\n\n"
         "💡 也可以使用命令：\n"
         "/search <关键词> - 搜索漫画\n"
-        "/download <ID> - 下载漫画\n"
+        "/download <ID> [章节] [页码 a-b] - 下载漫画\n"
+        "/preview <ID> - 预览前几页\n"
         "/info <ID> - 查看漫画信息\n\n"
     )
 
@@ -110,9 +223,12 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "⌨️ 命令操作：\n"
         "🔍 /search 僕の乳母メイド\n"
         "📥 /download 1222345\n"
+        "📑 /download 1222345 3 1-20（第 3 章的第 1-20 页）\n"
+        "👀 /preview 1222345（先看前几页）\n"
         "ℹ️ /info 1222345\n\n"
         "💡 提示：\n"
         "• 搜索结果会显示按钮，可直接点击下载\n"
+        "• 多章节的本子可以在 /info 中选择章节\n"
         "• 下载以图片组形式发送，可直接查看和保存\n"
         "• 每组最多 10 张图片\n"
         "• 支持 Telegram 原生图片浏览\n\n"
@@ -150,8 +266,8 @@ async def handle_menu_selection(update: Update, context: ContextTypes.DEFAULT_TY
         context.user_data['action'] = 'download'
         await update.message.reply_text(
             "📥 下载漫画\n\n"
-            "请输入漫画 ID：\n"
-            "例如：1222345"
+            "请输入漫画 ID（可以加章节和页码范围）：\n"
+            "例如：1222345 或 1222345 3 1-20"
         )
         return WAITING_INPUT
 
@@ -181,8 +297,8 @@ async def handle_user_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await search_command(update, context)
 
     elif action == 'download':
-        # 模拟命令调用
-        context.args = [user_input]
+        # 模拟命令调用（ID 之后可以带章节和页码范围）
+        context.args = user_input.split()
         await download_command(update, context)
 
     elif action == 'info':
@@ -197,6 +313,7 @@ async def handle_user_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """取消当前操作"""
+    prefetcher.cancel(update.effective_user.id)
     await update.message.reply_text(
         "操作已取消\n\n"
         "请选择新的操作：",
@@ -219,6 +336,18 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     keyword = " ".join(context.args)
 
+    # 新的搜索让上一次搜索结果的预取失去意义
+    prefetcher.cancel(update.effective_user.id)
+
+    # 检查搜索额度
+    wait_seconds = search_limiter.acquire(update.effective_user.id)
+    if wait_seconds > 0:
+        await update.message.reply_text(
+            f"⏳ 搜索次数已达上限（每小时 {TelegramConfig.MAX_SEARCHES_PER_HOUR} 次）\n"
+            f"请 {format_wait(wait_seconds)} 后再试"
+        )
+        return
+
     # 发送搜索中消息
     searching_msg = await update.message.reply_text(
         f"🔍 正在搜索: {keyword}\n"
@@ -253,7 +382,8 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 InlineKeyboardButton(
                     f"📥 {comic['id']} - {comic['title'][:20]}...",
                     callback_data=f"download_{comic['id']}"
-                )
+                ),
+                InlineKeyboardButton("👀 预览", callback_data=f"preview_{comic['id']}")
             ])
 
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -263,6 +393,14 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=reply_markup
         )
 
+        # 用户接下来大概率点击其中一个结果，提前载入详情
+        album_ids = [comic['id'] for comic in results]
+        prefetcher.schedule(update.effective_user.id, album_ids)
+
+        # 封面拼图在后台生成，不推迟文字结果
+        if TelegramConfig.SEARCH_COVER_SHEET:
+            context.application.create_task(send_search_sheet(searching_msg, keyword, album_ids))
+
     except Exception as e:
         logger.error(f"搜索错误: {e}", exc_info=True)
         await searching_msg.edit_text(
@@ -270,6 +408,20 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
+async def send_search_sheet(results_msg, keyword: str, album_ids: list):
+    """在搜索结果下方发送封面拼图，序号与文字结果对应"""
+    try:
+        sheet = await jm_api.get_search_sheet(keyword, album_ids)
+        if sheet is None:
+            return
+        await results_msg.reply_photo(
+            photo=sheet,
+            caption=f"🖼️ 搜索结果封面: {keyword}"
+        )
+    except Exception as e:
+        logger.warning(f"发送封面拼图失败: {e}")
+
+
 @authorized_only
 async def download_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """处理 /download 命令"""
@@ -277,74 +429,252 @@ async def download_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.args:
         await update.message.reply_text(
             "❌ 请提供漫画 ID\n\n"
-            "示例: /download 1222345"
+            "示例: /download 1222345\n"
+            "只下载一部分: /download 1222345 3 1-20（第 3 章的第 1-20 页）"
         )
         return
 
     album_id = context.args[0]
+    try:
+        selection = DownloadSelection.parse(context.args[1:])
+    except ValueError as e:
+        await update.message.reply_text(
+            f"❌ {e}\n\n"
+            "格式: /download <ID> [章节] [页码 a-b]\n"
+            "示例: /download 1222345 3 1-20"
+        )
+        return
 
-    await handle_download(update, album_id)
+    await enqueue_download(update, album_id, selection)
 
 
-async def handle_download(update: Update, album_id: str):
-    """处理下载逻辑"""
-    # 发送下载中消息
-    if update.callback_query:
-        await update.callback_query.answer("开始下载...")
-        downloading_msg = await update.callback_query.message.reply_text(
-            f"📥 开始下载 ID: {album_id}\n"
-            "⏳ 请稍候..."
-        )
-    else:
-        downloading_msg = await update.message.reply_text(
-            f"📥 开始下载 ID: {album_id}\n"
-            "⏳ 请稍候..."
+def format_wait(seconds: float) -> str:
+    """把等待秒数格式化为 x 分钟 / x 秒"""
+    if seconds >= 60:
+        return f"{int(seconds // 60) + 1} 分钟"
+    return f"{int(seconds) + 1} 秒"
+
+
+def describe_download(album_id: str, selection: DownloadSelection) -> str:
+    """提示消息中的下载内容，例如 1222345 (第 3 章 第 1-20 页)"""
+    return album_id if selection.is_full else f"{album_id} ({selection.describe()})"
+
+
+async def enqueue_download(update: Update, album_id: str, selection: DownloadSelection = DownloadSelection()):
+    """检查下载额度，然后把下载任务交给调度器排队"""
+    user_id = update.effective_user.id
+    message = update.callback_query.message if update.callback_query else update.message
+    prefetcher.cancel(user_id, keep=album_id)
+
+    pending_key = (update.effective_chat.id, album_id, selection.spec)
+    if pending_key in pending_downloads:
+        await message.reply_text(f"⏳ ID: {describe_download(album_id, selection)} 已在下载队列中，请稍候")
+        return
+
+    wait_seconds = download_limiter.acquire(user_id)
+    if wait_seconds > 0:
+        await message.reply_text(
+            f"⏳ 下载次数已达上限（每小时 {TelegramConfig.MAX_DOWNLOADS_PER_HOUR} 次）\n"
+            f"请 {format_wait(wait_seconds)} 后再试"
         )
+        return
 
-    try:
-        sent_count = 0
+    queue_msg = None
+    queue_msg_lock = asyncio.Lock()
+
+    # 排队位置变化时更新提示消息，轮到执行时删除
+    async def on_position(position: int):
+        nonlocal queue_msg
+        async with queue_msg_lock:
+            if position > 0:
+                text = (
+                    f"⏳ 已加入下载队列 ID: {describe_download(album_id, selection)}\n"
+                    f"📋 当前排队位置: 第 {position} 位"
+                )
+                if queue_msg is None:
+                    queue_msg = await message.reply_text(text)
+                else:
+                    await queue_msg.edit_text(text)
+            elif queue_msg is not None:
+                await queue_msg.delete()
+                queue_msg = None
+
+    chat = update.effective_chat
+    job_id = job_journal.add(chat.id, chat.type, user_id, album_id, selection.spec)
+    submit_download(chat, user_id, album_id, job_id, on_position, selection)
+
+
+def submit_download(chat: Chat, user_id: int, album_id: str, job_id: int, on_position=None,
+                    selection: DownloadSelection = DownloadSelection()):
+    """把已记录在任务日志中的下载交给调度器"""
+    pending_key = (chat.id, album_id, selection.spec)
+    job = download_scheduler.submit(
+        user_id,
+        f"download_{album_id}" + (f" {selection.spec}" if not selection.is_full else ""),
+        lambda: handle_download(chat, album_id, job_id, selection),
+        on_position=on_position
+    )
+    pending_downloads.add(pending_key)
+    job.done.add_done_callback(lambda _: pending_downloads.discard(pending_key))
 
-        # 图片回调：每下载一张就发送一张
-        async def image_callback(img_path: Path):
-            nonlocal sent_count
-            sent_count += 1
 
-            try:
-                logger.info(f"发送图片 #{sent_count}: {img_path.name}")
+async def resume_jobs(application: Application):
+    """重新排队上次运行时未完成的下载任务（容器重启）"""
+    for job in job_journal.unfinished(TelegramConfig.JOB_MAX_ATTEMPTS):
+        logger.info(f"恢复下载任务: {job.album_id} (会话 {job.chat_id}，第 {job.attempts + 1} 次)")
+        chat = Chat(job.chat_id, job.chat_type)
+        chat.set_bot(application.bot)
+        submit_download(chat, job.user_id, job.album_id, job.job_id,
+                        selection=DownloadSelection.parse(job.selection.split()))
+
+
+async def handle_download(chat: Chat, album_id: str, job_id: int,
+                          selection: DownloadSelection = DownloadSelection()):
+    """处理下载逻辑（由下载调度器执行），结果写入任务日志
+
+    任务被取消（进程退出）时不写入结果，重启后由 resume_jobs 继续。
+    """
+    job_journal.start(job_id)
+    success = await deliver_album(chat, album_id, job_id, selection)
+    job_journal.finish(job_id, success)
+
+
+async def deliver_album(chat: Chat, album_id: str, job_id: int,
+                        selection: DownloadSelection = DownloadSelection()) -> bool:
+    """下载并发送一个本子（或其中选中的章节/页码范围）
 
-                # 发送单张图片
-                with open(img_path, 'rb') as f:
-                    caption = f"📖 漫画 ID: {album_id}\n📄 图片 #{sent_count}"
-                    await update.effective_chat.send_photo(
-                        photo=f,
-                        caption=caption,
-                        read_timeout=30,
-                        write_timeout=30
-                    )
+    Returns:
+        是否发送完成
+    """
+    started_at = time.monotonic()
 
-                logger.info(f"图片 #{sent_count} 发送成功")
+    # 发送下载中消息
+    downloading_msg = await chat.send_message(
+        f"📥 开始下载 ID: {describe_download(album_id, selection)}\n"
+        "⏳ 请稍候..."
+    )
+
+    # 重启前已经发送过的页面不再发送
+    delivered = job_journal.delivered(job_id)
+    if delivered:
+        logger.info(f"任务 {job_id} 已发送过 {len(delivered)} 张图片，跳过这些页面")
+
+    try:
+        archive_mode = TelegramConfig.DEFAULT_FORMAT == "zip"
+
+        album = None
+        if not archive_mode or not selection.is_full:
+            album = await jm_api.get_album_detail(album_id)
+        if album is not None and selection.chapter > len(album.episode_list):
+            await downloading_msg.edit_text(
+                f"❌ 章节不存在\n\n"
+                f"漫画 ID: {album_id} 共 {len(album.episode_list)} 章"
+            )
+            return False
+
+        def on_sent(pages: list):
+            job_journal.mark_delivered(job_id, [(page.photo_index, page.page_index, page.part) for page in pages])
+
+        def on_cached_sent(pages: list):
+            # 转发中途失败时退回下载，已经转发成功的页面不再发送
+            on_sent(pages)
+            delivered.update((page.photo_index, page.page_index, page.part) for page in pages)
+
+        # 命中 file_id 缓存时直接转发，不再下载和上传（zip 模式整本作为文件发送，不使用页面缓存）
+        # 只下载一部分时从整本的缓存中挑出选中的页面
+        version = None
+        if not archive_mode:
+            version = album_version(album) if album is not None else None
+            accept = selection.page_filter(album) if not selection.is_full else None
+            if not delivered and version is not None and await send_cached_album(
+                    chat, album_id, version, downloading_msg, started_at, accept, on_sent=on_cached_sent):
+                return True
+
+        # 只有整本发送才记录 file_id（begin_album 会把缓存标记为未完成）
+        record_version = version if selection.is_full else None
+        if record_version is not None:
+            file_id_cache.begin_album(album_id, record_version)
+
+        def on_uploaded(page: PageRef, file_id: str):
+            if record_version is not None:
+                file_id_cache.put_page(album_id, page.photo_id, page.photo_index, page.page_index, page.part, file_id)
+
+        if archive_mode:
+            # ZIP/CBZ：页面边下载边写入分卷（临时文件），写满一卷发送一次；恢复的任务接着之前的分卷编号
+            uploader = ArchiveUploader(
+                chat,
+                album_id,
+                max_bytes=TelegramConfig.MAX_FILE_SIZE_MB * 1024 * 1024,
+                suffix=TelegramConfig.ARCHIVE_SUFFIX,
+                on_sent=on_sent,
+                first_volume=job_journal.sent_volumes(job_id) + 1,
+                on_volume_sent=lambda index: job_journal.mark_volume(job_id, index),
+                temp_dir=TelegramConfig.TEMP_DIR
+            )
+        else:
+            # 图片组上传：每攒满一组就发送一次 send_media_group
+            uploader = MediaGroupUploader(
+                chat,
+                album_id,
+                batch_size=TelegramConfig.MEDIA_GROUP_SIZE,
+                on_uploaded=on_uploaded,
+                on_sent=on_sent,
+                concurrency=TelegramConfig.UPLOAD_CONCURRENCY
+            )
+        # 编号接着重启前的进度，完成时 sent_count 也是整本的页数
+        uploader.sent_count = len(delivered)
+
+        # 下载、预处理、上传同时进行；文件没有图片尺寸限制，不需要预处理
+        preprocess = TelegramConfig.AUTO_COMPRESS and not archive_mode
+        pipeline = DeliveryPipeline(
+            uploader,
+            prepare=image_preprocessor.prepare if preprocess else None,
+            skip=delivered,
+            decode_ahead=TelegramConfig.DECODE_AHEAD_PAGES
+        )
 
-            except Exception as e:
-                logger.error(f"发送图片失败: {e}", exc_info=True)
+        # 图片回调：每下载一张就交给流水线，上传跟不上时在这里等待
+        async def image_callback(page: PageRef):
+            logger.info(f"加入发送队列: {page.path.name}")
+            await pipeline.put(page)
 
         # 进度回调
         async def progress_callback(current, total):
+            progress = f"{current}/{total}" if total > 0 else f"{current}"
             try:
                 await downloading_msg.edit_text(
                     f"📥 下载并发送中: {album_id}\n"
-                    f"📤 已发送: {current} 张\n"
+                    f"📤 已发送: {progress} 张\n"
                     f"⏱️ 实时流式传输..."
                 )
             except:
                 pass
 
-        # 流式下载和发送
+        # 流式下载和发送（其他会话正在下载同一本子时共享那次下载）
+        # 开启自动清理时，由最后一个接收完的会话删除下载目录
         logger.info(f"开始流式下载漫画 {album_id}")
-        download_dir = await jm_api.download_with_streaming(
-            album_id,
-            image_callback=image_callback,
-            progress_callback=progress_callback
-        )
+        try:
+            download_dir = await jm_api.download_with_streaming(
+                album_id,
+                image_callback=image_callback,
+                progress_callback=progress_callback,
+                # 等流水线中的页面发送完，再发送最后一组不足 batch_size 的图片 / 最后一个分卷
+                complete_callback=pipeline.close,
+                cleanup=TelegramConfig.AUTO_CLEANUP,
+                selection=selection
+            )
+        finally:
+            pipeline.cancel()
+        sent_count = uploader.sent_count
+        if uploader.first_sent_at is not None:
+            TIME_TO_FIRST_IMAGE.observe(uploader.first_sent_at - started_at)
+
+        if sent_count == 0 and not selection.is_full:
+            await downloading_msg.edit_text(
+                f"❌ 所选范围内没有图片\n\n"
+                f"漫画 ID: {describe_download(album_id, selection)}"
+            )
+            return False
 
         if not download_dir:
             logger.error(f"下载失败: {album_id}")
@@ -353,31 +683,212 @@ async def handle_download(update: Update, album_id: str):
                 f"漫画 ID: {album_id}\n"
                 "请检查 ID 是否正确"
             )
-            return
+            return False
 
         logger.info(f"下载完成，目录: {download_dir}，已发送 {sent_count} 张图片")
 
+        # 全部发送成功才标记缓存完整，之后的请求可以直接转发
+        if record_version is not None and uploader.failed_count == 0:
+            file_id_cache.mark_complete(album_id, sent_count)
+
         # 删除进度消息
         try:
             await downloading_msg.delete()
         except:
             pass
 
-        # 清理下载目录
-        if TelegramConfig.AUTO_CLEANUP:
-            try:
-                shutil.rmtree(download_dir, ignore_errors=True)
-                logger.info(f"已清理下载目录")
-            except Exception as e:
-                logger.warning(f"清理下载目录失败: {e}")
-
         logger.info(f"成功完成整个流程: {album_id} (共 {sent_count} 张图片)")
+        return True
 
     except Exception as e:
         logger.error(f"下载错误: {e}", exc_info=True)
         await downloading_msg.edit_text(
             f"❌ 下载失败: {str(e)}"
         )
+        return False
+
+
+async def send_cached_album(chat: Chat, album_id: str, version: str, downloading_msg, started_at: float,
+                            accept=None, on_sent=None) -> bool:
+    """用缓存的 file_id 转发整本漫画，accept 不为 None 时只转发选中的页面
+
+    on_sent 在每组页面转发成功后调用，有页面转发失败时调用方据此只重新发送其余页面。
+
+    Returns:
+        是否命中缓存并发送完成
+    """
+    cached_pages = file_id_cache.get_album(album_id, version)
+    if cached_pages and accept is not None:
+        cached_pages = [page for page in cached_pages if accept(page[0], page[1], page[2])]
+    if not cached_pages:
+        return False
+
+    logger.info(f"命中 file_id 缓存: {album_id} (共 {len(cached_pages)} 张图片)")
+    uploader = MediaGroupUploader(
+        chat,
+        album_id,
+        batch_size=TelegramConfig.MEDIA_GROUP_SIZE,
+        on_sent=on_sent
+    )
+    for photo_id, photo_index, page_index, part, file_id in cached_pages:
+        await uploader.add(PageRef(photo_id, photo_index, page_index, file_id=file_id, part=part))
+    await uploader.flush()
+
+    # file_id 失效（例如 Bot Token 更换）时退回正常下载流程
+    if uploader.failed_count > 0:
+        logger.warning(f"file_id 缓存发送失败 {uploader.failed_count} 张，重新下载其余页面: {album_id}")
+        return False
+
+    TIME_TO_FIRST_IMAGE.observe(uploader.first_sent_at - started_at)
+
+    try:
+        await downloading_msg.delete()
+    except:
+        pass
+    return True
+
+
+@authorized_only
+async def preview_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """处理 /preview 命令"""
+    if not context.args:
+        await update.message.reply_text(
+            "❌ 请提供漫画 ID\n\n"
+            "示例: /preview 1222345"
+        )
+        return
+
+    await enqueue_preview(update, context, context.args[0])
+
+
+async def enqueue_preview(update: Update, context: ContextTypes.DEFAULT_TYPE, album_id: str):
+    """发送预览：只有几页，不进入下载队列，也不计入下载次数
+
+    预览在后台任务中生成，处理器立即返回，不阻塞其他用户的更新
+    """
+    chat = update.effective_chat
+    message = update.callback_query.message if update.callback_query else update.message
+    prefetcher.cancel(update.effective_user.id, keep=album_id)
+
+    pending_key = (chat.id, album_id)
+    if pending_key in pending_previews:
+        await message.reply_text(f"⏳ ID: {album_id} 的预览正在生成，请稍候")
+        return
+
+    pending_previews.add(pending_key)
+    context.application.create_task(run_preview(chat, album_id, pending_key), update=update)
+
+
+async def run_preview(chat: Chat, album_id: str, pending_key: tuple):
+    try:
+        await send_preview(chat, album_id)
+    finally:
+        pending_previews.discard(pending_key)
+
+
+async def send_preview(chat: Chat, album_id: str) -> bool:
+    """把第一章的前 PREVIEW_IMAGE_COUNT 页作为一个图片组发送，之后附带下载全部的按钮
+
+    SEND_THUMBNAIL 时封面作为图片组的第一张。预览下载的页面留在下载目录（磁盘缓存）中，
+    之后下载整本时不再重复下载。
+
+    Returns:
+        是否发送成功
+    """
+    started_at = time.monotonic()
+    preview_msg = await chat.send_message(f"👀 正在生成预览 ID: {album_id}")
+
+    try:
+        album = await jm_api.get_album_detail(album_id)
+        if album is None or not album.episode_list:
+            await preview_msg.edit_text(
+                f"❌ 预览失败\n\n"
+                f"漫画 ID: {album_id}\n"
+                "请检查 ID 是否正确"
+            )
+            return False
+
+        # 封面和页面同时下载；一个图片组最多 10 张
+        cover_task = None
+        if TelegramConfig.SEND_THUMBNAIL:
+            cover_task = asyncio.ensure_future(jm_api.get_cover(album_id, size=''))
+        count = max(1, min(TelegramConfig.PREVIEW_IMAGE_COUNT, MEDIA_GROUP_MAX - (1 if cover_task else 0)))
+        selection = DownloadSelection(chapter=1, last_page=count)
+
+        # 整本已经发送过时直接用缓存的 file_id
+        cached_pages = file_id_cache.get_album(album_id, album_version(album)) or []
+        accept = selection.page_filter(album)
+        pages = [
+            PageRef(photo_id, photo_index, page_index, file_id=file_id, part=part)
+            for photo_id, photo_index, page_index, part, file_id in cached_pages
+            if accept(photo_id, photo_index, page_index)
+        ]
+
+        uploader = MediaGroupUploader(
+            chat,
+            album_id,
+            batch_size=MEDIA_GROUP_MAX,
+            caption=f"👀 预览: {album.title}\n📖 漫画 ID: {album_id}"
+        )
+
+        async def send_group():
+            if not pages:
+                return
+            cover = None
+            if cover_task is not None:
+                try:
+                    cover = await asyncio.wait_for(asyncio.shield(cover_task), PREVIEW_COVER_WAIT)
+                except asyncio.TimeoutError:
+                    logger.info(f"封面下载较慢，预览不带封面: {album_id}")
+            if cover is not None:
+                await uploader.add(PageRef(album_id, 0, 0, path=cover))
+            # 多线程下载时页面按完成顺序到达
+            pages.sort(key=lambda page: (page.photo_index, page.page_index, page.part))
+            for page in pages[:MEDIA_GROUP_MAX - len(uploader.pending)]:
+                await uploader.add(page)
+            await uploader.flush()
+
+        if pages:
+            await send_group()
+        else:
+            async def image_callback(page: PageRef):
+                pages.extend(await image_preprocessor.prepare(page) if TelegramConfig.AUTO_COMPRESS else [page])
+
+            # 在 complete_callback 中发送：未启用磁盘缓存时，下载目录在回调之后就会被删除
+            await jm_api.download_with_streaming(
+                album_id,
+                image_callback=image_callback,
+                complete_callback=send_group,
+                cleanup=TelegramConfig.AUTO_CLEANUP,
+                selection=selection,
+                preview=True,
+                # 共享正在进行的整本下载时，前 count 页到齐就发送，不等整本下载完
+                limit=count
+            )
+
+        if not pages:
+            await preview_msg.edit_text(f"❌ 预览失败\n\n漫画 ID: {album_id}")
+            return False
+        if uploader.sent_count == 0:
+            await preview_msg.edit_text(f"❌ 预览发送失败\n\n漫画 ID: {album_id}")
+            return False
+        logger.info(f"预览发送完成: {album_id}，用时 {time.monotonic() - started_at:.1f}s")
+
+        keyboard = [[InlineKeyboardButton("📥 下载全部", callback_data=f"download_{album_id}")]]
+        if len(album.episode_list) > 1:
+            keyboard.append([
+                InlineKeyboardButton(f"📑 选择章节 (共 {len(album.episode_list)} 章)", callback_data=f"chapters_{album_id}_0")
+            ])
+        await preview_msg.edit_text(
+            f"👀 以上为 ID: {album_id} 的前 {len(pages)} 页预览",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return True
+
+    except Exception as e:
+        logger.error(f"预览错误: {e}", exc_info=True)
+        await preview_msg.edit_text(f"❌ 预览失败: {str(e)}")
+        return False
 
 
 @authorized_only
@@ -392,6 +903,7 @@ async def info_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     album_id = context.args[0]
+    prefetcher.cancel(update.effective_user.id, keep=album_id)
 
     # 发送查询中消息
     info_msg = await update.message.reply_text(
@@ -426,10 +938,15 @@ async def info_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         info_text += f"\n更新: {info['update_date']}"
 
-        # 添加下载按钮
+        # 添加下载按钮，多章节的本子可以只下载其中一章
         keyboard = [[
-            InlineKeyboardButton("📥 下载 PDF", callback_data=f"download_{album_id}")
+            InlineKeyboardButton("📥 下载 PDF", callback_data=f"download_{album_id}"),
+            InlineKeyboardButton("👀 预览", callback_data=f"preview_{album_id}")
         ]]
+        if info.get('chapter_count', 0) > 1:
+            keyboard.append([
+                InlineKeyboardButton(f"📑 选择章节 (共 {info['chapter_count']} 章)", callback_data=f"chapters_{album_id}_0")
+            ])
         reply_markup = InlineKeyboardMarkup(keyboard)
 
         await info_msg.edit_text(
@@ -452,8 +969,93 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     data = query.data
 
     if data.startswith("download_"):
-        album_id = data.replace("download_", "")
-        await handle_download(update, album_id)
+        # download_<ID> 或 download_<ID>_<章节>
+        album_id, _, chapter = data.replace("download_", "").partition("_")
+        await enqueue_download(update, album_id, DownloadSelection(chapter=int(chapter)) if chapter else DownloadSelection())
+
+    elif data.startswith("preview_"):
+        await enqueue_preview(update, context, data.replace("preview_", ""))
+
+    elif data.startswith("chapters_"):
+        album_id, _, offset = data.replace("chapters_", "").partition("_")
+        await show_chapters(query, album_id, int(offset or 0))
+
+
+async def show_chapters(query, album_id: str, offset: int):
+    """把消息的按钮换成章节列表（每页 CHAPTERS_PER_PAGE 个），点击后只下载该章节"""
+    album = await jm_api.get_album_detail(album_id)
+    if album is None:
+        await query.message.reply_text(f"❌ 获取章节失败\n\n漫画 ID: {album_id}")
+        return
+
+    episodes = album.episode_list[offset:offset + CHAPTERS_PER_PAGE]
+    keyboard = [
+        [InlineKeyboardButton(f"{index}. {episode[2][:30] or f'第 {index} 章'}",
+                              callback_data=f"download_{album_id}_{index}")]
+        for index, episode in enumerate(episodes, offset + 1)
+    ]
+    pager = []
+    if offset > 0:
+        pager.append(InlineKeyboardButton("⬅️ 上一页", callback_data=f"chapters_{album_id}_{max(0, offset - CHAPTERS_PER_PAGE)}"))
+    if offset + CHAPTERS_PER_PAGE < len(album.episode_list):
+        pager.append(InlineKeyboardButton("➡️ 下一页", callback_data=f"chapters_{album_id}_{offset + CHAPTERS_PER_PAGE}"))
+    if pager:
+        keyboard.append(pager)
+    keyboard.append([InlineKeyboardButton("📥 下载全部章节", callback_data=f"download_{album_id}")])
+
+    try:
+        await query.edit_message_reply_markup(InlineKeyboardMarkup(keyboard))
+    except Exception as e:
+        logger.warning(f"显示章节列表失败: {e}")
+
+
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """处理 inline 查询 (@bot 关键词)
+
+    先查本地索引，结果足够时立即返回；不够时等用户停止输入后再请求禁漫，
+    输入过程中的每次按键不会触发请求。
+    """
+    query = update.inline_query
+    user_id = query.from_user.id
+    keyword = query.query.strip()
+
+    if not keyword or (TelegramConfig.ALLOWED_USERS and user_id not in TelegramConfig.ALLOWED_USERS):
+        await query.answer([], cache_time=TelegramConfig.INLINE_CACHE_TIME, is_personal=True)
+        return
+
+    generation = inline_generations.get(user_id, 0) + 1
+    inline_generations[user_id] = generation
+
+    limit = TelegramConfig.INLINE_RESULT_LIMIT
+    results = jm_api.search_local(keyword, limit)
+
+    if len(results) < TelegramConfig.INLINE_MIN_LOCAL_RESULTS:
+        await asyncio.sleep(TelegramConfig.INLINE_DEBOUNCE)
+        if inline_generations.get(user_id) != generation:
+            # 用户还在输入，这次查询不再回答
+            return
+
+        # 已缓存的搜索不访问禁漫，不计入搜索次数
+        if jm_api.search_cache.peek(keyword) or search_limiter.acquire(user_id) == 0:
+            seen = {comic['id'] for comic in results}
+            results += [comic for comic in await jm_api.search(keyword, limit) if comic['id'] not in seen]
+
+    if inline_generations.get(user_id) == generation:
+        del inline_generations[user_id]
+
+    articles = [
+        InlineQueryResultArticle(
+            id=comic['id'],
+            title=comic['title'][:100],
+            description=f"ID: {comic['id']}  ✍️ {comic['author'] or 'Unknown'}"
+                        + (f"\n🏷️ {', '.join(comic['tags'][:5])}" if comic.get('tags') else ""),
+            input_message_content=InputTextMessageContent(f"/download {comic['id']}"),
+            thumbnail_url=jm_api.cover_url(comic['id'])
+        )
+        for comic in results[:limit]
+    ]
+    # 结果与用户有关（授权、搜索限流），不能让 Telegram 把一个用户的结果缓存给所有人
+    await query.answer(articles, cache_time=TelegramConfig.INLINE_CACHE_TIME, is_personal=True)
 
 
 async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -464,60 +1066,152 @@ async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
-def main():
-    """主函数"""
-    try:
-        # 启动健康检查服务器（后台线程）
-        start_healthcheck_server(port=8080)
+def collect_stats() -> dict:
+    """/stats 和 /metrics 的统计信息"""
+    return {
+        'lanes': jm_api.lane_stats(),
+        'caches': jm_api.cache_stats(),
+        'album_cache': jm_api.disk_cache.stats() if jm_api.disk_cache else None,
+        'covers': jm_api.covers.stats(),
+        'album_index': len(jm_api.index) if jm_api.index is not None else 0,
+        'memory': memory_governor.stats(),
+        'jobs': job_journal.stats(),
+        'prefetch': prefetcher.stats(),
+        'download_workers': download_workers.stats() if download_workers is not None else None,
+        'fetch_wait_seconds': jm_api.fetch_wait_seconds,
+    }
+
+
+async def on_startup(application: Application):
+    """事件循环启动后执行：启动内存采样和 HTTP 服务器（webhook 模式下同时接收更新），恢复未完成的下载"""
+    memory_governor.start()
+    await resume_jobs(application)
+
+    async def on_update(data: dict):
+        await application.update_queue.put(Update.de_json(data, application.bot))
+
+    application.bot_data['http_server'] = await start_healthcheck_server(
+        port=TelegramConfig.HTTP_PORT,
+        stats_provider=collect_stats,
+        metrics_provider=REGISTRY.render,
+        webhook_path=TelegramConfig.WEBHOOK_PATH if TelegramConfig.WEBHOOK_URL else None,
+        webhook_secret=TelegramConfig.WEBHOOK_SECRET,
+        on_update=on_update
+    )
 
-        # 验证配置
-        TelegramConfig.validate()
 
-        logger.info("启动 JMComic Telegram Bot...")
-        logger.info(f"Bot: @Jm6271_bot")
+async def on_shutdown(application: Application):
+    """Application 停止时执行"""
+    server = application.bot_data.pop('http_server', None)
+    if server is not None:
+        await server.stop()
+    await memory_governor.stop()
+
 
-        # 创建应用
-        application = Application.builder().token(TelegramConfig.TELEGRAM_TOKEN).build()
+async def run_webhook(application: Application):
+    """webhook 模式：Telegram 直接把更新 POST 到本机的 HTTP 服务器，不再长轮询"""
+    await application.initialize()
+    await on_startup(application)
+    if application.bot_data.get('http_server') is None:
+        raise RuntimeError(f"HTTP 服务器无法监听端口 {TelegramConfig.HTTP_PORT}")
+    await application.start()
 
-        # 创建对话处理器
-        conv_handler = ConversationHandler(
-            entry_points=[
-                CommandHandler("start", start_command),
-                CommandHandler("help", help_command),
+    webhook_url = TelegramConfig.WEBHOOK_URL.rstrip('/') + TelegramConfig.WEBHOOK_PATH
+    await application.bot.set_webhook(
+        url=webhook_url,
+        secret_token=TelegramConfig.WEBHOOK_SECRET,
+        allowed_updates=Update.ALL_TYPES
+    )
+    logger.info(f"机器人已启动，webhook: {webhook_url}")
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    try:
+        await stop_event.wait()
+    finally:
+        await on_shutdown(application)
+        await application.stop()
+        await application.shutdown()
+
+
+def build_application() -> Application:
+    """创建 Application 并注册所有处理器"""
+    # 创建应用
+    builder = (
+        Application.builder()
+        .token(TelegramConfig.TELEGRAM_TOKEN)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if TelegramConfig.BOT_API_URL:
+        # 自建的 Bot API 服务器（或基准测试中的假服务器）
+        api_url = TelegramConfig.BOT_API_URL.rstrip('/')
+        builder = builder.base_url(f"{api_url}/bot").base_file_url(f"{api_url}/file/bot")
+    application = builder.build()
+
+    # 创建对话处理器
+    conv_handler = ConversationHandler(
+        entry_points=[
+            CommandHandler("start", start_command),
+            CommandHandler("help", help_command),
+            MessageHandler(filters.Regex("^(🔍 搜索漫画|📥 下载漫画|ℹ️ 查看信息|❓ 帮助)$"), handle_menu_selection),
+        ],
+        states={
+            SELECTING_ACTION: [
                 MessageHandler(filters.Regex("^(🔍 搜索漫画|📥 下载漫画|ℹ️ 查看信息|❓ 帮助)$"), handle_menu_selection),
+                CommandHandler("search", search_command),
+                CommandHandler("download", download_command),
+                CommandHandler("preview", preview_command),
+                CommandHandler("info", info_command),
+                CommandHandler("cancel", cancel_command),
             ],
-            states={
-                SELECTING_ACTION: [
-                    MessageHandler(filters.Regex("^(🔍 搜索漫画|📥 下载漫画|ℹ️ 查看信息|❓ 帮助)$"), handle_menu_selection),
-                    CommandHandler("search", search_command),
-                    CommandHandler("download", download_command),
-                    CommandHandler("info", info_command),
-                    CommandHandler("cancel", cancel_command),
-                ],
-                WAITING_INPUT: [
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, handle_user_input),
-                    CommandHandler("cancel", cancel_command),
-                ],
-            },
-            fallbacks=[
+            WAITING_INPUT: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_user_input),
                 CommandHandler("cancel", cancel_command),
-                CommandHandler("start", start_command),
             ],
-            allow_reentry=True,
-        )
+        },
+        fallbacks=[
+            CommandHandler("cancel", cancel_command),
+            CommandHandler("start", start_command),
+        ],
+        allow_reentry=True,
+    )
+
+    # 注册对话处理器
+    application.add_handler(conv_handler)
+
+    # 注册按钮回调处理器
+    application.add_handler(CallbackQueryHandler(button_callback))
 
-        # 注册对话处理器
-        application.add_handler(conv_handler)
+    # 注册 inline 查询处理器（不阻塞其他更新，防抖等待期间可以处理下一次输入）
+    application.add_handler(InlineQueryHandler(inline_query, block=False))
 
-        # 注册按钮回调处理器
-        application.add_handler(CallbackQueryHandler(button_callback))
+    # 注册未知命令处理器
+    application.add_handler(MessageHandler(filters.COMMAND, unknown_command))
+
+    return application
+
+
+def main():
+    """主函数"""
+    try:
+        # 验证配置
+        TelegramConfig.validate()
+
+        logger.info("启动 JMComic Telegram Bot...")
+        logger.info(f"Bot: @Jm6271_bot")
 
-        # 注册未知命令处理器
-        application.add_handler(MessageHandler(filters.COMMAND, unknown_command))
+        application = build_application()
 
-        # 启动机器人
-        logger.info("机器人已启动，正在监听消息...")
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        # 启动机器人：配置了 WEBHOOK_URL 时使用 webhook，否则长轮询
+        if TelegramConfig.WEBHOOK_URL:
+            asyncio.run(run_webhook(application))
+        else:
+            logger.info("机器人已启动，正在监听消息...")
+            application.run_polling(allowed_updates=Update.ALL_TYPES)
 
     except ValueError as e:
         print(f"\n❌ 配置错误:\n{e}\n")
@@ -525,6 +1219,9 @@ def main():
         logger.error(f"启动失败: {e}", exc_info=True)
     finally:
         jm_api.cleanup()
+        image_preprocessor.shutdown()
+        if download_workers is not None:
+            download_workers.shutdown()
 
 
 if __name__ == "__main__":
@@ -4,6 +4,7 @@
 Telegram Bot 配置文件
 """
 import os
+import secrets
 from pathlib import Path
 
 class TelegramConfig:
@@ -14,6 +15,21 @@ class TelegramConfig:
     # 优先使用环境变量，如果没有则使用硬编码的值（本地开发）
     TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN", "8226987850:AAE-RYMD84QgFnlFKH7t7W5nvz_w4ytiNoc")
 
+    # Bot API 地址 (例如自建的 telegram-bot-api 服务器 http://localhost:8081)，为空时使用 api.telegram.org
+    BOT_API_URL = os.getenv("BOT_API_URL", "")
+
+    # webhook 模式：公网可访问的地址 (例如 https://xxx.up.railway.app)，为空时使用长轮询
+    WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+
+    # 接收 Telegram 更新的路径
+    WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+
+    # webhook 请求头中的 secret_token，未设置时每次启动随机生成
+    WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+
+    # HTTP 服务器端口（健康检查、/metrics、webhook 共用），Railway 通过 PORT 指定
+    HTTP_PORT = int(os.getenv("PORT", "8080"))
+
     # 授权用户的 Telegram ID 列表
     # 获取方式：发送消息给 @userinfobot
     # 空列表 = 允许所有用户使用（公开模式）
@@ -26,26 +42,93 @@ class TelegramConfig:
     # 临时文件目录
     TEMP_DIR = Path(__file__).parent / "temp"
 
+    # file_id 缓存数据库（记录已上传页面的 Telegram file_id）
+    FILE_ID_CACHE_DB = TEMP_DIR / "file_id_cache.db"
+
+    # 下载任务日志数据库（重启后恢复未完成的下载）
+    JOB_JOURNAL_DB = TEMP_DIR / "jobs.db"
+
+    # 同一个任务最多尝试的次数（每次重启恢复算一次），超过后不再恢复
+    JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
     # 默认下载格式 (pdf, zip, images)
-    DEFAULT_FORMAT = "pdf"
+    # zip: 页面写入 ZIP/CBZ（不压缩）作为文件发送，超过 MAX_FILE_SIZE_MB 自动切分为分卷；其他值逐张发送图片
+    DEFAULT_FORMAT = os.getenv("DEFAULT_FORMAT", "pdf")
+
+    # zip 模式的文件扩展名 (zip, cbz)
+    ARCHIVE_SUFFIX = os.getenv("ARCHIVE_SUFFIX", "cbz")
 
     # 是否自动清理临时文件
     AUTO_CLEANUP = True
 
+    # 下载目录作为磁盘缓存的大小上限 (MB)，完整下载过的本子再次请求时不重新下载；
+    # 0 表示不缓存，按 AUTO_CLEANUP 在发送后删除
+    ALBUM_CACHE_MAX_MB = int(os.getenv("ALBUM_CACHE_MAX_MB", "1024"))
+
     # ============ 文件限制 ============
     # 最大文件大小 (MB) - Telegram 普通 Bot 限制 50MB
     MAX_FILE_SIZE_MB = 50
 
-    # 如果文件超过限制，是否自动压缩
+    # 每个图片组的图片数量 (1-10)，Telegram 单个图片组最多 10 张
+    MEDIA_GROUP_SIZE = int(os.getenv("MEDIA_GROUP_SIZE", "10"))
+
+    # 如果文件超过限制，是否自动压缩（图片超出 Telegram 限制时缩放、切分后再发送）
     AUTO_COMPRESS = True
 
     # 压缩质量 (1-100)
     COMPRESS_QUALITY = 85
 
+    # 图片预处理（缩放/切分超出 Telegram 限制的页面）进程数
+    PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", "1"))
+
+    # ============ 发送流水线 ============
+    # 下载最多领先最慢的发送方多少页，超出时暂停下载；0 表示不限制
+    FETCH_AHEAD_PAGES = int(os.getenv("FETCH_AHEAD_PAGES", "30"))
+
+    # 预处理中和等待上传的页面数上限（每个会话）
+    DECODE_AHEAD_PAGES = int(os.getenv("DECODE_AHEAD_PAGES", "20"))
+
+    # 每个会话同时发送的图片组数；1 保证图片组按顺序显示，大于 1 时相邻的组可能乱序
+    UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "1"))
+
+    # 图片按页面顺序下载（第 1 页最先开始），而不是各章节的线程同时随机完成
+    PAGE_ORDER_DOWNLOAD = os.getenv("PAGE_ORDER_DOWNLOAD", "true").lower() in ("1", "true", "yes")
+
+    # 页面按顺序交出前最多缓冲的页数，超出时不再等待前面较慢的页面；0 表示按完成顺序交出
+    REORDER_WINDOW_PAGES = int(os.getenv("REORDER_WINDOW_PAGES", "16"))
+
     # ============ 并发限制 ============
     # 最大同时下载数
     MAX_CONCURRENT_DOWNLOADS = 3
 
+    # 元数据请求（搜索、详情）通道线程数，与下载通道互不阻塞
+    FAST_LANE_WORKERS = int(os.getenv("FAST_LANE_WORKERS", "2"))
+
+    # 下载和 PDF 生成通道线程数
+    DOWNLOAD_LANE_WORKERS = int(os.getenv("DOWNLOAD_LANE_WORKERS", str(MAX_CONCURRENT_DOWNLOADS)))
+
+    # ============ 内存预算 ============
+    # 进程内存预算 (MB)，超出时降低下载并发、暂缓新任务；0 表示不限制
+    MEMORY_BUDGET_MB = int(os.getenv("MEMORY_BUDGET_MB", "400"))
+
+    # 单个章节同时下载的图片数上限
+    # （每个下载线程同时解码一张图片；发送速度受上传限制，更高的并发只增加内存占用）
+    MAX_IMAGE_THREADS = int(os.getenv("MAX_IMAGE_THREADS", "4"))
+
+    # 同时下载的章节数上限
+    MAX_PHOTO_THREADS = int(os.getenv("MAX_PHOTO_THREADS", "1"))
+
+    # ============ 下载工作进程 ============
+    # 下载工作进程数，大于 0 时本子下载在独立进程中执行，内存泄漏或崩溃不影响机器人进程；
+    # 0 表示在机器人进程的下载通道线程中下载
+    DOWNLOAD_PROCESSES = int(os.getenv("DOWNLOAD_PROCESSES", "0"))
+
+    # 每个工作进程执行的任务数上限，达到后换新进程；0 表示不限制
+    WORKER_MAX_JOBS = int(os.getenv("WORKER_MAX_JOBS", "20"))
+
+    # 任务结束后工作进程常驻内存超过此值 (MB) 时换新进程；0 表示不限制
+    WORKER_MAX_RSS_MB = int(os.getenv("WORKER_MAX_RSS_MB", "300"))
+
     # ============ 速率限制 ============
     # 每个用户每小时最多下载次数
     MAX_DOWNLOADS_PER_HOUR = 10
@@ -63,12 +146,52 @@ class TelegramConfig:
     # 下载超时时间 (秒)
     DOWNLOAD_TIMEOUT = 600
 
+    # 搜索结果 / 本子详情缓存条数 (LRU)
+    METADATA_CACHE_SIZE = int(os.getenv("METADATA_CACHE_SIZE", "256"))
+
+    # 缓存保持新鲜的秒数，过期后先返回旧结果、后台刷新
+    METADATA_CACHE_TTL = int(os.getenv("METADATA_CACHE_TTL", "300"))
+
+    # 过期缓存最长可用秒数，超过后必须重新请求
+    METADATA_CACHE_MAX_STALE = int(os.getenv("METADATA_CACHE_MAX_STALE", "3600"))
+
+    # 搜索结果显示后预取前几个结果的本子详情，0 表示不预取
+    PREFETCH_COUNT = int(os.getenv("PREFETCH_COUNT", "5"))
+
+    # 预取时同时下载封面
+    PREFETCH_COVERS = os.getenv("PREFETCH_COVERS", "false").lower() in ("1", "true", "yes")
+
+    # 搜索结果附带一张封面拼图
+    SEARCH_COVER_SHEET = os.getenv("SEARCH_COVER_SHEET", "true").lower() in ("1", "true", "yes")
+
+    # 封面缩略图缓存大小上限 (MB)
+    COVER_CACHE_MAX_MB = int(os.getenv("COVER_CACHE_MAX_MB", "50"))
+
+    # 封面并发下载线程数
+    COVER_WORKERS = int(os.getenv("COVER_WORKERS", "4"))
+
+    # ============ Inline 查询 ============
+    # 本地本子索引数据库（搜索结果、本子详情中见过的标题/作者/标签）
+    ALBUM_INDEX_DB = TEMP_DIR / "album_index.db"
+
+    # 本地结果少于该数量时才请求禁漫
+    INLINE_MIN_LOCAL_RESULTS = int(os.getenv("INLINE_MIN_LOCAL_RESULTS", "5"))
+
+    # 请求禁漫前等待用户停止输入的秒数，期间有新的输入则放弃这次请求
+    INLINE_DEBOUNCE = float(os.getenv("INLINE_DEBOUNCE", "0.8"))
+
+    # 每次 inline 查询返回的结果数上限 (Telegram 最多 50)
+    INLINE_RESULT_LIMIT = 20
+
+    # Telegram 端缓存 inline 结果的秒数（按用户分别缓存）
+    INLINE_CACHE_TIME = 300
+
     # ============ 预览配置 ============
-    # 预览图片数量
-    PREVIEW_IMAGE_COUNT = 5
+    # 预览图片数量（/preview 发送第一章的前几页，与封面合计最多 10 张）
+    PREVIEW_IMAGE_COUNT = int(os.getenv("PREVIEW_IMAGE_COUNT", "5"))
 
-    # 是否发送预览缩略图
-    SEND_THUMBNAIL = True
+    # 是否发送预览缩略图（封面作为预览图片组的第一张）
+    SEND_THUMBNAIL = os.getenv("SEND_THUMBNAIL", "true").lower() in ("1", "true", "yes")
 
     # ============ 其他配置 ============
     # 是否启用详细日志
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式 ZIP/CBZ 写入
+页面到达一张写入一张：
+- 分卷写入 SpooledTemporaryFile，超过 SPOOL_BYTES 后落到临时目录，内存中不保留整个分卷
+- 图片本身已经压缩过，条目使用 ZIP_STORED，不再 deflate；图片文件分块复制，不整张读入内存
+- 写入前估算分卷最终大小，超过上限时结束当前分卷，后续页面写入新的分卷
+每个分卷都是独立完整的 ZIP，可以单独打开
+"""
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+from typing import BinaryIO, Callable, NamedTuple, Optional
+
+# 分卷在内存中最多保留的字节数，超出后写入临时文件
+SPOOL_BYTES = 4 * 1024 * 1024
+
+# ZIP 格式的固定开销：本地文件头、中央目录项、中央目录结束记录
+_LOCAL_HEADER_SIZE = 30
+_CENTRAL_HEADER_SIZE = 46
+_END_RECORD_SIZE = 22
+
+
+class ZipVolume(NamedTuple):
+    """写完的一个分卷，file 已经定位到开头，用完由调用方关闭"""
+    index: int   # 分卷序号，从 first_index 开始
+    file: BinaryIO
+    size: int    # 字节数
+    pages: int   # 分卷中的页面数
+
+
+class StreamingZipWriter:
+    """按大小切分分卷的 ZIP 写入器
+
+    用法:
+        writer = StreamingZipWriter(max_bytes)
+        for name, path in pages:
+            volume = writer.add_file(name, path)
+            if volume is not None:
+                upload(volume.file)
+                volume.file.close()
+        volume = writer.finish()
+    """
+
+    def __init__(self, max_bytes: int, first_index: int = 1, temp_dir: Optional[Path] = None):
+        """初始化
+
+        Args:
+            max_bytes: 单个分卷的大小上限 (字节)，单个页面超过上限时独占一个分卷
+            first_index: 第一个分卷的序号（任务恢复时接着之前发送过的分卷编号）
+            temp_dir: 分卷临时文件所在目录，为 None 时使用系统临时目录
+        """
+        self.max_bytes = max_bytes
+        self.temp_dir = temp_dir
+        # 已经开始的分卷的序号
+        self.volume_count = first_index - 1
+
+        self._buffer: Optional[BinaryIO] = None
+        self._zip: Optional[zipfile.ZipFile] = None
+        self._pages = 0
+        self._central_size = 0
+
+    @property
+    def pending_pages(self) -> int:
+        """当前分卷中还没有输出的页面数"""
+        return self._pages
+
+    def add_file(self, name: str, path: Path) -> Optional[ZipVolume]:
+        """把一个图片文件写入 ZIP
+
+        Returns:
+            写入前当前分卷已满时，返回结束的那个分卷，否则返回 None
+        """
+        return self._add(name, Path(path).stat().st_size,
+                         lambda: self._zip.write(path, name, compress_type=zipfile.ZIP_STORED))
+
+    def add(self, name: str, data: bytes) -> Optional[ZipVolume]:
+        """写入一个条目，返回值同 add_file"""
+        def _write():
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            self._zip.writestr(info, data)
+
+        return self._add(name, len(data), _write)
+
+    def _add(self, name: str, data_size: int, write: Callable[[], None]) -> Optional[ZipVolume]:
+        entry_size = len(name.encode('utf-8')) * 2 + _LOCAL_HEADER_SIZE + _CENTRAL_HEADER_SIZE + data_size
+
+        finished = None
+        if self._zip is not None and self._pages > 0 and self._projected_size() + entry_size > self.max_bytes:
+            finished = self.finish()
+
+        if self._zip is None:
+            self._open_volume()
+
+        write()
+        self._pages += 1
+        self._central_size += _CENTRAL_HEADER_SIZE + len(name.encode('utf-8'))
+        return finished
+
+    def finish(self) -> Optional[ZipVolume]:
+        """结束当前分卷，没有页面时返回 None"""
+        if self._zip is None:
+            return None
+
+        self._zip.close()
+        volume = None
+        if self._pages:
+            size = self._buffer.tell()
+            self._buffer.seek(0)
+            volume = ZipVolume(self.volume_count, self._buffer, size, self._pages)
+        else:
+            self._buffer.close()
+        self._buffer = None
+        self._zip = None
+        self._pages = 0
+        self._central_size = 0
+        return volume
+
+    def close(self):
+        """放弃当前分卷，删除临时文件"""
+        if self._zip is not None:
+            # 先关闭 ZipFile，否则它被回收时会写入已经关闭的临时文件
+            self._zip.close()
+        if self._buffer is not None:
+            self._buffer.close()
+        self._buffer = None
+        self._zip = None
+        self._pages = 0
+        self._central_size = 0
+
+    def _open_volume(self):
+        self.volume_count += 1
+        self._buffer = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES, dir=self.temp_dir)
+        self._zip = zipfile.ZipFile(self._buffer, 'w', compression=zipfile.ZIP_STORED)
+
+    def _projected_size(self) -> int:
+        # 已写入的本地条目 + 关闭时才写出的中央目录和结束记录
+        return self._buffer.tell() + self._central_size + _END_RECORD_SIZE